@@ -0,0 +1,93 @@
+"""
+Micro-benchmark: shared output codec vs the two parsers it replaced.
+
+    python -m benchmarks.bench_output_codec [--entities 10 100 1000] [--repeat 200]
+"""
+import argparse
+import copy
+import random
+import string
+import timeit
+
+from src.utils.output_codec import apply_to_entities, parse_output
+
+ROLES = ("subject", "publisher", "author", "content_descriptor", "filter_time", "prediction_time", "context")
+
+
+def legacy_convert_results_to_dict(entities: dict, api_result: str) -> dict:
+    # prepare_data.convert_results_to_dict before the shared codec
+    result_dict = {}
+    for result in api_result.split("|"):
+        parts = result.split("-")
+        if len(parts) != 3:
+            continue
+        entity_id, role, confidence = parts
+        result_dict[entity_id] = {"role": role, "confidence": confidence}
+    seen_ids = []
+    all_ids = [k for k, _ in result_dict.items()]
+    for key in ("ner_enterprise", "ner_time", "ner_person"):
+        for item in entities[key]:
+            if item["id"] not in seen_ids and item["id"] in all_ids:
+                item["role"] = result_dict[item["id"]]["role"]
+                item["confidence"] = result_dict[item["id"]]["confidence"]
+                seen_ids.append(item["id"])
+    return entities
+
+
+def legacy_extract_roles_from_string(output: str) -> dict:
+    # llm_judge._extract_roles_from_string before the shared codec
+    roles = {}
+    for chunk in output.split("|"):
+        chunk = chunk.strip()
+        if not chunk:
+            continue
+        parts = chunk.split("-", 2)
+        if len(parts) < 2:
+            continue
+        if parts[0].strip() and parts[1].strip():
+            roles[parts[0].strip()] = parts[1].strip()
+    return roles
+
+
+def make_case(n_entities: int, seed: int = 0):
+    rng = random.Random(seed)
+    ids = set()
+    while len(ids) < n_entities:
+        ids.add("".join(rng.choices(string.ascii_uppercase + string.digits, k=4)))
+    ids = list(ids)
+    third = max(1, n_entities // 3)
+    entities = {
+        "current_date": "2026-01-01",
+        "ner_enterprise": [{"id": i, "name": f"企业{i}", "codes": []} for i in ids[:third]],
+        "ner_time": [{"id": i, "raw": f"时间{i}"} for i in ids[third:2 * third]],
+        "ner_person": [{"id": i, "name": f"人物{i}"} for i in ids[2 * third:]],
+    }
+    output = "|".join(f"{i}-{rng.choice(ROLES)}-{rng.randint(0, 10)}" for i in ids)
+    return entities, output
+
+
+def bench(label, fn, repeat):
+    seconds = min(timeit.repeat(fn, number=repeat, repeat=3)) / repeat
+    print(f"  {label:<34}{seconds * 1e6:>12.1f} us/op{1 / seconds:>14.0f} ops/s")
+    return seconds
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--entities", type=int, nargs="+", default=[3, 30, 300, 3000])
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    for n in args.entities:
+        entities, output = make_case(n)
+        print(f"entities={n}")
+        legacy = bench("legacy convert_results_to_dict", lambda: legacy_convert_results_to_dict(copy.deepcopy(entities), output), args.repeat)
+        shared = bench("codec parse + apply", lambda: apply_to_entities(copy.deepcopy(entities), parse_output(output)), args.repeat)
+        bench("deepcopy baseline", lambda: copy.deepcopy(entities), args.repeat)
+        bench("legacy _extract_roles_from_string", lambda: legacy_extract_roles_from_string(output), args.repeat)
+        bench("codec parse_output().roles()", lambda: parse_output(output).roles(), args.repeat)
+        print(f"  convert speedup: {legacy / shared:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
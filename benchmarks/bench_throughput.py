@@ -0,0 +1,281 @@
+"""
+Throughput of the real rollout / data-prep code against the local mock server.
+
+    python -m benchmarks.bench_throughput rollouts [--concurrency 8] [--rollouts 200] [--async]
+    python -m benchmarks.bench_throughput prepare [--questions 100]
+    python -m benchmarks.bench_throughput scaling [--runner-counts 1,2,4,8,16] [--async]
+
+The mock runs in a child process (see benchmarks.mock_server; its latency and
+failure options are accepted here too), so the CPU figures only cover this
+process: rendering, HTTP client, parsing and scoring. Response cache and score
+store are disabled and the rate limiter is off unless --rpm is given; set
+LLM_HEDGE=1 to benchmark hedged requests, and LLM_STREAM=0 with
+--explain-chars 200 to see what early-stopped streaming saves.
+
+`scaling` runs the real agentlightning Trainer (train.build_trainer: one shm
+runner thread, or runner processes behind the store server) once per runner
+count, with an algorithm that only enqueues --rollouts train-mode rollouts
+and waits for them, and prints throughput per setting; its CPU column
+includes the runner processes. Pass --rpm to see where the rate limit caps it.
+"""
+import argparse
+import asyncio
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.mock_server import ENTERPRISES, PERSONS, add_config_arguments
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_mock(args) -> subprocess.Popen:
+    port = _free_port()
+    command = [
+        sys.executable, "-m", "benchmarks.mock_server", "--port", str(port),
+        "--latency", args.latency, "--ner-latency", args.ner_latency,
+        "--error-rate", str(args.error_rate), "--rate-limit-rate", str(args.rate_limit_rate),
+        "--tokens-per-char", str(args.tokens_per_char), "--stream-interval", str(args.stream_interval),
+        "--explain-chars", str(args.explain_chars),
+        "--seed", str(args.seed),
+    ]
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+    deadline = time.time() + 10
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            process.url = f"http://127.0.0.1:{port}"
+            return process
+        except OSError:
+            time.sleep(0.05)
+    process.kill()
+    raise RuntimeError("mock server did not start")
+
+
+def configure_environment(args, url: str):
+    # settings.py reads these at import time, so set them before importing src.*
+    os.environ["LLM_CACHE_ENABLED"] = "0"
+    os.environ["SCORE_STORE_ENABLED"] = "0"
+    os.environ["LLM_RPM"] = str(args.rpm)
+    os.environ["LLM_LIMITER_PATH"] = os.path.join(tempfile.gettempdir(), f"bench_limiter_{os.getpid()}.bucket")
+    os.environ["NER_API_URL"] = f"{url}/ner_pred"
+    for prefix in ("LLM", "ROLLOUT", "OPTIMIZER"):
+        os.environ[f"{prefix}_BASE_URL"] = f"{url}/v1"
+        os.environ[f"{prefix}_API_KEY"] = "mock"
+
+
+def mock_stats(url: str) -> dict:
+    import httpx
+
+    return httpx.get(f"{url}/stats").json()
+
+
+def percentile(values, q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def report(label: str, count: int, wall: float, cpu: float, latencies=None, failures: int = 0):
+    print(f"{label}: {count} in {wall:.2f}s -> {count / wall:.1f}/s, CPU {cpu / max(1, count) * 1000:.2f} ms each"
+          + (f", {failures} failed" if failures else ""))
+    if latencies:
+        print(f"  latency p50 {percentile(latencies, 0.5) * 1000:.0f} ms, "
+              f"p99 {percentile(latencies, 0.99) * 1000:.0f} ms, max {max(latencies) * 1000:.0f} ms")
+
+
+def bench_rollouts(args, url: str):
+    from src.agents.entity_filter import entity_filter_agent, entity_filter_agent_async
+    from src.client.registry import client_registry
+    from src.client.resilience import resilient_caller
+    from src.client.single_flight import single_flight
+
+    prompt_template, tasks = _load_tasks(args, url)
+    latencies = []
+    failures = 0
+
+    if args.use_async:
+        rollout = entity_filter_agent_async._rollout_func
+
+        async def run_all():
+            nonlocal failures
+            semaphore = asyncio.Semaphore(args.concurrency)
+
+            async def one(task):
+                nonlocal failures
+                async with semaphore:
+                    started = time.perf_counter()
+                    try:
+                        await rollout(task, prompt_template, None)
+                    except Exception:
+                        failures += 1
+                    latencies.append(time.perf_counter() - started)
+
+            await asyncio.gather(*(one(task) for task in tasks))
+            await client_registry.aclose()
+
+        runner = lambda: asyncio.run(run_all())
+    else:
+        rollout = entity_filter_agent._rollout_func
+
+        def one(task):
+            nonlocal failures
+            started = time.perf_counter()
+            try:
+                rollout(task, prompt_template, None)
+            except Exception:
+                failures += 1
+            latencies.append(time.perf_counter() - started)
+
+        def runner():
+            with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+                list(executor.map(one, tasks))
+
+    wall, cpu = time.perf_counter(), time.process_time()
+    runner()
+    wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+    mode = "async" if args.use_async else "threads"
+    report(f"rollouts ({mode}, concurrency {args.concurrency})", len(tasks), wall, cpu, latencies, failures)
+    print(f"  LLM calls: {resilient_caller.stats()}, coalescing: {single_flight.stats()}")
+    print(f"  mock: {mock_stats(url)}")
+
+
+def bench_prepare(args, url: str):
+    from src.workflow.prepare_data import pipeline_with_gold
+
+    rng = random.Random(args.seed)
+    times = ("最近", "2025年", "今年", "2024年四季度", "去年")
+    questions = [
+        f"{rng.choice(ENTERPRISES)}{rng.choice(times)}的研报" + (f"，{rng.choice(PERSONS)}写的" if rng.random() < 0.3 else "")
+        for _ in range(args.questions)
+    ]
+    with tempfile.TemporaryDirectory() as directory:
+        output_path = os.path.join(directory, "bench.jsonl")
+        wall, cpu = time.perf_counter(), time.process_time()
+        pipeline_with_gold(questions, output_path, ner_workers=args.concurrency,
+                           generation_workers=args.concurrency, correction_workers=args.concurrency)
+        wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+        with open(output_path, encoding="utf-8") as file:
+            written = sum(1 for line in file if line.strip())
+    report(f"prepare_data pipeline_with_gold (concurrency {args.concurrency})", len(questions), wall, cpu,
+           failures=len(questions) - written)
+
+
+def _load_tasks(args, url: str):
+    import agentlightning as agl
+
+    from src.agents.task import EntityTask, RunContext
+    from src.utils.jsonl import JsonlDataset
+    from train import _normalize_sample, load_config
+
+    config = load_config(f"src/configs/nodes/{args.node}.yaml")
+    prompt_template = agl.PromptTemplate(template=config["prompt_template"], engine="f-string")
+    context = RunContext(config["goal"], config.get("eval_mode", "llm"), "mock", f"{url}/v1", "mock")
+    samples = JsonlDataset(f"src/datasets/{args.node}/{args.split}.jsonl", transform=_normalize_sample)
+    return prompt_template, [EntityTask.from_sample(samples[i % len(samples)], context) for i in range(args.rollouts)]
+
+
+def _cpu_seconds() -> float:
+    # This process plus its waited-for children (the runner processes), not the mock
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+def bench_scaling(args, url: str):
+    import agentlightning as agl
+
+    from src.agents.entity_filter import entity_filter_agent, entity_filter_agent_async
+    from train import build_trainer
+
+    class EnqueueRollouts(agl.Algorithm):
+        """Enqueues every task once and waits until all rollouts finished."""
+
+        def __init__(self, tasks, prompt_template):
+            super().__init__()
+            self.tasks = tasks
+            self.prompt_template = prompt_template
+            self.wall = 0.0
+            self.statuses = {}
+
+        async def run(self, train_dataset=None, val_dataset=None):
+            store = self.get_store()
+            resources = await store.update_resources("bench", {"prompt_template": self.prompt_template})
+            started = time.perf_counter()
+            rollout_ids = []
+            for task in self.tasks:
+                # train mode: no response cache, score store or request coalescing
+                rollout = await store.enqueue_rollout(input=task, mode="train", resources_id=resources.resources_id)
+                rollout_ids.append(rollout.rollout_id)
+            while True:
+                finished = await store.wait_for_rollouts(rollout_ids=rollout_ids, timeout=0.0)
+                if len(finished) >= len(rollout_ids):
+                    break
+                await asyncio.sleep(0.02)
+            self.wall = time.perf_counter() - started
+            for rollout in finished:
+                self.statuses[rollout.status] = self.statuses.get(rollout.status, 0) + 1
+
+    prompt_template, tasks = _load_tasks(args, url)
+    agent = entity_filter_agent_async if args.use_async else entity_filter_agent
+    rows = []
+    for n_runners in [int(n) for n in args.runner_counts.split(",")]:
+        # Runner processes get their inputs as JSON through the store server
+        algo = EnqueueRollouts([task.to_dict() for task in tasks] if n_runners > 1 else tasks, prompt_template)
+        trainer = build_trainer(algo, prompt_template, n_runners=n_runners, poll_interval=args.poll_interval,
+                                server_port=_free_port())
+        cpu = _cpu_seconds()
+        trainer.fit(agent=agent)
+        cpu = _cpu_seconds() - cpu
+        failed = sum(count for status, count in algo.statuses.items() if status != "succeeded")
+        rows.append((n_runners, algo.wall, len(tasks) / algo.wall, cpu / len(tasks) * 1000, failed))
+        print(f"runners {n_runners:>3}: {len(tasks) / algo.wall:.1f} rollouts/s", flush=True)
+
+    print()
+    print(f"{'runners':>8}{'wall s':>9}{'rollouts/s':>12}{'CPU ms':>9}{'failed':>8}")
+    for n_runners, wall, rate, cpu_ms, failed in rows:
+        print(f"{n_runners:>8}{wall:>9.2f}{rate:>12.1f}{cpu_ms:>9.2f}{failed:>8}")
+    best = max(rows, key=lambda row: row[2])
+    print(f"best: --runners {best[0]}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("mode", choices=("rollouts", "prepare", "scaling"))
+    parser.add_argument("--node", default="entity_filter")
+    parser.add_argument("--split", default="val")
+    parser.add_argument("--rollouts", type=int, default=200)
+    parser.add_argument("--questions", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--async", dest="use_async", action="store_true", help="Use the async rollout agent")
+    parser.add_argument("--rpm", type=int, default=0, help="LLM_RPM for the shared limiter (0 = off)")
+    parser.add_argument("--runner-counts", default="1,2,4,8,16", help="Runner counts swept by the scaling mode")
+    parser.add_argument("--poll-interval", type=float, default=0.5, help="Idle runner poll interval")
+    add_config_arguments(parser)
+    args = parser.parse_args()
+
+    mock = start_mock(args)
+    try:
+        configure_environment(args, mock.url)
+        if args.mode == "rollouts":
+            bench_rollouts(args, mock.url)
+        elif args.mode == "scaling":
+            bench_scaling(args, mock.url)
+        else:
+            bench_prepare(args, mock.url)
+    finally:
+        mock.terminate()
+        mock.wait()
+
+
+if __name__ == "__main__":
+    main()
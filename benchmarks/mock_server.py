@@ -0,0 +1,317 @@
+"""
+Local stand-in for the LLM gateway and the NER service, for offline benchmarks.
+
+    python -m benchmarks.mock_server [--port 8765] [--latency lognormal:0.8,0.5]
+                                     [--error-rate 0.01] [--rate-limit-rate 0.02]
+
+Serves
+  POST /v1/chat/completions   OpenAI-compatible (also /chat/completions), with stream=true SSE
+  POST /ner_pred              the NER service payload consumed by data_processor.main()
+  GET  /stats                 request counters as JSON
+
+Chat answers are format-valid: entity ids found in the prompt (JSON or dict
+repr of the entities) get an `id-role-confidence` with a role valid for their
+kind; judge prompts get a 0~1 score (or `n: score` lines when batched).
+--explain-chars appends an explanation to entity answers, the way chatty
+models do; max_tokens truncates answers (finish_reason "length"). Answers
+are generated at --stream-interval per 4 characters whether streamed or not.
+
+Latency specs: fixed:S | uniform:A,B | lognormal:MEDIAN,SIGMA (seconds).
+"""
+import argparse
+import json
+import math
+import random
+import re
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROLES_BY_KIND = {
+    "ner_enterprise": ("subject", "publisher"),
+    "ner_time": ("filter_time", "content_descriptor", "prediction_time", "context"),
+    "ner_person": ("author", "subject"),
+    "ner_location": ("context",),
+}
+
+# Entity kind keys and ids, in prompt order, in either JSON or Python repr form
+_ENTITY_TOKEN_RE = re.compile(
+    r"""['"](ner_enterprise|ner_time|ner_person|ner_location)['"]|['"]id['"]\s*:\s*['"]([A-Za-z0-9_]+)['"]"""
+)
+_BATCH_JUDGE_RE = re.compile(r"共 (\d+) 个样本")
+
+# Vocabulary the mock NER recognises; benchmarks build questions from it
+ENTERPRISES = ("贵州茅台", "腾讯", "中信证券", "立讯精密", "恒生电子", "宁德时代", "招商银行", "比亚迪")
+PERSONS = ("张三", "马云", "李四", "钟才平")
+_TIME_RE = re.compile(r"\d{4}年(?:[一二三四]季度|上半年|下半年)?|最近\d*[年月天周]?|今年|去年|明年")
+
+
+def parse_latency(spec: str):
+    """Latency spec -> sampler(rng) returning seconds."""
+    kind, _, args = spec.partition(":")
+    values = [float(v) for v in args.split(",")] if args else []
+    if kind == "fixed":
+        return lambda rng: values[0]
+    if kind == "uniform":
+        return lambda rng: rng.uniform(values[0], values[1])
+    if kind == "lognormal":
+        median, sigma = values
+        return lambda rng: rng.lognormvariate(math.log(median), sigma)
+    raise ValueError(f"Unknown latency spec: {spec}")
+
+
+def entity_ids(prompt: str) -> list:
+    """(kind, id) of every entity in the prompt, first occurrence wins."""
+    found = {}
+    kind = None
+    for match in _ENTITY_TOKEN_RE.finditer(prompt):
+        if match.group(1):
+            kind = match.group(1)
+        elif kind is not None and match.group(2) not in found:
+            found[match.group(2)] = kind
+    return [(k, entity_id) for entity_id, k in found.items()]
+
+
+def answer(prompt: str, rng: random.Random) -> str:
+    batch = _BATCH_JUDGE_RE.search(prompt)
+    if batch:
+        return "\n".join(f"{i}: {rng.random():.2f}" for i in range(1, int(batch.group(1)) + 1))
+    if "只输出0~1小数" in prompt:
+        return f"{rng.random():.2f}"
+    entities = entity_ids(prompt)
+    if entities:
+        return "|".join(f"{eid}-{rng.choice(ROLES_BY_KIND[kind])}-{rng.randint(5, 10)}" for kind, eid in entities)
+    return "这是本地模拟服务返回的文本。"
+
+
+def ner_payload(text: str) -> dict:
+    items = []
+    for name in ENTERPRISES:
+        if name in text:
+            items.append({"entity": name, "type": "stockCN", "id": "600000.SH", "fullName": name, "nerType": "enterprise"})
+    for name in PERSONS:
+        if name in text:
+            items.append({"entity": name, "type": "person", "id": "", "fullName": name, "nerType": "person"})
+    for match in _TIME_RE.finditer(text):
+        items.append({"entity": match.group(0), "type": "time", "id": "", "fullName": match.group(0), "nerType": "time"})
+    return {"data": [items], "succeed": True, "status_code": 200, "message": "", "from_cache": "0", "cost_time": 0.0}
+
+
+class MockConfig:
+    def __init__(self, latency="lognormal:0.8,0.5", ner_latency="fixed:0.05", error_rate=0.0,
+                 rate_limit_rate=0.0, tokens_per_char=0.5, stream_interval=0.01, explain_chars=0, seed=0):
+        self.latency = parse_latency(latency)
+        self.ner_latency = parse_latency(ner_latency)
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.tokens_per_char = tokens_per_char
+        self.stream_interval = stream_interval
+        self.explain_chars = explain_chars
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = {"chat": 0, "ner": 0, "errors": 0, "rate_limited": 0, "streams_closed_early": 0}
+
+    def count(self, key: str):
+        with self.lock:
+            self.stats[key] += 1
+
+    def draw(self, sampler):
+        with self.lock:
+            return sampler(self.rng)
+
+    def tokens(self, text: str) -> int:
+        return int(len(text) * self.tokens_per_char) + 1
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    config: MockConfig = None
+
+    def setup(self):
+        super().setup()
+        # Headers and body go out as separate writes; without this, Nagle plus
+        # delayed ACKs add ~40ms to every response
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, payload: dict, headers: dict = None):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client gave up on the request (timeout, cancelled hedge)
+            self.close_connection = True
+
+    def _read_json(self) -> dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def do_GET(self):
+        if self.path == "/stats":
+            with self.config.lock:
+                stats = dict(self.config.stats)
+            self._send_json(200, stats)
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        path = self.path.split("?")[0]
+        if path.endswith("/chat/completions"):
+            self._chat(self._read_json())
+        elif path == "/ner_pred":
+            self._ner(self._read_json())
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def _fail_injected(self) -> bool:
+        config = self.config
+        with config.lock:
+            roll = config.rng.random()
+        if roll < config.rate_limit_rate:
+            config.count("rate_limited")
+            self._send_json(429, {"error": {"message": "rate limited", "type": "rate_limit_error"}},
+                            headers={"Retry-After": "1"})
+            return True
+        if roll < config.rate_limit_rate + config.error_rate:
+            config.count("errors")
+            self._send_json(500, {"error": {"message": "injected failure", "type": "server_error"}})
+            return True
+        return False
+
+    def _chat(self, params: dict):
+        config = self.config
+        config.count("chat")
+        if self._fail_injected():
+            return
+        prompt = "".join(str(m.get("content") or "") for m in params.get("messages", []))
+        with config.lock:
+            content = answer(prompt, config.rng)
+        if config.explain_chars and entity_ids(prompt):
+            content += "\n\n说明：" + ("根据问句语境判断实体角色。" * config.explain_chars)[:config.explain_chars]
+        finish_reason = "stop"
+        max_tokens = params.get("max_tokens")
+        if max_tokens and config.tokens(content) > max_tokens:
+            content = content[:int(max_tokens / config.tokens_per_char)]
+            finish_reason = "length"
+        time.sleep(config.draw(config.latency))
+        usage = {
+            "prompt_tokens": config.tokens(prompt),
+            "completion_tokens": config.tokens(content),
+        }
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        model = params.get("model") or "mock"
+        if params.get("stream"):
+            self._stream(model, content, usage, params, finish_reason)
+            return
+        # Same generation time as the streamed answer, sent in one piece
+        time.sleep(self.config.stream_interval * math.ceil(len(content) / 4))
+        self._send_json(200, {
+            "id": "chatcmpl-mock",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "finish_reason": finish_reason, "message": {"role": "assistant", "content": content}}],
+            "usage": usage,
+        })
+
+    def _stream(self, model: str, content: str, usage: dict, params: dict, finish_reason: str = "stop"):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        def send(delta: dict, finish_reason=None, with_usage=False):
+            chunk = {
+                "id": "chatcmpl-mock",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            }
+            if with_usage:
+                chunk["usage"] = usage
+            self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        try:
+            send({"role": "assistant", "content": ""})
+            for start in range(0, len(content), 4):
+                send({"content": content[start:start + 4]})
+                time.sleep(self.config.stream_interval)
+            include_usage = (params.get("stream_options") or {}).get("include_usage")
+            send({}, finish_reason=finish_reason, with_usage=bool(include_usage))
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # The client stopped reading early
+            self.config.count("streams_closed_early")
+
+    def _ner(self, params: dict):
+        config = self.config
+        config.count("ner")
+        if self._fail_injected():
+            return
+        time.sleep(config.draw(config.ner_latency))
+        self._send_json(200, ner_payload(params.get("text") or ""))
+
+
+def start_mock_server(config: MockConfig, host: str = "127.0.0.1", port: int = 0) -> ThreadingHTTPServer:
+    """Start the mock server on a daemon thread; port 0 picks a free port."""
+    handler = type("ConfiguredMockHandler", (MockHandler,), {"config": config})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def add_config_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--latency", default="lognormal:0.8,0.5", help="Chat latency spec")
+    parser.add_argument("--ner-latency", default="fixed:0.05", help="NER latency spec")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Fraction of requests answered with 429")
+    parser.add_argument("--tokens-per-char", type=float, default=0.5, help="Reported usage tokens per character")
+    parser.add_argument("--stream-interval", type=float, default=0.01, help="Seconds between streamed chunks")
+    parser.add_argument("--explain-chars", type=int, default=0, help="Explanation appended to entity answers")
+    parser.add_argument("--seed", type=int, default=0)
+
+
+def config_from_args(args) -> MockConfig:
+    return MockConfig(
+        latency=args.latency,
+        ner_latency=args.ner_latency,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        tokens_per_char=args.tokens_per_char,
+        stream_interval=args.stream_interval,
+        explain_chars=args.explain_chars,
+        seed=args.seed,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    add_config_arguments(parser)
+    args = parser.parse_args()
+    server = start_mock_server(config_from_args(args), args.host, args.port)
+    print(f"mock server on http://{args.host}:{server.server_port} (chat base_url .../v1, NER .../ner_pred)", flush=True)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,261 @@
+"""
+Micro-benchmarks of the CPU-side per-sample hot paths, with stored baselines.
+
+    python -m benchmarks.suite run [--filter score] [--full] [--save benchmarks/baselines/default.json]
+    python -m benchmarks.suite compare [--baseline benchmarks/baselines/default.json] [--threshold 0.15]
+    python -m benchmarks.suite list
+
+Per-sample cases scale the entities per question (3 / 30 / 300); dataset
+cases scale the sample count (1k / 10k / 100k, plus 1M with --full). Each
+result reports ops/s (samples/s for dataset cases) and the tracemalloc peak
+of one operation. `compare` re-runs the cases found in the baseline and
+exits with status 1 when any is slower than baseline by more than the
+threshold.
+"""
+import argparse
+import copy
+import gc
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import timeit
+import tracemalloc
+from datetime import datetime
+
+from benchmarks import synthetic
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "baselines", "default.json")
+ENTITY_SCALES = (3, 30, 300)
+SAMPLE_SCALES = (1_000, 10_000, 100_000)
+FULL_SAMPLE_SCALES = SAMPLE_SCALES + (1_000_000,)
+
+
+# Each case factory takes the scale and returns (fn, ops per call). Imports
+# stay inside the factories so `list` works without the training stack.
+
+def case_normalize_payload(n_entities):
+    from src.workflow.data_processor import main
+
+    raw = json.dumps(synthetic.make_ner_payload(n_entities), ensure_ascii=False)
+    return (lambda: main(raw)), 1
+
+
+def case_convert_results_to_dict(n_entities):
+    from src.workflow.prepare_data import convert_results_to_dict
+
+    entities = synthetic.make_entities(n_entities)
+    output = synthetic.make_output(entities)
+    # convert_results_to_dict annotates in place; the copy is part of every real call site too
+    return (lambda: convert_results_to_dict(copy.deepcopy(entities), output)), 1
+
+
+def case_score_with_gold(n_entities):
+    from src.evaluators.llm_judge import score_with_gold
+
+    entities = synthetic.make_entities(n_entities)
+    gold = synthetic.make_output(entities, seed=1)
+    gold_struct = synthetic.make_gold_struct(entities, gold)
+    output = synthetic.make_output(entities, seed=2)
+    return (lambda: score_with_gold(output, gold_struct=gold_struct)), 1
+
+
+def case_render_prompt(n_entities):
+    import agentlightning as agl
+
+    from src.agents.entity_filter import _render_prompt
+    from src.agents.task import EntityTask, RunContext
+    from train import load_config
+
+    config = load_config("src/configs/nodes/entity_filter.yaml")
+    template = agl.PromptTemplate(template=config["prompt_template"], engine="f-string")
+    context = RunContext(config["goal"], "llm", "bench", None, None)
+    task = EntityTask("问句", synthetic.make_entities(n_entities), context)
+    return (lambda: _render_prompt(task, template)), 1
+
+
+def case_normalize_sample(n_entities):
+    from train import _normalize_sample
+
+    line = json.dumps(synthetic.make_sample(0, n_entities), ensure_ascii=False)
+    # _normalize_sample runs on every freshly decoded line
+    return (lambda: _normalize_sample(json.loads(line))), 1
+
+
+_datasets = {}
+
+
+def _dataset_path(n_samples):
+    path = _datasets.get(n_samples)
+    if path is None:
+        directory = tempfile.mkdtemp(prefix="bench_dataset_")
+        path = synthetic.write_dataset(os.path.join(directory, f"{n_samples}.jsonl"), n_samples)
+        _datasets[n_samples] = path
+    return path
+
+
+def case_load_jsonl(n_samples):
+    from train import load_jsonl
+
+    path = _dataset_path(n_samples)
+
+    def run():
+        # Cold load: drop the cached offset index so it is rebuilt
+        index_path = path + ".idx"
+        if os.path.exists(index_path):
+            os.remove(index_path)
+        dataset = load_jsonl(path)
+        for i in range(len(dataset)):
+            dataset[i]
+    return run, n_samples
+
+
+def case_load_jsonl_indexed(n_samples):
+    from train import load_jsonl
+
+    path = _dataset_path(n_samples)
+    load_jsonl(path)
+
+    def run():
+        dataset = load_jsonl(path)
+        for i in range(len(dataset)):
+            dataset[i]
+    return run, n_samples
+
+
+CASES = {
+    "normalize_payload": (case_normalize_payload, "entities"),
+    "convert_results_to_dict": (case_convert_results_to_dict, "entities"),
+    "score_with_gold": (case_score_with_gold, "entities"),
+    "render_prompt": (case_render_prompt, "entities"),
+    "normalize_sample": (case_normalize_sample, "entities"),
+    "load_jsonl": (case_load_jsonl, "samples"),
+    "load_jsonl_indexed": (case_load_jsonl_indexed, "samples"),
+}
+
+
+def measure(fn, ops_per_call: int, min_time: float = 0.2, repeat: int = 5) -> dict:
+    # Peak memory of one call, measured apart from the timing runs
+    gc.collect()
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    timer = timeit.Timer(fn)
+    number, elapsed = timer.autorange()
+    number = max(1, int(number * min_time / max(elapsed, 1e-9))) if elapsed < min_time else number
+    best = min(timer.repeat(repeat=repeat, number=number)) / number
+    return {"ops_per_sec": ops_per_call / best, "seconds_per_call": best, "peak_bytes": peak}
+
+
+def iter_cases(name_filter=None, full=False):
+    for name, (factory, scale_kind) in CASES.items():
+        if name_filter and name_filter not in name:
+            continue
+        scales = ENTITY_SCALES if scale_kind == "entities" else (FULL_SAMPLE_SCALES if full else SAMPLE_SCALES)
+        for scale in scales:
+            yield f"{name}[{scale_kind}={scale}]", factory, scale
+
+
+def run_cases(cases) -> dict:
+    results = {}
+    for key, factory, scale in cases:
+        fn, ops = factory(scale)
+        result = measure(fn, ops)
+        results[key] = result
+        print(f"{key:<44}{result['ops_per_sec']:>14,.0f} ops/s{result['peak_bytes'] / 1024:>12,.0f} KiB peak", flush=True)
+    return results
+
+
+def _environment() -> dict:
+    return {
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "date": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+    }
+
+
+def cmd_run(args):
+    results = run_cases(iter_cases(args.filter, args.full))
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, "w", encoding="utf-8") as file:
+            json.dump({"environment": _environment(), "results": results}, file, indent=2)
+        print(f"saved baseline -> {args.save}")
+
+
+def cmd_compare(args):
+    with open(args.baseline, "r", encoding="utf-8") as file:
+        baseline = json.load(file)
+    print(f"baseline: {args.baseline} ({baseline['environment'].get('date')}, "
+          f"python {baseline['environment'].get('python')}, {baseline['environment'].get('cpus')} cpus)")
+    wanted = baseline["results"]
+    cases = [c for c in iter_cases(args.filter, full=True) if c[0] in wanted]
+    current = run_cases(cases)
+
+    regressions = 0
+    print()
+    print(f"{'case':<44}{'baseline':>14}{'current':>14}{'change':>10}{'peak mem':>12}")
+    for key, result in current.items():
+        before = wanted[key]
+        ratio = result["ops_per_sec"] / before["ops_per_sec"]
+        memory = result["peak_bytes"] / max(1, before["peak_bytes"])
+        flag = ""
+        if ratio < 1.0 - args.threshold:
+            flag = "  REGRESSION"
+            regressions += 1
+        print(f"{key:<44}{before['ops_per_sec']:>14,.0f}{result['ops_per_sec']:>14,.0f}"
+              f"{(ratio - 1) * 100:>+9.1f}%{(memory - 1) * 100:>+11.1f}%{flag}")
+    missing = sorted(key for key in wanted if key not in current and (not args.filter or args.filter in key))
+    if missing:
+        print(f"not run (no longer defined): {', '.join(missing)}")
+    if regressions:
+        print(f"{regressions} case(s) slower than baseline by more than {args.threshold:.0%}")
+        sys.exit(1)
+
+
+def cmd_list(args):
+    for key, _, _ in iter_cases(args.filter, args.full):
+        print(key)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="Run the benchmarks")
+    run.add_argument("--save", default=None, help="Write the results as a baseline JSON file")
+    run.set_defaults(handler=cmd_run)
+
+    compare = commands.add_parser("compare", help="Re-run the baseline's cases and compare")
+    compare.add_argument("--baseline", default=DEFAULT_BASELINE)
+    compare.add_argument("--threshold", type=float, default=0.15, help="Allowed ops/s drop before failing")
+    compare.set_defaults(handler=cmd_compare)
+
+    listing = commands.add_parser("list", help="List the cases")
+    listing.set_defaults(handler=cmd_list)
+
+    for sub in (run, compare, listing):
+        sub.add_argument("--filter", default=None, help="Only cases whose name contains this")
+        sub.add_argument("--full", action="store_true", help="Include the 1M-sample dataset cases")
+
+    args = parser.parse_args()
+    started = time.perf_counter()
+    try:
+        args.handler(args)
+    finally:
+        for path in _datasets.values():
+            for leftover in (path, path + ".idx"):
+                if os.path.exists(leftover):
+                    os.remove(leftover)
+            os.rmdir(os.path.dirname(path))
+    print(f"({time.perf_counter() - started:.1f}s)")
+
+
+if __name__ == "__main__":
+    main()
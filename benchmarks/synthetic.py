@@ -0,0 +1,92 @@
+"""
+Synthetic inputs for the benchmarks: NER payloads, entity dicts, model
+outputs and whole dataset files, scaled by entities per question and sample
+count. Everything is seeded, so two runs benchmark identical data.
+"""
+import json
+import random
+
+from src.utils.output_codec import apply_to_entities, parse_output
+from src.workflow.data_processor import assign_stable_ids
+
+ROLES_BY_KEY = {
+    "ner_enterprise": ("subject", "publisher"),
+    "ner_time": ("filter_time", "content_descriptor", "prediction_time", "context"),
+    "ner_person": ("author", "subject"),
+}
+_NAME_FIELD = {"ner_enterprise": "name", "ner_time": "raw", "ner_person": "name"}
+_CJK = "的一是在不了有和人这中大为上个国我以要他时来用们生到作地于出就分对成会可主发年动同工也能下过子说产种面而方后多定行学法所民得经"
+
+
+def _name(rng: random.Random, length: int = 4) -> str:
+    return "".join(rng.choice(_CJK) for _ in range(length))
+
+
+def make_ner_payload(n_entities: int, seed: int = 0) -> dict:
+    """A /ner_pred response with n_entities recognised spans of mixed kinds."""
+    rng = random.Random(seed)
+    items = []
+    for i in range(n_entities):
+        kind = i % 4
+        name = _name(rng, rng.randint(2, 6))
+        if kind == 0:
+            items.append({"entity": name, "type": "stockCN", "id": f"{rng.randint(0, 999999):06d}.SZ", "nerType": "enterprise"})
+        elif kind == 1:
+            items.append({"entity": f"{rng.randint(2000, 2030)}年{name[:2]}", "type": "time", "id": "", "nerType": "time"})
+        elif kind == 2:
+            items.append({"entity": name[:3], "type": "person", "id": "", "nerType": "person"})
+        else:
+            items.append({"entity": name, "type": "nz", "id": "", "nerType": "concept"})
+    return {"data": [items], "succeed": True, "status_code": 200, "message": ""}
+
+
+def make_entities(n_entities: int, seed: int = 0) -> dict:
+    """A data_processor-shaped entities dict with n_entities entities and stable ids."""
+    rng = random.Random(seed)
+    entities = {"current_date": "2026-01-01", "ner_enterprise": [], "ner_time": [], "ner_person": []}
+    keys = list(ROLES_BY_KEY)
+    for i in range(n_entities):
+        key = keys[i % len(keys)]
+        item = {_NAME_FIELD[key]: f"{_name(rng)}{i}"}
+        if key == "ner_enterprise":
+            item["codes"] = [f"{rng.randint(0, 999999):06d}.SH"]
+        entities[key].append(item)
+    assign_stable_ids(entities)
+    return entities
+
+
+def make_output(entities: dict, seed: int = 0) -> str:
+    """A model output assigning a random valid role to every entity."""
+    rng = random.Random(seed)
+    parts = []
+    for key, roles in ROLES_BY_KEY.items():
+        for item in entities.get(key) or []:
+            parts.append(f"{item['id']}-{rng.choice(roles)}-{rng.randint(0, 10)}")
+    rng.shuffle(parts)
+    return "|".join(parts)
+
+
+def make_gold_struct(entities: dict, output: str) -> dict:
+    return apply_to_entities(json.loads(json.dumps(entities)), parse_output(output))
+
+
+def make_sample(index: int, n_entities: int, seed: int = 0) -> dict:
+    """One dataset line in the val.jsonl layout (input / output / format_output)."""
+    entities = make_entities(n_entities, seed=seed * 1_000_003 + index)
+    output = make_output(entities, seed=index)
+    return {
+        "input": {"question": f"{_name(random.Random(index), 12)}的研报", "entities": entities},
+        "output": output,
+        "format_output": make_gold_struct(entities, output),
+    }
+
+
+def write_dataset(path: str, n_samples: int, n_entities: int = 3, seed: int = 0) -> str:
+    """Write n_samples lines; a template line is reused with a new question to keep generation fast."""
+    templates = [make_sample(i, n_entities, seed) for i in range(min(n_samples, 64))]
+    with open(path, "w", encoding="utf-8") as file:
+        for i in range(n_samples):
+            sample = templates[i % len(templates)]
+            sample["input"]["question"] = f"问句{i}的研报"
+            file.write(json.dumps(sample, ensure_ascii=False) + "\n")
+    return path
@@ -32,4 +32,69 @@ ROLLOUT_CONFIG = ModelConfig(
 
 # Rate Limiting
 LLM_RPM = int(os.getenv("LLM_RPM", "100")) # Requests Per Minute
-LLM_REQUEST_INTERVAL = 60.0 / LLM_RPM if LLM_RPM > 0 else 0
+LLM_TPM = int(os.getenv("LLM_TPM", "0")) # Tokens Per Minute, 0 disables the token budget
+LLM_BURST = int(os.getenv("LLM_BURST", "0")) # Requests allowed back-to-back, 0 = 10s worth of LLM_RPM
+LLM_LIMITER_PATH = os.getenv("LLM_LIMITER_PATH", "") # Shared limiter state file, defaults to the temp dir
+
+# LLM response cache
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "1") == "1"
+LLM_CACHE_DETERMINISTIC_ONLY = os.getenv("LLM_CACHE_DETERMINISTIC_ONLY", "0") == "1" # Skip calls that sample (temperature unset or > 0)
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", ".cache/llm_responses.sqlite")
+LLM_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+LLM_CACHE_MAX_AGE = float(os.getenv("LLM_CACHE_MAX_AGE", str(30 * 24 * 3600))) # Seconds, 0 keeps entries forever
+
+# Prompt x sample score memo shared across training runs
+SCORE_STORE_ENABLED = os.getenv("SCORE_STORE_ENABLED", "1") == "1"
+SCORE_STORE_PATH = os.getenv("SCORE_STORE_PATH", ".cache/scores.sqlite")
+
+# NER service used by the dataset builders in src/workflow/prepare_data.py
+NER_API_URL = os.getenv("NER_API_URL", "http://10.106.40.74:30803/ner_pred")
+NER_MAX_IN_FLIGHT = int(os.getenv("NER_MAX_IN_FLIGHT", "16"))
+NER_TIMEOUT = float(os.getenv("NER_TIMEOUT", "60"))
+NER_RETRIES = int(os.getenv("NER_RETRIES", "3"))
+
+# Entity ids in NER payloads: "stable" hashes entity type + name so the same
+# question always renders the same prompt, "random" keeps the legacy random ids
+ENTITY_ID_MODE = os.getenv("ENTITY_ID_MODE", "stable")
+
+# LLM judge (eval_mode: llm samples without gold)
+JUDGE_BATCH_SIZE = int(os.getenv("JUDGE_BATCH_SIZE", "8")) # Samples packed into one judge request by llm_judge_batch (validation report), 1 disables batching
+
+# HTTP clients for the LLM gateways (src/client/registry.py)
+LLM_HTTP2 = os.getenv("LLM_HTTP2", "1") == "1" # Used only when the h2 package is installed
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "10"))
+LLM_READ_TIMEOUT = float(os.getenv("LLM_READ_TIMEOUT", "300"))
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "100"))
+LLM_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", "50"))
+
+# Per-rollout telemetry (src/utils/telemetry.py)
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0")) # Prometheus text endpoint on 127.0.0.1, 0 disables it
+METRICS_JSONL_PATH = os.getenv("METRICS_JSONL_PATH", "") # One JSON line per rollout, empty disables the sink
+
+# Retries, deadlines and hedging of LLM calls (src/client/resilience.py)
+LLM_RETRY_ATTEMPTS = int(os.getenv("LLM_RETRY_ATTEMPTS", "4")) # Attempts per call, including the first
+LLM_RETRY_BASE_DELAY = float(os.getenv("LLM_RETRY_BASE_DELAY", "0.5")) # Seconds, doubled per retry (full jitter)
+LLM_RETRY_MAX_DELAY = float(os.getenv("LLM_RETRY_MAX_DELAY", "30"))
+LLM_ROLLOUT_DEADLINE = float(os.getenv("LLM_ROLLOUT_DEADLINE", "120")) # Seconds of LLM time per rollout, 0 disables the budget
+LLM_HEDGE = os.getenv("LLM_HEDGE", "0") == "1" # Send a duplicate request when the first is slower than the hedge quantile
+LLM_HEDGE_QUANTILE = float(os.getenv("LLM_HEDGE_QUANTILE", "0.95"))
+LLM_HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY", "1.0")) # Never hedge sooner than this many seconds
+LLM_COALESCE = os.getenv("LLM_COALESCE", "1") == "1" # Concurrent identical cacheable calls share one upstream request
+
+# Placeholders of APO-generated prompt templates that no variable answers
+# (src/utils/prompt_renderer.py): "fill" keeps them as literal text, "reject" fails the template
+PROMPT_UNKNOWN_FIELDS = os.getenv("PROMPT_UNKNOWN_FIELDS", "fill")
+
+# Rollout runners (train.py --runners)
+RUNNERS = os.getenv("RUNNERS", "1") # Runners (one rollout in flight each), or "auto" to size from LLM_RPM and rollout latency
+RUNNER_POLL_INTERVAL = float(os.getenv("RUNNER_POLL_INTERVAL", "0.5")) # Seconds an idle runner waits before polling the store again
+RUNNERS_MAX = int(os.getenv("RUNNERS_MAX", "32")) # Upper bound for "auto"
+ROLLOUT_LATENCY_HINT = float(os.getenv("ROLLOUT_LATENCY_HINT", "3.0")) # Seconds per rollout assumed by "auto" until one was measured
+
+# Streamed completions (entity_filter validation rollouts, prepare_data generation): the
+# stream is closed as soon as every entity has a role. Opt-in: max_tokens capped at
+# LLM_MAX_TOKENS_BASE + LLM_MAX_TOKENS_PER_ENTITY x entities; off by default because
+# thinking models (glm-4.7, glm-4.5-flash) spend the cap on reasoning and return empty content
+LLM_STREAM = os.getenv("LLM_STREAM", "1") == "1"
+LLM_MAX_TOKENS_BASE = int(os.getenv("LLM_MAX_TOKENS_BASE", "64"))
+LLM_MAX_TOKENS_PER_ENTITY = int(os.getenv("LLM_MAX_TOKENS_PER_ENTITY", "0")) # 0 leaves max_tokens unset; e.g. 24 for non-thinking models
@@ -1,64 +1,74 @@
 import json
-
-from openai import OpenAI
-from src.workflow.prepare_data import convert_results_to_dict
+from datetime import date
 
 import agentlightning as agl
 
+from settings import LLM_ROLLOUT_DEADLINE, PROMPT_UNKNOWN_FIELDS
+from src.client.openai_httpx import acreate_chat_completion, create_chat_completion
+from src.client.registry import client_registry
+from src.client.resilience import deadline_budget
+from src.agents.task import EntityTask
 from src.evaluators.human_feedback import get_human_score
-from src.evaluators.llm_judge import llm_judge, score_with_gold
+from src.evaluators.llm_judge import score_with_gold
+from src.evaluators.score_store import score_store
+from src.utils.output_codec import apply_to_entities, completion_options, parse_output
+from src.utils.prompt_renderer import PromptRenderer
+from src.utils.telemetry import record, telemetry
 
-@agl.rollout
-def entity_filter_agent(task, prompt_template: agl.PromptTemplate) -> float:
+
+# Variables APO may introduce into generated templates besides the sample
+# fields. They are the same for every sample, so they are substituted once
+# when a template is compiled.
+_VALID_ROLES = """subject (查询主体), publisher (发布机构), author (作者), filter_time (过滤时间), prediction_time (预测时间), context (背景信息)"""
+_STATIC_FIELDS = {
+    "valid_roles": _VALID_ROLES,
+    "roles": _VALID_ROLES,
+    "role_list": _VALID_ROLES,
+    "available_roles": _VALID_ROLES,
+    "instructions": "Assign exactly one role to each entity with a confidence score.",
+    "format": "EntityID-Role-Confidence | EntityID-Role-Confidence",
+    "example": "USCF-subject-0.9 | KJOC-filter_time-0.8",
+}
+
+
+def _goal(task):
+    return task.get("goal", "Identify entity roles")
+
+
+def _current_date(task):
+    # data_processor stamps the NER date into the entities payload
+    return task["entities"].get("current_date") or date.today().strftime("%Y-%m-%d")
+
+
+_renderer = PromptRenderer(
+    static=_STATIC_FIELDS,
+    dynamic={
+        "question": lambda task: task["question"],
+        "entities": lambda task: json.dumps(task["entities"], ensure_ascii=False),
+        "current_date": _current_date,
+        "task": _goal,
+        "goal": _goal,
+    },
+    unknown=PROMPT_UNKNOWN_FIELDS,
+)
+
+
+def _render_prompt(task, prompt_template: agl.PromptTemplate):
     entities = task.get("entities")
     if entities is None:
         raise ValueError("Missing entities in task payload")
+    prompt = _renderer.render(prompt_template.template, task)
+    # 评分时会把角色写回实体：写到副本上，任务本身（以及据此计算的样本哈希）保持原样
+    entities = {key: [dict(item) for item in value] if isinstance(value, list) else value
+                for key, value in entities.items()}
+    return entities, prompt
 
-    entities_json = json.dumps(entities, ensure_ascii=False)
-    
-    # Define all known variables that might be used in prompt templates
-    # APO may generate prompts with additional variables, so we provide safe defaults
-    valid_roles = """subject (查询主体), publisher (发布机构), author (作者), filter_time (过滤时间), prediction_time (预测时间), context (背景信息)"""
-    
-    format_kwargs = {
-        "question": task["question"],
-        "entities": entities_json,
-        # Fallback values for variables APO might introduce
-        "valid_roles": valid_roles,
-        "roles": valid_roles,
-        "role_list": valid_roles,
-        "available_roles": valid_roles,
-        "task": task.get("goal", "Identify entity roles"),
-        "goal": task.get("goal", "Identify entity roles"),
-        "instructions": "Assign exactly one role to each entity with a confidence score.",
-        "format": "EntityID-Role-Confidence | EntityID-Role-Confidence",
-        "example": "USCF-subject-0.9 | KJOC-filter_time-0.8",
-    }
-    
-    try:
-        prompt = prompt_template.format(**format_kwargs)
-    except KeyError as e:
-        # If there's still a missing key, add it with a placeholder and retry
-        missing_key = str(e).strip("'")
-        format_kwargs[missing_key] = f"[{missing_key}]"
-        prompt = prompt_template.format(**format_kwargs)
-
-    from src.utils.rate_limiter import limiter
-    limiter.wait()
-
-    client = OpenAI(
-        api_key=task.get("model_api_key"),
-        base_url=task.get("model_base_url")
-    )
-    resp = client.chat.completions.create(
-        model=task.get("model"),
-        messages=[{"role": "user", "content": prompt}],
-    )
-    output = resp.choices[0].message.content
 
+def _score_output(task, entities, output) -> float:
     # 输出是一个结果字符串，需要结合entities还原成json
-    # convert_results_to_dict(entities:dict, api_result: str) 
-    output_json = convert_results_to_dict(entities, output)
+    parsed = parse_output(output)
+    record("parse_errors", len(parsed.errors))
+    output_json = apply_to_entities(entities, parsed)
 
     eval_mode = task.get("eval_mode", "llm")
     human_score = get_human_score(task)
@@ -69,15 +79,110 @@ def entity_filter_agent(task, prompt_template: agl.PromptTemplate) -> float:
     gold = task.get("gold") or task.get("output")
     if gold_struct is not None or gold is not None:
         return score_with_gold(output_json=output, gold=gold, gold_struct=gold_struct)
-    else:
-        return score_with_gold(output_json=output, gold=gold, gold_struct=output_json)
+    # 没有gold：按自洽性打分；LLM评审在验证报告里按批进行，不在每个rollout里调用
+    return score_with_gold(output_json=output, gold=gold, gold_struct=output_json)
+
+
+def _reuses_known_results(rollout) -> bool:
+    # Training rollouts feed APO's textual gradient, which reads the LLM call
+    # spans of the rollout, so they always hit the model. Validation rollouts
+    # and offline calls (no rollout) only need the score.
+    return rollout is None or rollout.mode != "train"
+
+
+def _lookup_known_score(task, prompt_template: agl.PromptTemplate, rollout):
+    reuse = _reuses_known_results(rollout)
+    score_key = score_store.key_for(prompt_template.template, task)
+    known_score = score_store.get(score_key) if reuse else None
+    return reuse, score_key, known_score
+
 
-    if human_score is not None:
-        return human_score
+def _completion_options(entities, reuse: bool) -> dict:
+    # The tracer does not record streamed responses, and APO's gradient needs
+    # the completion in the LLM span of training rollouts: only reusable
+    # calls stream, training rollouts just get the max_tokens cap
+    return completion_options(entities, stream=None if reuse else False)
 
-    return llm_judge(
-        question=task["question"],
-        entities=entities,
-        output_json=output,
-        goal=task["goal"],
+
+def _complete(task, entities, prompt, use_cache=True) -> str:
+    from src.utils.rate_limiter import limiter
+
+    client = client_registry.get_client(task.get("model_api_key"), task.get("model_base_url"))
+    resp = create_chat_completion(
+        client,
+        limiter=limiter,
+        use_cache=use_cache,
+        model=task.get("model"),
+        messages=[{"role": "user", "content": prompt}],
+        **_completion_options(entities, use_cache),
     )
+    return resp["choices"][0]["message"]["content"]
+
+
+def predict(task, prompt_template: agl.PromptTemplate) -> str:
+    """Raw model output for one task, outside of a rollout (used for reports)."""
+    entities, prompt = _render_prompt(task, prompt_template)
+    return _complete(task, entities, prompt)
+
+
+def _rollout_mode(rollout):
+    return rollout.mode if rollout is not None else None
+
+
+@agl.rollout
+def entity_filter_agent(task, prompt_template: agl.PromptTemplate, rollout: agl.Rollout = None) -> float:
+    with telemetry.rollout(_rollout_mode(rollout)) as metrics:
+        # 多进程时任务以JSON到达：按上下文id还原成EntityTask
+        task = EntityTask.coerce(task)
+        reuse, score_key, known_score = _lookup_known_score(task, prompt_template, rollout)
+        if known_score is not None:
+            metrics.update(source="score_store", score=known_score)
+            return known_score
+
+        entities, prompt = _render_prompt(task, prompt_template)
+        with deadline_budget(LLM_ROLLOUT_DEADLINE):
+            output = _complete(task, entities, prompt, use_cache=reuse)
+
+        score = _score_output(task, entities, output)
+        score_store.put(score_key, score)
+        metrics["score"] = score
+        return score
+
+
+@agl.rollout
+async def entity_filter_agent_async(task, prompt_template: agl.PromptTemplate, rollout: agl.Rollout = None) -> float:
+    """
+    Async variant of entity_filter_agent.
+
+    Uses the registry's pooled AsyncOpenAI client for the runner loop and
+    awaits the rate limiter instead of sleeping, so the runner loop stays
+    free while the request is in flight.
+    """
+    from src.utils.rate_limiter import limiter
+
+    with telemetry.rollout(_rollout_mode(rollout)) as metrics:
+        # 多进程时任务以JSON到达：按上下文id还原成EntityTask
+        task = EntityTask.coerce(task)
+        reuse, score_key, known_score = _lookup_known_score(task, prompt_template, rollout)
+        if known_score is not None:
+            metrics.update(source="score_store", score=known_score)
+            return known_score
+
+        entities, prompt = _render_prompt(task, prompt_template)
+
+        client = client_registry.get_async_client(task.get("model_api_key"), task.get("model_base_url"))
+        with deadline_budget(LLM_ROLLOUT_DEADLINE):
+            resp = await acreate_chat_completion(
+                client,
+                limiter=limiter,
+                use_cache=reuse,
+                model=task.get("model"),
+                messages=[{"role": "user", "content": prompt}],
+                **_completion_options(entities, reuse),
+            )
+        output = resp["choices"][0]["message"]["content"]
+
+        score = _score_output(task, entities, output)
+        score_store.put(score_key, score)
+        metrics["score"] = score
+        return score
@@ -0,0 +1,145 @@
+import hashlib
+import sys
+import threading
+
+
+class RunContext:
+    """
+    Run-wide settings every rollout of a training run shares.
+
+    Instances are interned: equal field values always resolve to the same
+    object, including after unpickling, so N tasks reference one context
+    instead of carrying N copies of goal/model/credentials. Each context
+    also gets a short id that JSON payloads carry instead of the fields.
+    """
+    __slots__ = ("goal", "eval_mode", "model", "model_base_url", "model_api_key", "id")
+
+    _instances = {}
+    _by_id = {}
+    _lock = threading.Lock()
+
+    def __new__(cls, goal, eval_mode, model, model_base_url, model_api_key):
+        key = (goal, eval_mode, model, model_base_url, model_api_key)
+        with cls._lock:
+            instance = cls._instances.get(key)
+            if instance is None:
+                instance = super().__new__(cls)
+                instance.goal = goal
+                instance.eval_mode = eval_mode
+                instance.model = model
+                instance.model_base_url = model_base_url
+                instance.model_api_key = model_api_key
+                instance.id = hashlib.sha256(repr(key).encode("utf-8")).hexdigest()[:16]
+                cls._instances[key] = instance
+                cls._by_id[instance.id] = instance
+        return instance
+
+    @classmethod
+    def lookup(cls, context_id: str) -> "RunContext":
+        """
+        Context created in this process under `context_id`.
+
+        Runner processes are forked from train.py after the datasets were
+        built, so they resolve the ids of its contexts.
+        """
+        with cls._lock:
+            instance = cls._by_id.get(context_id)
+        if instance is None:
+            raise KeyError(f"Unknown run context {context_id!r}")
+        return instance
+
+    def __reduce__(self):
+        return (RunContext, (self.goal, self.eval_mode, self.model, self.model_base_url, self.model_api_key))
+
+    def __repr__(self):
+        return f"RunContext(model={self.model!r}, eval_mode={self.eval_mode!r})"
+
+
+def intern_strings(value):
+    """Recursively intern the strings of a decoded JSON value (keys and values)."""
+    if isinstance(value, str):
+        return sys.intern(value)
+    if isinstance(value, dict):
+        return {sys.intern(k) if isinstance(k, str) else k: intern_strings(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [intern_strings(v) for v in value]
+    return value
+
+
+class EntityTask:
+    """
+    One entity_filter sample plus a reference to its shared RunContext.
+
+    Keeps the dict-style access (`task["question"]`, `task.get("model")`)
+    the rollout code already uses, while storing per-sample fields once in
+    slots and run-wide fields once in the context.
+    """
+    __slots__ = ("question", "entities", "gold", "gold_struct", "human_score", "context")
+
+    _SAMPLE_FIELDS = ("question", "entities", "gold", "gold_struct", "human_score")
+    _CONTEXT_FIELDS = frozenset(RunContext.__slots__) - {"id"}
+
+    def __init__(self, question, entities, context, gold=None, gold_struct=None, human_score=None):
+        self.question = question
+        self.entities = intern_strings(entities)
+        self.gold = gold
+        self.gold_struct = intern_strings(gold_struct)
+        self.human_score = human_score
+        self.context = context
+
+    @classmethod
+    def from_sample(cls, item: dict, context: RunContext) -> "EntityTask":
+        """Build a task from a sample normalized by train._normalize_sample."""
+        return cls(
+            question=item.get("question"),
+            entities=item.get("entities"),
+            context=context,
+            gold=item.get("gold"),
+            gold_struct=item.get("gold_struct"),
+            human_score=item.get("human_score"),
+        )
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "EntityTask":
+        """Inverse of to_dict(): resolves the context id in this process."""
+        return cls.from_sample(data, RunContext.lookup(data["context"]))
+
+    @classmethod
+    def coerce(cls, task):
+        """An EntityTask for a to_dict() payload; other tasks pass through unchanged."""
+        if isinstance(task, dict) and isinstance(task.get("context"), str):
+            return cls.from_dict(task)
+        return task
+
+    def get(self, key, default=None):
+        if key in self._CONTEXT_FIELDS:
+            value = getattr(self.context, key)
+        elif key in self._SAMPLE_FIELDS:
+            value = getattr(self, key)
+        else:
+            return default
+        return default if value is None else value
+
+    def __getitem__(self, key):
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def to_dict(self) -> dict:
+        """JSON payload for runner processes: the per-sample fields and the context id."""
+        data = {field: getattr(self, field) for field in self._SAMPLE_FIELDS if getattr(self, field) is not None}
+        data["context"] = self.context.id
+        return data
+
+    def __reduce__(self):
+        return (
+            EntityTask,
+            (self.question, self.entities, self.context, self.gold, self.gold_struct, self.human_score),
+        )
+
+    def __repr__(self):
+        return f"EntityTask(question={self.question!r})"
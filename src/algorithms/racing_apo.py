@@ -0,0 +1,140 @@
+import logging
+import math
+from typing import Iterator, List, Sequence
+
+from agentlightning.algorithm.apo.apo import VersionedPromptTemplate
+
+from src.algorithms.resumable_apo import ResumableAPO
+
+
+class RacingAPO(ResumableAPO):
+    """
+    APO whose beam selection races the candidates instead of scoring each on
+    the whole validation batch.
+
+    Candidates are scored on growing slices of the batch (min_samples, then
+    doubling up to the full batch). After each slice a Hoeffding bound at
+    `confidence` is put around every candidate's mean reward, and a candidate
+    is dropped once its upper bound falls below the beam_width-th best lower
+    bound, i.e. once it can no longer make the beam. The beam_width
+    candidates with the best lower bounds are never dropped, so the selected
+    beam is always full and scored on the whole batch.
+
+    Rewards are assumed to lie in [0, 1]. `racing_stats` keeps one entry per
+    round with the rollouts run and saved.
+    """
+
+    def __init__(self, *args, min_samples: int = 4, confidence: float = 0.9, **kwargs):
+        super().__init__(*args, **kwargs)
+        if not 0.0 < confidence < 1.0:
+            raise ValueError("confidence must be between 0 and 1")
+        self.min_samples = max(1, min_samples)
+        self.confidence = confidence
+        self.racing_stats = []
+
+    def _checkpoint_state(self) -> dict:
+        return {"racing_stats": self.racing_stats}
+
+    def _restore_state(self, state: dict):
+        self.racing_stats = state.get("racing_stats", [])
+
+    def _slice_ends(self, size: int) -> List[int]:
+        ends = []
+        end = min(self.min_samples, size)
+        while end < size:
+            ends.append(end)
+            end *= 2
+        ends.append(size)
+        return ends
+
+    def _half_width(self, count: int) -> float:
+        if count == 0:
+            return float("inf")
+        return math.sqrt(math.log(2.0 / (1.0 - self.confidence)) / (2.0 * count))
+
+    async def _evaluate_and_select_beam(
+        self,
+        candidates: List[VersionedPromptTemplate],
+        resource_name: str,
+        val_dataset_iterator: Iterator[Sequence],
+        round_num: int,
+    ) -> List[VersionedPromptTemplate]:
+        display_round = round_num + 1
+        round_prefix = self._format_log_prefix(round_num=display_round)
+        val_batch = next(val_dataset_iterator)
+        self._log(
+            logging.INFO,
+            f"Racing {len(candidates)} candidates on up to {len(val_batch)} validation samples",
+            prefix=round_prefix,
+        )
+
+        totals = {id(prompt): 0.0 for prompt in candidates}
+        counts = {id(prompt): 0 for prompt in candidates}
+        alive = list(candidates)
+        eliminated = []
+        rollouts = 0
+        start = 0
+        for end in self._slice_ends(len(val_batch)):
+            tasks = val_batch[start:end]
+            for prompt in alive:
+                prefix = self._format_log_prefix(round_num=display_round, prompt_version=prompt.version)
+                results, _ = await self.evaluate_prompt_on_batch(
+                    prompt, resource_name, tasks, mode="val", prefix=prefix,
+                )
+                rollouts += len(tasks)
+                totals[id(prompt)] += sum(r["final_reward"] or 0.0 for r in results)
+                counts[id(prompt)] += len(results)
+                prompt.score = totals[id(prompt)] / max(1, counts[id(prompt)])
+            start = end
+            if end == len(val_batch) or len(alive) <= self.beam_width:
+                continue
+
+            bounds = {
+                id(prompt): (prompt.score - self._half_width(counts[id(prompt)]),
+                             prompt.score + self._half_width(counts[id(prompt)]))
+                for prompt in alive
+            }
+            cutoff = sorted((low for low, _ in bounds.values()), reverse=True)[self.beam_width - 1]
+            survivors = [prompt for prompt in alive if bounds[id(prompt)][1] >= cutoff]
+            for prompt in alive:
+                if bounds[id(prompt)][1] < cutoff:
+                    eliminated.append(prompt)
+                    self._log(
+                        logging.INFO,
+                        f"Eliminated after {counts[id(prompt)]} samples: score {prompt.score:.3f}, "
+                        f"upper bound {bounds[id(prompt)][1]:.3f} < beam lower bound {cutoff:.3f}",
+                        prefix=self._format_log_prefix(round_num=display_round, prompt_version=prompt.version),
+                    )
+            alive = survivors
+
+        full = len(candidates) * len(val_batch)
+        stats = {
+            "round": display_round,
+            "candidates": len(candidates),
+            "eliminated": len(eliminated),
+            "rollouts": rollouts,
+            "full_rollouts": full,
+            "saved": full - rollouts,
+        }
+        self.racing_stats.append(stats)
+        self._log(
+            logging.INFO,
+            f"Racing ran {rollouts}/{full} rollouts, saved {full - rollouts} "
+            f"({len(eliminated)}/{len(candidates)} candidates eliminated early)",
+            prefix=round_prefix,
+        )
+
+        # Survivors were scored on the whole batch and rank first; eliminated
+        # candidates only fill the beam if there are fewer survivors than slots
+        ranked = sorted(alive, key=lambda p: p.score, reverse=True)
+        ranked += sorted(eliminated, key=lambda p: p.score, reverse=True)
+        selected_prompts = ranked[: self.beam_width]
+        self._log(
+            logging.INFO,
+            f"Top {len(selected_prompts)} candidates on validation dataset: "
+            f"{[f'{p.version}:{p.score:.3f}' for p in selected_prompts]}",
+            prefix=round_prefix,
+        )
+        if not selected_prompts:
+            raise ValueError("No beam candidates any more")
+        return selected_prompts
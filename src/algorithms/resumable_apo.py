@@ -0,0 +1,308 @@
+import hashlib
+import json
+import logging
+import os
+from typing import List, Optional, Sequence
+
+from agentlightning.algorithm.apo.apo import APO, RolloutResultForAPO, VersionedPromptTemplate
+from agentlightning.algorithm.utils import with_llm_proxy, with_store
+from agentlightning.types import PromptTemplate
+
+from src.evaluators.score_store import sample_hash, template_hash
+
+CHECKPOINT_FORMAT = 2
+# Format 1 checkpoints have no per-sample results or run fingerprint
+_READABLE_FORMATS = (1, CHECKPOINT_FORMAT)
+
+
+def _prompt_to_dict(prompt: VersionedPromptTemplate) -> dict:
+    return {
+        "version": prompt.version,
+        "template": prompt.prompt_template.template,
+        "engine": prompt.prompt_template.engine,
+        "score": prompt.score,
+    }
+
+
+def _dataset_fingerprint(dataset) -> dict:
+    digest = hashlib.sha256()
+    for i in range(len(dataset)):
+        digest.update(sample_hash(dataset[i]).encode("ascii"))
+    return {"size": len(dataset), "hash": digest.hexdigest()}
+
+
+def _prompt_from_dict(data: dict) -> VersionedPromptTemplate:
+    return VersionedPromptTemplate(
+        version=data["version"],
+        prompt_template=PromptTemplate(template=data["template"], engine=data["engine"]),
+        score=data.get("score"),
+    )
+
+
+class ResumableAPO(APO):
+    """
+    APO that checkpoints its search state to `checkpoint_path` and, with
+    `resume=True`, continues from the last checkpoint instead of the seed.
+
+    A checkpoint is written after the seed validation, after the candidates
+    of a round are generated, after the round's beam is selected and after
+    every rollout batch that ran new rollouts. It holds the beam, the next
+    round, any generated-but-unscored candidates, the best prompt so far,
+    every scored candidate, subclass state (_checkpoint_state) and the
+    per-sample results of the run.
+
+    Per-sample results map (mode, template, sample) to the rollout result.
+    evaluate_prompt_on_batch() replays them instead of enqueueing the
+    rollout again, so a resumed round only runs what the interrupted one
+    had not finished. Val results are kept for the prompts that can be
+    scored again (beam and best prompt), train results (which carry the
+    spans and messages the textual gradient reads) only until their round
+    completes.
+
+    A checkpoint is only resumed by a run with the same train and val data,
+    whose seed prompt is the checkpoint's seed or a prompt it produced (the
+    config YAML is updated with the best prompt while training).
+
+    The run() loop mirrors APO.run(); the dataset iterators are not part of
+    the checkpoint, so a resumed round samples fresh batches.
+    """
+
+    def __init__(self, *args, checkpoint_path: Optional[str] = None, resume: bool = False, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checkpoint_path = checkpoint_path
+        self.resume = resume
+        self.scored_candidates = []
+        self.sample_results = {"val": {}, "train": {}}
+        self.fingerprint = None
+        self._resource_templates = {}
+        self._checkpoint_args = None
+
+    def _checkpoint_state(self) -> dict:
+        """Extra state of subclasses, stored under "extra"."""
+        return {}
+
+    def _restore_state(self, state: dict):
+        pass
+
+    def save_checkpoint(self, next_round: int, beam: List[VersionedPromptTemplate],
+                        candidates: Optional[List[VersionedPromptTemplate]] = None):
+        if not self.checkpoint_path:
+            return
+        self._checkpoint_args = (next_round, beam, candidates)
+        best = None
+        if self._history_best_prompt is not None:
+            best = {
+                "version": self._history_best_version,
+                "template": self._history_best_prompt.template,
+                "engine": self._history_best_prompt.engine,
+                "score": self._history_best_score,
+            }
+        state = {
+            "format": CHECKPOINT_FORMAT,
+            "next_round": next_round,
+            "beam_rounds": self.beam_rounds,
+            "version_counter": self._version_counter,
+            "beam": [_prompt_to_dict(p) for p in beam],
+            "pending_candidates": [_prompt_to_dict(p) for p in candidates] if candidates is not None else None,
+            "best": best,
+            "scored_candidates": self.scored_candidates,
+            "fingerprint": self.fingerprint,
+            "sample_results": self.sample_results,
+            "extra": self._checkpoint_state(),
+        }
+        directory = os.path.dirname(self.checkpoint_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = self.checkpoint_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            # Spans of train results hold timestamps
+            json.dump(state, file, ensure_ascii=False, default=str)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def load_checkpoint(self) -> Optional[dict]:
+        if not self.checkpoint_path or not os.path.exists(self.checkpoint_path):
+            return None
+        with open(self.checkpoint_path, "r", encoding="utf-8") as file:
+            state = json.load(file)
+        if state.get("format") not in _READABLE_FORMATS:
+            raise ValueError(f"Unsupported checkpoint format in {self.checkpoint_path}: {state.get('format')}")
+        return state
+
+    def _restore(self, state: dict):
+        self._version_counter = state["version_counter"]
+        best = state.get("best")
+        if best is not None:
+            self._history_best_prompt = PromptTemplate(template=best["template"], engine=best["engine"])
+            self._history_best_score = best["score"]
+            self._history_best_version = best["version"]
+        self.scored_candidates = state.get("scored_candidates") or []
+        self.sample_results = state.get("sample_results") or {"val": {}, "train": {}}
+        self._restore_state(state.get("extra") or {})
+        beam = [_prompt_from_dict(p) for p in state["beam"]]
+        pending = state.get("pending_candidates")
+        pending = [_prompt_from_dict(p) for p in pending] if pending is not None else None
+        return beam, state["next_round"], pending
+
+    def _check_resumable(self, state: dict, seed_prompt: PromptTemplate):
+        """Raise ValueError when the checkpoint belongs to another seed prompt or other data."""
+        saved = state.get("fingerprint")
+        if saved is None:
+            self._log(logging.WARNING, f"{self.checkpoint_path} predates run fingerprints; seed and data not checked")
+            return
+        for name in ("train", "val"):
+            if saved[name] != self.fingerprint[name]:
+                raise ValueError(
+                    f"Checkpoint {self.checkpoint_path} was written for a different {name} set "
+                    f"({saved[name]['size']} samples, now {self.fingerprint[name]['size']}); "
+                    "start without --resume or use another --checkpoint"
+                )
+        produced = {saved["seed"]}
+        produced.update(template_hash(p["template"]) for p in state["beam"] + state["scored_candidates"])
+        if state.get("best") is not None:
+            produced.add(template_hash(state["best"]["template"]))
+        if template_hash(seed_prompt.template) not in produced:
+            raise ValueError(
+                f"Checkpoint {self.checkpoint_path} was written for a different seed prompt; "
+                "start without --resume or use another --checkpoint"
+            )
+
+    @staticmethod
+    def _result_key(template: str, task) -> tuple:
+        # Truncated hashes keep the checkpoint small; collisions are negligible at these sizes
+        return template_hash(template)[:16], sample_hash(task)[:16]
+
+    async def evaluate_prompt_on_batch(self, prompt: VersionedPromptTemplate, resource_name: str,
+                                       dataset: Sequence, mode, *, prefix: Optional[str] = None):
+        """APO.evaluate_prompt_on_batch() that replays the per-sample results already known."""
+        known = self.sample_results.setdefault(mode, {})
+        replayed, missing = [], []
+        for task in dataset:
+            template_key, sample_key = self._result_key(prompt.prompt_template.template, task)
+            result = known.get(template_key, {}).get(sample_key)
+            if result is None:
+                missing.append(task)
+            else:
+                replayed.append(RolloutResultForAPO(
+                    status=result["status"],
+                    final_reward=result["final_reward"],
+                    spans=result.get("spans") or [],
+                    messages=result.get("messages") or [],
+                ))
+        if replayed:
+            self._log(logging.INFO, f"Replaying {len(replayed)}/{len(dataset)} {mode} results from the checkpoint",
+                      prefix=prefix)
+        results = list(replayed)
+        if missing:
+            self._resource_templates[prompt.version] = prompt.prompt_template.template
+            fresh, _ = await super().evaluate_prompt_on_batch(prompt, resource_name, missing, mode, prefix=prefix)
+            results.extend(fresh)
+            if self._checkpoint_args is not None:
+                self.save_checkpoint(*self._checkpoint_args)
+        rewards = [r["final_reward"] for r in results]
+        return results, float(sum(r or 0.0 for r in rewards) / max(1, len(rewards)))
+
+    @with_store
+    async def get_rollout_results(self, store, rollout, *, prefix: Optional[str] = None):
+        results = await super().get_rollout_results(rollout, prefix=prefix)
+        for r, result in zip(rollout, results):
+            template = self._resource_templates.get(r.resources_id)
+            if template is None or r.status != "succeeded" or result["final_reward"] is None:
+                continue
+            template_key, sample_key = self._result_key(template, r.input)
+            entry = {"status": result["status"], "final_reward": result["final_reward"]}
+            if r.mode == "train":
+                entry.update(spans=result["spans"], messages=result["messages"])
+            self.sample_results.setdefault(r.mode, {}).setdefault(template_key, {})[sample_key] = entry
+        return results
+
+    def _prune_sample_results(self, beam: List[VersionedPromptTemplate]):
+        """Keep val results of the prompts that can still be scored; train results end with their round."""
+        keep = {template_hash(p.prompt_template.template)[:16] for p in beam}
+        if self._history_best_prompt is not None:
+            keep.add(template_hash(self._history_best_prompt.template)[:16])
+        val = self.sample_results.get("val", {})
+        self.sample_results = {"val": {k: v for k, v in val.items() if k in keep}, "train": {}}
+
+    def _record_scored(self, candidates: List[VersionedPromptTemplate], round_num: int):
+        known = {c["version"] for c in self.scored_candidates}
+        for prompt in candidates:
+            if prompt.version not in known and prompt.score is not None:
+                self.scored_candidates.append({"round": round_num + 1, **_prompt_to_dict(prompt)})
+
+    async def _validate_seed(self, seed_versioned: VersionedPromptTemplate, resource_name: str, val_dataset):
+        seed_prefix = self._format_log_prefix(round_num=0, prompt_version=seed_versioned.version)
+        self._log(logging.INFO, "Evaluating seed prompt on validation dataset before optimization...",
+                  prefix=seed_prefix)
+        _, seed_score = await self.evaluate_prompt_on_batch(
+            seed_versioned, resource_name, val_dataset, mode="val", prefix=seed_prefix,
+        )
+        self._log(logging.INFO, f"Seed prompt baseline score: {seed_score:.3f}", prefix=seed_prefix)
+        seed_versioned.score = seed_score
+        self._history_best_score = seed_score
+        self._record_scored([seed_versioned], -1)
+        self.save_checkpoint(0, [seed_versioned])
+
+    @with_llm_proxy()
+    @with_store
+    async def run(self, store, llm_proxy, train_dataset=None, val_dataset=None) -> None:
+        resource_name, seed_prompt, grad_iterator, val_iterator = self._initialize_beam(train_dataset, val_dataset)
+
+        if self._poml_trace:
+            import poml
+
+            poml.set_trace(trace_dir="pomltrace")
+
+        assert val_dataset is not None
+        self.fingerprint = {
+            "seed": template_hash(seed_prompt.template),
+            "train": _dataset_fingerprint(train_dataset),
+            "val": _dataset_fingerprint(val_dataset),
+        }
+
+        state = self.load_checkpoint() if self.resume else None
+        if state is not None:
+            self._check_resumable(state, seed_prompt)
+            beam, start_round, pending = self._restore(state)
+            if state.get("fingerprint") is not None:
+                # Keep the original seed: the config may already hold a prompt this run produced
+                self.fingerprint["seed"] = state["fingerprint"]["seed"]
+            self._checkpoint_args = (start_round, beam, pending)
+            self._log(
+                logging.INFO,
+                f"Resuming from {self.checkpoint_path}: round {start_round + 1}/{self.beam_rounds}, "
+                f"beam {[p.version for p in beam]}, best score {self._history_best_score:.3f}"
+                + (f", {len(pending)} generated candidates awaiting evaluation" if pending else ""),
+            )
+            # Interrupted during the seed validation: finish it, replaying what was scored
+            if self.run_initial_validation and start_round == 0 and not self.scored_candidates:
+                await self._validate_seed(beam[0], resource_name, val_dataset)
+        else:
+            if self.resume:
+                self._log(logging.WARNING, f"No checkpoint at {self.checkpoint_path}, starting from the seed prompt")
+            seed_versioned = self._create_versioned_prompt(seed_prompt)
+            beam = [seed_versioned]
+            self._history_best_prompt = seed_prompt
+            self._history_best_version = seed_versioned.version
+            start_round, pending = 0, None
+            self.save_checkpoint(0, beam)
+            if self.run_initial_validation:
+                await self._validate_seed(seed_versioned, resource_name, val_dataset)
+
+        for rnd in range(start_round, self.beam_rounds):
+            display_round = rnd + 1
+            round_prefix = self._format_log_prefix(round_num=display_round)
+            self._log(logging.INFO, f"Round {display_round}/{self.beam_rounds}...", prefix=round_prefix)
+
+            if pending is not None:
+                new_candidates, pending = pending, None
+            else:
+                parent_prompts = self._sample_parent_prompts(beam, rnd)
+                new_candidates = await self._generate_candidate_prompts(parent_prompts, resource_name, grad_iterator, rnd)
+                self.save_checkpoint(rnd, beam, candidates=new_candidates)
+
+            all_candidates = [*beam, *new_candidates]
+            beam = await self._evaluate_and_select_beam(all_candidates, resource_name, val_iterator, rnd)
+            await self._update_best_prompt(beam, resource_name, val_dataset, rnd)
+            self._record_scored(all_candidates, rnd)
+            self._prune_sample_results(beam)
+            self.save_checkpoint(rnd + 1, beam)
@@ -0,0 +1,157 @@
+import asyncio
+import logging
+import math
+from typing import Iterator, List, Sequence
+
+from agentlightning.algorithm.apo.apo import VersionedPromptTemplate
+
+from src.algorithms.resumable_apo import ResumableAPO
+from src.evaluators.val_sampler import StratifiedSampler
+
+
+class StratifiedValAPO(ResumableAPO):
+    """
+    APO that scores candidates on adaptive stratified subsets of the whole
+    validation set instead of a random val batch.
+
+    Each candidate is scored on a growing prefix of StratifiedSampler.order
+    (starting with one task per stratum, then growing by `growth`) until the
+    confidence interval of its stratified mean is at most `ci_width` wide
+    or the whole set is scored. A beam leader whose subset estimate beats
+    the history best is confirmed on the full validation set before it
+    replaces it: the maximum of several noisy estimates is biased upwards.
+    The rollouts of its subset are replayed, so only the rest is run.
+
+    `intervals` maps prompt version to (score, half_width, tasks scored) and
+    `val_stats` keeps the rollouts run per round.
+    """
+
+    def __init__(self, *args, ci_width: float = 0.1, confidence: float = 0.95, growth: float = 1.5,
+                 min_samples: int = 0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.ci_width = ci_width
+        self.confidence = confidence
+        self.growth = max(1.1, growth)
+        self.min_samples = min_samples
+        self.sampler = None
+        self.intervals = {}
+        self.val_stats = []
+        self._val_dataset = None
+
+    def _checkpoint_state(self) -> dict:
+        return {"val_stats": self.val_stats, "intervals": self.intervals}
+
+    def _restore_state(self, state: dict):
+        self.val_stats = state.get("val_stats", [])
+        self.intervals = {version: tuple(value) for version, value in state.get("intervals", {}).items()}
+
+    def _initialize_beam(self, train_dataset, val_dataset):
+        initialized = super()._initialize_beam(train_dataset, val_dataset)
+        self._val_dataset = val_dataset
+        self.sampler = StratifiedSampler(val_dataset, confidence=self.confidence)
+        self._log(logging.INFO, f"Validation strata: {self.sampler.describe()}")
+        return initialized
+
+    async def _estimate(self, prompt: VersionedPromptTemplate, resource_name: str, prefix: str,
+                        full: bool = False):
+        sampler = self.sampler
+        rewards = {}
+        scored = 0
+        target = min(sampler.size, max(self.min_samples, len(sampler.strata)))
+        while True:
+            chunk = sampler.take(scored, target)
+            # One rollout batch per stratum, run concurrently, so rewards stay attributable
+            results = await asyncio.gather(*(
+                self.evaluate_prompt_on_batch(
+                    prompt, resource_name, [self._val_dataset[i] for i in indices], mode="val", prefix=prefix,
+                )
+                for indices in chunk.values()
+            ))
+            for key, (stratum_results, _) in zip(chunk, results):
+                rewards.setdefault(key, []).extend(r["final_reward"] or 0.0 for r in stratum_results)
+            scored = target
+            score, half_width = sampler.estimate(rewards)
+            if (not full and 2 * half_width <= self.ci_width) or scored >= sampler.size:
+                return score, half_width, scored
+            target = min(sampler.size, math.ceil(scored * self.growth))
+
+    async def _evaluate_and_select_beam(
+        self,
+        candidates: List[VersionedPromptTemplate],
+        resource_name: str,
+        val_dataset_iterator: Iterator[Sequence],
+        round_num: int,
+    ) -> List[VersionedPromptTemplate]:
+        display_round = round_num + 1
+        round_prefix = self._format_log_prefix(round_num=display_round)
+        self._log(
+            logging.INFO,
+            f"Evaluating {len(candidates)} candidates on stratified val subsets (CI width <= {self.ci_width})",
+            prefix=round_prefix,
+        )
+
+        rollouts = 0
+        for prompt in candidates:
+            prefix = self._format_log_prefix(round_num=display_round, prompt_version=prompt.version)
+            score, half_width, scored = await self._estimate(prompt, resource_name, prefix)
+            prompt.score = score
+            self.intervals[prompt.version] = (score, half_width, scored)
+            rollouts += scored
+            self._log(
+                logging.INFO,
+                f"Candidate score: {score:.3f} ± {half_width:.3f} ({scored}/{self.sampler.size} tasks)",
+                prefix=prefix,
+            )
+
+        full = len(candidates) * self.sampler.size
+        self.val_stats.append({"round": display_round, "rollouts": rollouts, "full_rollouts": full})
+        self._log(
+            logging.INFO,
+            f"Stratified validation ran {rollouts}/{full} rollouts, saved {full - rollouts}",
+            prefix=round_prefix,
+        )
+
+        selected_prompts = sorted(candidates, key=lambda p: p.score, reverse=True)[: self.beam_width]
+        self._log(
+            logging.INFO,
+            f"Top {len(selected_prompts)} candidates on validation dataset: "
+            f"{[f'{p.version}:{p.score:.3f}±{self.intervals[p.version][1]:.3f}' for p in selected_prompts]}",
+            prefix=round_prefix,
+        )
+        if not selected_prompts:
+            raise ValueError("No beam candidates any more")
+        return selected_prompts
+
+    async def _update_best_prompt(self, beam, resource_name, val_dataset, round_num) -> None:
+        best_prompt = beam[0]
+        prefix = self._format_log_prefix(round_num=round_num + 1, prompt_version=best_prompt.version)
+        size = self.sampler.size
+        best_score, half_width, scored = self.intervals[best_prompt.version]
+        if best_score > self._history_best_score and scored < size:
+            self._log(
+                logging.INFO,
+                f"Confirming leader score {best_score:.3f} ± {half_width:.3f} ({scored}/{size} tasks) "
+                f"on the full validation set",
+                prefix=prefix,
+            )
+            best_score, half_width, scored = await self._estimate(best_prompt, resource_name, prefix, full=True)
+            best_prompt.score = best_score
+            self.intervals[best_prompt.version] = (best_score, half_width, scored)
+        # The history best (seed included) is always a full validation set score
+        if best_score > self._history_best_score:
+            self._log(
+                logging.INFO,
+                f"Best prompt updated. New best score: {best_score:.3f} ({scored}/{size} tasks) "
+                f"(prev: {self._history_best_score:.3f}, {size}/{size} tasks)",
+                prefix=prefix,
+            )
+            self._history_best_prompt = best_prompt.prompt_template
+            self._history_best_score = best_score
+            self._history_best_version = best_prompt.version
+        else:
+            self._log(
+                logging.WARNING,
+                f"Best prompt not updated. Current score: {best_score:.3f} ± {half_width:.3f} "
+                f"({scored}/{size} tasks) vs. history best: {self._history_best_score:.3f} ({size}/{size} tasks)",
+                prefix=prefix,
+            )
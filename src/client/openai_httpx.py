@@ -1,39 +1,282 @@
+import importlib.util
+import logging
+import time
 import httpx
 from typing import Optional
 
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI
 
-def build_httpx_client() -> httpx.Client:
+from settings import LLM_CONNECT_TIMEOUT, LLM_HTTP2, LLM_MAX_CONNECTIONS, LLM_MAX_KEEPALIVE_CONNECTIONS, LLM_READ_TIMEOUT
+from src.client.resilience import DeadlineExceeded, remaining_budget, resilient_caller
+from src.client.response_cache import response_cache
+from src.client.single_flight import single_flight
+from src.utils.rate_limiter import estimate_tokens
+from src.utils.telemetry import record
+
+logger = logging.getLogger(__name__)
+
+# Keep-alive pool sizing shared by the sync and async builders. Rollouts hit the
+# same gateway over and over, so idle connections are kept around long enough
+# to be reused by the next request instead of paying TCP/TLS setup again.
+DEFAULT_MAX_CONNECTIONS = LLM_MAX_CONNECTIONS
+DEFAULT_MAX_KEEPALIVE_CONNECTIONS = LLM_MAX_KEEPALIVE_CONNECTIONS
+DEFAULT_KEEPALIVE_EXPIRY = 60.0
+
+# A dead gateway should fail fast on connect; a slow completion may legitimately
+# stream for minutes.
+DEFAULT_TIMEOUT = httpx.Timeout(LLM_READ_TIMEOUT, connect=LLM_CONNECT_TIMEOUT)
+
+# HTTP/2 multiplexes concurrent requests over one connection, but httpx only
+# supports it with the optional h2 package installed.
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+_http2_warned = False
+
+
+def _build_limits(max_connections: int, max_keepalive_connections: int) -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=max_connections,
+        max_keepalive_connections=max_keepalive_connections,
+        keepalive_expiry=DEFAULT_KEEPALIVE_EXPIRY,
+    )
+
+def _use_http2(http2: Optional[bool]) -> bool:
+    global _http2_warned
+    wanted = LLM_HTTP2 if http2 is None else http2
+    if wanted and not HTTP2_AVAILABLE and not _http2_warned:
+        _http2_warned = True
+        logger.warning("HTTP/2 requested (LLM_HTTP2=1) but the h2 package is missing, using HTTP/1.1; "
+                       "install httpx[http2]")
+    return HTTP2_AVAILABLE and wanted
+
+def build_httpx_client(
+    max_connections: int = DEFAULT_MAX_CONNECTIONS,
+    max_keepalive_connections: int = DEFAULT_MAX_KEEPALIVE_CONNECTIONS,
+    event_hooks: Optional[dict] = None,
+    timeout: httpx.Timeout = DEFAULT_TIMEOUT,
+    http2: Optional[bool] = None,
+) -> httpx.Client:
     """
     Builds a synchronous httpx client.
     """
     return httpx.Client(
-        timeout=300.0,
+        timeout=timeout,
         follow_redirects=True,
+        limits=_build_limits(max_connections, max_keepalive_connections),
+        event_hooks=event_hooks,
+        http2=_use_http2(http2),
     )
 
-def build_async_httpx_client() -> httpx.AsyncClient:
+def build_async_httpx_client(
+    max_connections: int = DEFAULT_MAX_CONNECTIONS,
+    max_keepalive_connections: int = DEFAULT_MAX_KEEPALIVE_CONNECTIONS,
+    event_hooks: Optional[dict] = None,
+    timeout: httpx.Timeout = DEFAULT_TIMEOUT,
+    http2: Optional[bool] = None,
+) -> httpx.AsyncClient:
     """
-    Builds an asynchronous httpx client.
+    Builds an asynchronous httpx client with a keep-alive connection pool.
     """
     return httpx.AsyncClient(
-        timeout=300.0,
+        timeout=timeout,
         follow_redirects=True,
+        limits=_build_limits(max_connections, max_keepalive_connections),
+        event_hooks=event_hooks,
+        http2=_use_http2(http2),
     )
 
-def run_chat(prompt: str, model: str = None, temperature: float = 0.7):
+def _prompt_text(messages) -> str:
+    return "".join(str(m.get("content") or "") for m in messages)
+
+def _lookup_cache(client, use_cache: bool, params: dict):
+    if not use_cache or not response_cache.cacheable(params):
+        return None, None
+    key = response_cache.make_key(client.base_url, params)
+    return key, response_cache.get(key)
+
+def _record_response(response: dict, key, limiter, reserved: int):
+    usage = response.get("usage") or {}
+    record("prompt_tokens", usage.get("prompt_tokens"))
+    record("completion_tokens", usage.get("completion_tokens"))
+    if limiter is not None:
+        limiter.record_usage(reserved, usage.get("total_tokens"))
+    if key is not None:
+        response_cache.set(key, response)
+
+def _timeout_options(timeout) -> dict:
+    # Passing timeout=None to the SDK would disable the client timeout altogether
+    return {} if timeout is None else {"timeout": timeout}
+
+class _StreamCollector:
+    """Assembles the chunks of one streamed completion into a chat.completion dict."""
+
+    def __init__(self, stop_when, prompt: str, started: float):
+        self.parser = stop_when() if stop_when is not None else None
+        self.prompt = prompt
+        self.started = started
+        self.parts = []
+        self.first = None
+        self.finish_reason = None
+        self.usage = None
+        self.stopped = False
+
+    def add(self, chunk) -> bool:
+        """Take one chunk; True once the caller should close the stream."""
+        if self.first is None:
+            self.first = chunk
+        if chunk.usage is not None:
+            self.usage = chunk.usage.model_dump()
+        for choice in chunk.choices:
+            if choice.index != 0:
+                continue
+            delta = choice.delta.content if choice.delta is not None else None
+            if delta:
+                if not self.parts:
+                    record("ttft_seconds", time.perf_counter() - self.started)
+                self.parts.append(delta)
+                if self.parser is not None and self.parser.feed(delta):
+                    self.stopped = True
+            if choice.finish_reason:
+                self.finish_reason = choice.finish_reason
+        return self.stopped
+
+    def response(self) -> dict:
+        content = "".join(self.parts)
+        usage = self.usage
+        if usage is None:
+            # Closed before the final usage chunk, or the server does not send one
+            prompt_tokens = estimate_tokens(self.prompt)
+            completion_tokens = estimate_tokens(content)
+            usage = {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+                "estimated": True,
+            }
+        if self.stopped:
+            record("early_stops", 1)
+        first = self.first
+        return {
+            "id": first.id if first is not None else None,
+            "object": "chat.completion",
+            "created": first.created if first is not None else int(time.time()),
+            "model": first.model if first is not None else None,
+            "choices": [{
+                "index": 0,
+                "finish_reason": "stop" if self.stopped else self.finish_reason,
+                "message": {"role": "assistant", "content": content},
+            }],
+            "usage": usage,
+        }
+
+def _timeout_after_limiter(sent: bool, timeout):
+    # The limiter wait counts against the rollout's deadline budget
+    if not sent:
+        raise DeadlineExceeded("LLM deadline budget exhausted waiting for the rate limiter")
+    return timeout if timeout is None else resilient_caller.remaining_timeout()
+
+def _stream_options(stream: bool) -> dict:
+    return {"stream": True, "stream_options": {"include_usage": True}} if stream else {}
+
+def create_chat_completion(client: OpenAI, limiter=None, use_cache: bool = True, stop_when=None, **params) -> dict:
+    """
+    Runs a chat completion through the response cache and returns it as a dict.
+
+    The rate limiter is only consulted on a cache miss, so cached answers do
+    not spend request budget. Misses go through resilient_caller: retries with
+    backoff, the deadline budget of the enclosing rollout, optional hedging.
+    With use_cache, a miss identical to a call already in flight waits for
+    that call instead (single_flight).
+
+    stream=True streams the completion and returns the same dict, cached and
+    coalesced like a plain call. `stop_when` builds, per attempt, an object
+    whose feed(delta) is given every content delta (e.g. output_codec's
+    StreamingParser); the stream is closed as soon as it returns True.
+    """
+    stream = params.pop("stream", False)
+    key, cached = _lookup_cache(client, use_cache, params)
+    if cached is not None:
+        record("cache_hits", 1)
+        return cached
+    reserved = estimate_tokens(_prompt_text(params.get("messages", []))) if limiter is not None else 0
+
+    def attempt(timeout):
+        if limiter is not None:
+            started = time.perf_counter()
+            sent = limiter.wait(reserved, max_wait=remaining_budget())
+            record("limiter_wait_seconds", time.perf_counter() - started)
+            timeout = _timeout_after_limiter(sent, timeout)
+        sent_at = time.perf_counter()
+        response = client.chat.completions.create(**params, **_stream_options(stream), **_timeout_options(timeout))
+        if not stream:
+            return response.model_dump()
+        collector = _StreamCollector(stop_when, _prompt_text(params.get("messages", [])), sent_at)
+        with response:
+            for chunk in response:
+                if collector.add(chunk):
+                    break
+        return collector.response()
+
+    def call():
+        record("llm_requests", 1)
+        started = time.perf_counter()
+        response = resilient_caller.call(attempt, endpoint=str(client.base_url))
+        record("llm_seconds", time.perf_counter() - started)
+        _record_response(response, key, limiter, reserved)
+        return response
+
+    return single_flight.do(single_flight.key_for(client.base_url, params, use_cache), call)
+
+async def acreate_chat_completion(client: AsyncOpenAI, limiter=None, use_cache: bool = True, stop_when=None,
+                                  **params) -> dict:
     """
-    Simple wrapper for OpenAI chat completions.
+    Async counterpart of create_chat_completion().
+    """
+    stream = params.pop("stream", False)
+    key, cached = _lookup_cache(client, use_cache, params)
+    if cached is not None:
+        record("cache_hits", 1)
+        return cached
+    reserved = estimate_tokens(_prompt_text(params.get("messages", []))) if limiter is not None else 0
+
+    async def attempt(timeout):
+        if limiter is not None:
+            started = time.perf_counter()
+            sent = await limiter.async_wait(reserved, max_wait=remaining_budget())
+            record("limiter_wait_seconds", time.perf_counter() - started)
+            timeout = _timeout_after_limiter(sent, timeout)
+        sent_at = time.perf_counter()
+        response = await client.chat.completions.create(**params, **_stream_options(stream), **_timeout_options(timeout))
+        if not stream:
+            return response.model_dump()
+        collector = _StreamCollector(stop_when, _prompt_text(params.get("messages", [])), sent_at)
+        async with response:
+            async for chunk in response:
+                if collector.add(chunk):
+                    break
+        return collector.response()
+
+    async def call():
+        record("llm_requests", 1)
+        started = time.perf_counter()
+        response = await resilient_caller.acall(attempt, endpoint=str(client.base_url))
+        record("llm_seconds", time.perf_counter() - started)
+        _record_response(response, key, limiter, reserved)
+        return response
+
+    return await single_flight.ado(single_flight.key_for(client.base_url, params, use_cache), call)
+
+def run_chat(prompt: str, model: str = None, temperature: float = 0.7, **params):
+    """
+    Simple wrapper for OpenAI chat completions; extra params go to create_chat_completion.
     """
     from settings import BASE_CONFIG
-    client = OpenAI(
-        api_key=BASE_CONFIG.api_key,
-        base_url=BASE_CONFIG.base_url,
-        http_client=build_httpx_client()
-    )
-    response = client.chat.completions.create(
+    from src.client.registry import client_registry
+
+    client = client_registry.get_client(BASE_CONFIG.api_key, BASE_CONFIG.base_url)
+    return create_chat_completion(
+        client,
         model=model or BASE_CONFIG.model_name,
         messages=[{"role": "user", "content": prompt}],
-        temperature=temperature
+        temperature=temperature,
+        **params,
     )
-    return response.model_dump()
@@ -0,0 +1,190 @@
+import asyncio
+import os
+import threading
+import time
+import weakref
+from typing import Optional
+
+from openai import AsyncOpenAI, OpenAI
+
+from src.client.openai_httpx import build_async_httpx_client, build_httpx_client
+from src.utils.telemetry import record
+
+_START_KEY = "registry_started_at"
+
+
+class ClientMetrics:
+    """Request counters of one registry client, fed by httpx event hooks."""
+
+    def __init__(self, label: str):
+        self.label = label
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.responses = 0
+        self.status = {}
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+
+    def on_request(self, request):
+        request.extensions[_START_KEY] = time.perf_counter()
+        record("http_requests", 1)
+        with self._lock:
+            self.requests += 1
+
+    def on_response(self, response):
+        started = response.request.extensions.get(_START_KEY)
+        # Time to response headers; the body may still be streaming
+        elapsed = time.perf_counter() - started if started is not None else 0.0
+        status = f"{response.status_code // 100}xx"
+        record("headers_seconds", elapsed)
+        with self._lock:
+            self.responses += 1
+            self.status[status] = self.status.get(status, 0) + 1
+            self.total_seconds += elapsed
+            self.max_seconds = max(self.max_seconds, elapsed)
+
+    def event_hooks(self, asynchronous: bool) -> dict:
+        if not asynchronous:
+            return {"request": [self.on_request], "response": [self.on_response]}
+
+        async def on_request(request):
+            self.on_request(request)
+
+        async def on_response(response):
+            self.on_response(response)
+
+        return {"request": [on_request], "response": [on_response]}
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "responses": self.responses,
+                # Requests without a response failed below HTTP (connect/read errors)
+                "transport_errors": self.requests - self.responses,
+                "status": dict(self.status),
+                "mean_seconds": self.total_seconds / self.responses if self.responses else 0.0,
+                "max_seconds": self.max_seconds,
+            }
+
+
+class ClientRegistry:
+    """
+    Process-wide OpenAI clients, one per (base_url, api_key).
+
+    Sync clients are shared by every thread. Async clients are additionally
+    kept per running event loop, since httpx async pools are bound to the
+    loop they were first used on and each agentlightning runner thread drives
+    its own loop. Clients requested outside a loop share one loop-less slot.
+    Clients of a closed loop are dropped on the next lookup (their sockets
+    close when they are collected); call aclose() before a loop ends to
+    close its clients cleanly.
+
+    `request_hooks` adds extra async httpx request hooks (e.g. the shared
+    rate limiter for clients handed to agentlightning, which bypass
+    create_chat_completion); they are part of the client key.
+
+    SDK retries are off by default because create_chat_completion retries
+    through src/client/resilience.py; clients handed to code that calls the
+    SDK directly should pass `max_retries`.
+
+    A forked runner process starts with no clients: pooled keep-alive
+    connections inherited from the parent are sockets both processes would
+    read responses from.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._clients = {}
+        self._loop_clients = weakref.WeakKeyDictionary()
+        self._metrics = {}
+        self._pid = os.getpid()
+
+    def _clients_here(self) -> dict:
+        # Callers hold self._lock. The parent's clients are dropped, not closed:
+        # closing would shut sockets the parent still uses.
+        if self._pid != os.getpid():
+            self._clients = {}
+            self._loop_clients = weakref.WeakKeyDictionary()
+            self._pid = os.getpid()
+        return self._clients
+
+    def _async_clients_here(self, loop) -> dict:
+        # Callers hold self._lock
+        clients = self._clients_here()
+        if loop is None:
+            return clients
+        for closed in [other for other in self._loop_clients.keys() if other.is_closed()]:
+            del self._loop_clients[closed]
+        return self._loop_clients.setdefault(loop, {})
+
+    def _metrics_for(self, kind: str, base_url: Optional[str]) -> ClientMetrics:
+        label = f"{kind} {base_url or 'default'}"
+        metrics = self._metrics.get(label)
+        if metrics is None:
+            metrics = self._metrics[label] = ClientMetrics(label)
+        return metrics
+
+    def get_client(self, api_key: Optional[str], base_url: Optional[str], max_retries: int = 0) -> OpenAI:
+        key = ("sync", base_url, api_key, max_retries)
+        with self._lock:
+            clients = self._clients_here()
+            client = clients.get(key)
+            if client is None:
+                metrics = self._metrics_for("sync", base_url)
+                client = OpenAI(
+                    api_key=api_key,
+                    base_url=base_url,
+                    max_retries=max_retries,
+                    http_client=build_httpx_client(event_hooks=metrics.event_hooks(asynchronous=False)),
+                )
+                clients[key] = client
+        return client
+
+    def get_async_client(self, api_key: Optional[str], base_url: Optional[str],
+                         request_hooks: tuple = (), max_retries: int = 0) -> AsyncOpenAI:
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        key = ("async", base_url, api_key, tuple(request_hooks), max_retries)
+        with self._lock:
+            clients = self._async_clients_here(loop)
+            client = clients.get(key)
+            if client is None:
+                metrics = self._metrics_for("async", base_url)
+                event_hooks = metrics.event_hooks(asynchronous=True)
+                event_hooks["request"] = list(request_hooks) + event_hooks["request"]
+                client = AsyncOpenAI(
+                    api_key=api_key,
+                    base_url=base_url,
+                    max_retries=max_retries,
+                    http_client=build_async_httpx_client(event_hooks=event_hooks),
+                )
+                clients[key] = client
+        return client
+
+    def metrics(self) -> dict:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {m.label: m.snapshot() for m in metrics}
+
+    def close(self):
+        """Close the sync clients; async clients are closed by aclose() on their loop."""
+        with self._lock:
+            clients = [c for k, c in self._clients_here().items() if k[0] == "sync"]
+            self._clients = {k: c for k, c in self._clients.items() if k[0] != "sync"}
+        for client in clients:
+            client.close()
+
+    async def aclose(self):
+        """Close the async clients of the running event loop."""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            self._clients_here()
+            clients = list(self._loop_clients.pop(loop, {}).values())
+        for client in clients:
+            await client.close()
+
+
+client_registry = ClientRegistry()
@@ -0,0 +1,323 @@
+import asyncio
+import contextvars
+import email.utils
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from typing import Optional
+
+import httpx
+import openai
+
+from settings import (
+    LLM_CONNECT_TIMEOUT,
+    LLM_HEDGE,
+    LLM_HEDGE_MIN_DELAY,
+    LLM_HEDGE_QUANTILE,
+    LLM_MAX_CONNECTIONS,
+    LLM_READ_TIMEOUT,
+    LLM_RETRY_ATTEMPTS,
+    LLM_RETRY_BASE_DELAY,
+    LLM_RETRY_MAX_DELAY,
+)
+from src.utils.telemetry import record
+
+
+class DeadlineExceeded(TimeoutError):
+    """The time budget ran out before the call could succeed."""
+
+
+_deadline = contextvars.ContextVar("llm_deadline", default=None)
+
+
+@contextmanager
+def deadline_budget(seconds: Optional[float]):
+    """
+    LLM calls made inside the block share `seconds` of wall time.
+
+    None or <= 0 sets no budget; a nested budget can only tighten the outer one.
+    """
+    if not seconds or seconds <= 0:
+        yield
+        return
+    deadline = time.monotonic() + seconds
+    outer = _deadline.get()
+    token = _deadline.set(deadline if outer is None else min(outer, deadline))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining_budget() -> Optional[float]:
+    """Seconds left in the enclosing deadline_budget(), None without one."""
+    deadline = _deadline.get()
+    return None if deadline is None else max(0.0, deadline - time.monotonic())
+
+
+def _retryable(error: BaseException) -> bool:
+    # APITimeoutError is an APIConnectionError
+    if isinstance(error, openai.APIConnectionError):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in (408, 409, 429) or error.status_code >= 500
+    return False
+
+
+def retry_after(error: BaseException) -> Optional[float]:
+    """Seconds the server asked us to wait (Retry-After / retry-after-ms), if any."""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return max(0.0, float(value) / 1000)
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class LatencyTracker:
+    """Latencies of the last `window` successful attempts against one endpoint."""
+
+    def __init__(self, window: int = 256, min_samples: int = 20):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.min_samples = min_samples
+
+    def observe(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def quantile(self, q: float) -> Optional[float]:
+        """None until min_samples latencies have been seen."""
+        with self._lock:
+            if len(self._samples) < self.min_samples:
+                return None
+            ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def _check_attempts(attempts: int) -> int:
+    # attempts=0 would return None from call() without ever sending the request
+    if attempts < 1:
+        raise ValueError(f"LLM retry attempts must be >= 1, got {attempts}")
+    return attempts
+
+
+class ResilientCaller:
+    """
+    Retries, deadline budgets and hedging around one logical LLM call.
+
+    `attempt(timeout)` performs a single request (limiter wait included) with
+    the given per-attempt httpx timeout, or the client default when None.
+
+    - Retryable errors (connection errors, timeouts, 408/409/429/5xx) are
+      retried up to `attempts` times with full-jitter exponential backoff,
+      never sooner than the server's Retry-After.
+    - Inside deadline_budget() every attempt's timeout and every backoff is
+      clipped to the remaining budget; once it is spent DeadlineExceeded is
+      raised instead of stalling the runner.
+    - With hedging on, an attempt still running after the hedge quantile of
+      recent latencies for its endpoint gets a duplicate request, and the
+      first successful answer wins. Async losers are cancelled; sync losers
+      finish in the background (bounded by their timeout) and are ignored.
+    """
+
+    def __init__(self, attempts: int = LLM_RETRY_ATTEMPTS, base_delay: float = LLM_RETRY_BASE_DELAY,
+                 max_delay: float = LLM_RETRY_MAX_DELAY, hedge: bool = LLM_HEDGE,
+                 hedge_quantile: float = LLM_HEDGE_QUANTILE, hedge_min_delay: float = LLM_HEDGE_MIN_DELAY):
+        self.attempts = _check_attempts(attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_delay = hedge_min_delay
+        self._lock = threading.Lock()
+        self._trackers = {}
+        self._executor = None
+        self._counters = dict.fromkeys(
+            ("calls", "retries", "hedges", "hedge_wins", "deadline_exceeded", "failures"), 0)
+
+    def configure(self, attempts: int = None, hedge: bool = None, hedge_quantile: float = None):
+        if attempts is not None:
+            self.attempts = _check_attempts(attempts)
+        if hedge is not None:
+            self.hedge = hedge
+        if hedge_quantile is not None:
+            self.hedge_quantile = hedge_quantile
+
+    def _count(self, key: str):
+        with self._lock:
+            self._counters[key] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._counters)
+
+    def _tracker(self, endpoint) -> LatencyTracker:
+        with self._lock:
+            tracker = self._trackers.get(endpoint)
+            if tracker is None:
+                tracker = self._trackers[endpoint] = LatencyTracker()
+            return tracker
+
+    def _hedge_delay(self, tracker: LatencyTracker) -> Optional[float]:
+        if not self.hedge:
+            return None
+        latency = tracker.quantile(self.hedge_quantile)
+        return None if latency is None else max(latency, self.hedge_min_delay)
+
+    def backoff(self, retry: int, error: BaseException) -> float:
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** retry))
+        hint = retry_after(error)
+        return delay if hint is None else max(delay, hint)
+
+    def _timeout(self, deadline: Optional[float]) -> Optional[httpx.Timeout]:
+        if deadline is None:
+            return None
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            self._count("deadline_exceeded")
+            raise DeadlineExceeded("LLM deadline budget exhausted")
+        return httpx.Timeout(min(remaining, LLM_READ_TIMEOUT), connect=min(remaining, LLM_CONNECT_TIMEOUT))
+
+    def remaining_timeout(self) -> Optional[httpx.Timeout]:
+        """Per-attempt timeout for a request sent now, clipped to the deadline budget."""
+        return self._timeout(_deadline.get())
+
+    def _next_delay(self, retry: int, error: BaseException, deadline: Optional[float]) -> float:
+        """Backoff before the next attempt; re-raises when no attempt is left."""
+        if not _retryable(error) or retry + 1 >= self.attempts:
+            self._count("failures")
+            raise error
+        delay = self.backoff(retry, error)
+        if deadline is not None and time.monotonic() + delay >= deadline:
+            self._count("deadline_exceeded")
+            raise DeadlineExceeded(f"LLM deadline budget exhausted after {retry + 1} attempts") from error
+        self._count("retries")
+        return delay
+
+    def _start_hedge(self):
+        self._count("hedges")
+        record("hedges", 1)
+
+    def _executor_pool(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=LLM_MAX_CONNECTIONS, thread_name_prefix="llm-hedge")
+            return self._executor
+
+    def call(self, attempt, endpoint=None):
+        self._count("calls")
+        deadline = _deadline.get()
+        tracker = self._tracker(endpoint)
+        for retry in range(self.attempts):
+            started = time.monotonic()
+            try:
+                result = self._hedged(attempt, deadline, tracker)
+            except DeadlineExceeded:
+                raise
+            except Exception as error:
+                time.sleep(self._next_delay(retry, error, deadline))
+                continue
+            tracker.observe(time.monotonic() - started)
+            return result
+
+    def _hedged(self, attempt, deadline, tracker):
+        timeout = self._timeout(deadline)
+        delay = self._hedge_delay(tracker)
+        if delay is None:
+            return attempt(timeout)
+        pool = self._executor_pool()
+        # Each attempt runs in its own copy of the caller's context (rollout metrics, budget)
+        primary = pool.submit(contextvars.copy_context().run, attempt, timeout)
+        done, _ = wait([primary], timeout=delay)
+        if done:
+            return primary.result()
+        try:
+            hedge_timeout = self._timeout(deadline)
+        except DeadlineExceeded:
+            return primary.result()
+        self._start_hedge()
+        hedge = pool.submit(contextvars.copy_context().run, attempt, hedge_timeout)
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        self._count("hedge_wins")
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    async def acall(self, attempt, endpoint=None):
+        """Async counterpart of call(); `attempt(timeout)` returns an awaitable."""
+        self._count("calls")
+        deadline = _deadline.get()
+        tracker = self._tracker(endpoint)
+        for retry in range(self.attempts):
+            started = time.monotonic()
+            try:
+                result = await self._ahedged(attempt, deadline, tracker)
+            except DeadlineExceeded:
+                raise
+            except Exception as error:
+                await asyncio.sleep(self._next_delay(retry, error, deadline))
+                continue
+            tracker.observe(time.monotonic() - started)
+            return result
+
+    async def _ahedged(self, attempt, deadline, tracker):
+        timeout = self._timeout(deadline)
+        delay = self._hedge_delay(tracker)
+        if delay is None:
+            return await attempt(timeout)
+        primary = asyncio.ensure_future(attempt(timeout))
+        tasks = [primary]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if done:
+                return primary.result()
+            try:
+                hedge_timeout = self._timeout(deadline)
+            except DeadlineExceeded:
+                return await primary
+            self._start_hedge()
+            hedge = asyncio.ensure_future(attempt(hedge_timeout))
+            tasks.append(hedge)
+            pending = set(tasks)
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            self._count("hedge_wins")
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+
+resilient_caller = ResilientCaller()
@@ -0,0 +1,141 @@
+import hashlib
+import json
+import threading
+import time
+from typing import Optional
+
+from settings import (
+    LLM_CACHE_DETERMINISTIC_ONLY,
+    LLM_CACHE_ENABLED,
+    LLM_CACHE_MAX_AGE,
+    LLM_CACHE_MAX_BYTES,
+    LLM_CACHE_PATH,
+)
+from src.utils.sqlite_store import ThreadLocalSQLite
+
+_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS responses ("
+    "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+    "created_at REAL NOT NULL, accessed_at REAL NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS idx_responses_accessed ON responses (accessed_at)",
+)
+
+# Request fields that never change the completion and must stay out of the key
+_NON_KEY_PARAMS = {"stream", "stream_options", "timeout", "extra_headers", "user"}
+
+
+class ResponseCache:
+    """
+    Persistent, content-addressed cache of chat completion responses.
+
+    Entries are keyed on a hash of (base_url, model, messages, sampling params)
+    and stored in SQLite so that reruns, resumed runs and beam rounds that send
+    byte-identical prompts are answered locally. Old entries are dropped by
+    age, then least-recently-used entries until the store fits in max_bytes.
+    """
+
+    # Run eviction every N writes rather than on every write
+    EVICT_EVERY = 200
+
+    def __init__(self, path=None, max_bytes=None, max_age=None, enabled=None, deterministic_only=None):
+        self.path = path or LLM_CACHE_PATH
+        self.max_bytes = max_bytes if max_bytes is not None else LLM_CACHE_MAX_BYTES
+        self.max_age = max_age if max_age is not None else LLM_CACHE_MAX_AGE
+        self.enabled = enabled if enabled is not None else LLM_CACHE_ENABLED
+        self.deterministic_only = (
+            deterministic_only if deterministic_only is not None else LLM_CACHE_DETERMINISTIC_ONLY
+        )
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self._db = ThreadLocalSQLite(self.path, _SCHEMA)
+        self._lock = threading.Lock()
+
+    def cacheable(self, params: dict) -> bool:
+        if not self.enabled or params.get("stream"):
+            return False
+        if self.deterministic_only:
+            # Without an explicit temperature the provider default applies, which samples
+            temperature = params.get("temperature")
+            if temperature is None or temperature > 0:
+                return False
+        return True
+
+    def make_key(self, base_url, params: dict) -> str:
+        keyed = {k: v for k, v in params.items() if k not in _NON_KEY_PARAMS}
+        raw = json.dumps(
+            {"base_url": str(base_url or "").rstrip("/"), "params": keyed},
+            ensure_ascii=False,
+            sort_keys=True,
+            default=str,
+        )
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key) -> Optional[dict]:
+        conn = self._db.connect()
+        now = time.time()
+        row = conn.execute("SELECT value, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None or (self.max_age > 0 and now - row[1] > self.max_age):
+            with self._lock:
+                self.misses += 1
+            return None
+        conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+        conn.commit()
+        with self._lock:
+            self.hits += 1
+        return json.loads(row[0])
+
+    def set(self, key, response: dict):
+        value = json.dumps(response, ensure_ascii=False)
+        now = time.time()
+        conn = self._db.connect()
+        conn.execute(
+            "INSERT OR REPLACE INTO responses (key, value, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+            (key, value, len(value), now, now),
+        )
+        conn.commit()
+        with self._lock:
+            self.stores += 1
+            should_evict = self.stores % self.EVICT_EVERY == 0
+        if should_evict:
+            self.evict()
+
+    def evict(self):
+        conn = self._db.connect()
+        removed = 0
+        if self.max_age > 0:
+            removed += conn.execute(
+                "DELETE FROM responses WHERE created_at < ?", (time.time() - self.max_age,)
+            ).rowcount
+        if self.max_bytes > 0:
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            if total > self.max_bytes:
+                excess = total - self.max_bytes
+                rows = conn.execute("SELECT key, size FROM responses ORDER BY accessed_at").fetchall()
+                stale = []
+                for key, size in rows:
+                    if excess <= 0:
+                        break
+                    stale.append((key,))
+                    excess -= size
+                conn.executemany("DELETE FROM responses WHERE key = ?", stale)
+                removed += len(stale)
+        conn.commit()
+        with self._lock:
+            self.evictions += removed
+        return removed
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "stores": self.stores,
+            "evictions": self.evictions,
+        }
+
+
+# Global response cache instance
+response_cache = ResponseCache()
@@ -0,0 +1,134 @@
+import asyncio
+import copy
+import threading
+from concurrent.futures import Future
+from typing import Optional
+
+from settings import LLM_COALESCE
+from src.client.resilience import DeadlineExceeded, remaining_budget
+from src.client.response_cache import response_cache
+from src.utils.telemetry import record
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical chat calls into one upstream request.
+
+    The first caller for a key (the leader) makes the call; callers arriving
+    while it is in flight wait for its response and get a copy of it. The
+    table is process-wide and the shared future is a concurrent.futures
+    Future, so sync runner threads and the event loops of async runners
+    (shared-memory runners are threads of one process) all join the same
+    call. Only successes are shared: when the leader fails or is cancelled,
+    every follower makes its own call, so one rollout's deadline or
+    cancellation never leaks into another. A follower waits at most for the
+    rest of its own deadline_budget() and then raises DeadlineExceeded,
+    however long the leader's call may take.
+    """
+
+    def __init__(self, enabled: bool = None):
+        self.enabled = enabled if enabled is not None else LLM_COALESCE
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self.leaders = 0
+        self.coalesced = 0
+        self.fallbacks = 0
+        self.deadline_exceeded = 0
+
+    def key_for(self, base_url, params: dict, use_cache: bool = True) -> Optional[str]:
+        """Coalescing key, or None for calls that must reach the model themselves."""
+        # use_cache=False marks calls whose own LLM span matters (training rollouts).
+        # Streamed calls arrive here without `stream` and are coalesced like plain ones.
+        if not self.enabled or not use_cache:
+            return None
+        return response_cache.make_key(base_url, params)
+
+    def _join(self, key: str):
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return future, False
+            future = self._inflight[key] = Future()
+            self.leaders += 1
+            return future, True
+
+    def _finish(self, key: str, future: Future, result=None, error: BaseException = None):
+        with self._lock:
+            self._inflight.pop(key, None)
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def _fallback(self):
+        with self._lock:
+            self.fallbacks += 1
+
+    def _follower_failed(self, error: BaseException):
+        """Raise for a follower whose wait ended without the leader's result."""
+        if isinstance(error, TimeoutError):
+            with self._lock:
+                self.deadline_exceeded += 1
+            raise DeadlineExceeded("LLM deadline budget exhausted waiting for a coalesced call") from error
+        raise error
+
+    def do(self, key: Optional[str], call):
+        if key is None:
+            return call()
+        future, leader = self._join(key)
+        if not leader:
+            record("coalesced", 1)
+            try:
+                return copy.deepcopy(future.result(timeout=remaining_budget()))
+            except BaseException as e:
+                # Not done: this follower's own deadline ran out, or it was interrupted
+                if not future.done():
+                    self._follower_failed(e)
+                self._fallback()
+                return call()
+        try:
+            result = call()
+        except BaseException as e:
+            self._finish(key, future, error=e)
+            raise
+        self._finish(key, future, result)
+        return result
+
+    async def ado(self, key: Optional[str], call):
+        """Async counterpart of do(); `call()` returns an awaitable."""
+        if key is None:
+            return await call()
+        future, leader = self._join(key)
+        if not leader:
+            record("coalesced", 1)
+            try:
+                # shield: a cancelled or timed-out follower must not cancel the shared future
+                shared = asyncio.shield(asyncio.wrap_future(future))
+                return copy.deepcopy(await asyncio.wait_for(shared, remaining_budget()))
+            except BaseException as e:
+                # Not done: this follower's own deadline ran out, or it was cancelled
+                if not future.done():
+                    self._follower_failed(e)
+                self._fallback()
+                return await call()
+        try:
+            result = await call()
+        except BaseException as e:
+            self._finish(key, future, error=e)
+            raise
+        self._finish(key, future, result)
+        return result
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "leaders": self.leaders,
+                "coalesced": self.coalesced,
+                "fallbacks": self.fallbacks,
+                "deadline_exceeded": self.deadline_exceeded,
+                "in_flight": len(self._inflight),
+            }
+
+
+single_flight = SingleFlight()
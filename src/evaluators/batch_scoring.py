@@ -0,0 +1,219 @@
+import argparse
+import json
+import sys
+
+import numpy as np
+
+from src.evaluators.llm_judge import _extract_roles_from_string, _extract_roles_from_structured
+
+# Known roles come first so report columns are stable; unseen roles are appended
+KNOWN_ROLES = (
+    "subject",
+    "publisher",
+    "author",
+    "content_descriptor",
+    "filter_time",
+    "prediction_time",
+    "context",
+)
+NONE_ROLE = "<none>"
+
+
+def _safe_div(num, den):
+    num = np.asarray(num, dtype=np.float64)
+    den = np.asarray(den, dtype=np.float64)
+    return np.divide(num, den, out=np.zeros_like(num), where=den > 0)
+
+
+class BatchScoreReport:
+    """
+    Scores of a whole prediction set against its gold labels.
+
+    `sample_f1` matches score_with_gold() item by item, so `mean_f1` is the
+    same number APO averages as reward. Micro scores pool every entity;
+    `macro_f1` averages the per-role F1 over roles that occur in gold or
+    predictions. `confusion[g, p]` counts entities with gold role g predicted
+    as p, where the extra last row/column is NONE_ROLE (missing on that side).
+    """
+
+    def __init__(self, roles, sample_f1, tp, pred_count, gold_count, confusion):
+        self.roles = roles
+        self.sample_f1 = sample_f1
+        self.n_samples = len(sample_f1)
+        self.mean_f1 = float(sample_f1.mean()) if self.n_samples else 0.0
+
+        self.micro_precision = float(_safe_div(tp.sum(), pred_count.sum()))
+        self.micro_recall = float(_safe_div(tp.sum(), gold_count.sum()))
+        self.micro_f1 = float(_safe_div(
+            2 * self.micro_precision * self.micro_recall, self.micro_precision + self.micro_recall
+        ))
+
+        self.precision = _safe_div(tp, pred_count)
+        self.recall = _safe_div(tp, gold_count)
+        self.f1 = _safe_div(2 * self.precision * self.recall, self.precision + self.recall)
+        self.support = gold_count
+        present = (gold_count + pred_count) > 0
+        self.macro_f1 = float(self.f1[present].mean()) if present.any() else 0.0
+        self.confusion = confusion
+
+    def per_role(self) -> dict:
+        return {
+            role: {
+                "precision": float(self.precision[i]),
+                "recall": float(self.recall[i]),
+                "f1": float(self.f1[i]),
+                "support": int(self.support[i]),
+            }
+            for i, role in enumerate(self.roles)
+        }
+
+    def to_dict(self) -> dict:
+        return {
+            "n_samples": self.n_samples,
+            "mean_f1": self.mean_f1,
+            "micro_precision": self.micro_precision,
+            "micro_recall": self.micro_recall,
+            "micro_f1": self.micro_f1,
+            "macro_f1": self.macro_f1,
+            "per_role": self.per_role(),
+            "confusion": {
+                "labels": [*self.roles, NONE_ROLE],
+                "matrix": self.confusion.tolist(),
+            },
+        }
+
+    def format(self) -> str:
+        lines = [
+            f"samples={self.n_samples} mean_f1={self.mean_f1:.4f} micro_f1={self.micro_f1:.4f} "
+            f"(p={self.micro_precision:.4f} r={self.micro_recall:.4f}) macro_f1={self.macro_f1:.4f}",
+            f"{'role':<20}{'precision':>10}{'recall':>10}{'f1':>10}{'support':>10}",
+        ]
+        for i, role in enumerate(self.roles):
+            lines.append(
+                f"{role:<20}{self.precision[i]:>10.4f}{self.recall[i]:>10.4f}{self.f1[i]:>10.4f}{int(self.support[i]):>10}"
+            )
+        labels = [*self.roles, NONE_ROLE]
+        width = max(len(label) for label in labels) + 2
+        lines.append("confusion (rows=gold, cols=pred):")
+        lines.append(" " * width + "".join(f"{label[:10]:>11}" for label in labels))
+        for i, label in enumerate(labels):
+            lines.append(f"{label:<{width}}" + "".join(f"{int(v):>11}" for v in self.confusion[i]))
+        return "\n".join(lines)
+
+
+def score_batch(predictions, golds=None, gold_structs=None) -> BatchScoreReport:
+    """
+    Score a batch of `id-role-confidence` predictions in one pass.
+
+    `golds` holds gold strings and `gold_structs` structured gold entities;
+    per item the structured gold wins, as in score_with_gold(). Parsing is
+    per item, everything after is vectorized over all (sample, entity) pairs.
+    """
+    n = len(predictions)
+    golds = golds if golds is not None else [None] * n
+    gold_structs = gold_structs if gold_structs is not None else [None] * n
+    if len(golds) != n or len(gold_structs) != n:
+        raise ValueError("predictions, golds and gold_structs must have the same length")
+
+    role_index = {role: i for i, role in enumerate(KNOWN_ROLES)}
+    sample_ids, gold_codes, pred_codes = [], [], []
+    empty_pred = np.zeros(n, dtype=bool)
+    empty_gold = np.zeros(n, dtype=bool)
+
+    for i in range(n):
+        if gold_structs[i] is not None:
+            gold_roles = _extract_roles_from_structured(gold_structs[i])
+        else:
+            gold_roles = _extract_roles_from_string(golds[i] or "")
+        pred_roles = _extract_roles_from_string(predictions[i] or "")
+        empty_gold[i] = not gold_roles
+        empty_pred[i] = not pred_roles
+        for entity_id in gold_roles.keys() | pred_roles.keys():
+            codes = []
+            for roles in (gold_roles, pred_roles):
+                role = roles.get(entity_id)
+                if role is None:
+                    codes.append(-1)
+                else:
+                    codes.append(role_index.setdefault(role, len(role_index)))
+            sample_ids.append(i)
+            gold_codes.append(codes[0])
+            pred_codes.append(codes[1])
+
+    roles = list(role_index)
+    n_roles = len(roles)
+    sample_ids = np.asarray(sample_ids, dtype=np.int64)
+    gold_codes = np.asarray(gold_codes, dtype=np.int64)
+    pred_codes = np.asarray(pred_codes, dtype=np.int64)
+
+    has_gold = gold_codes >= 0
+    has_pred = pred_codes >= 0
+    correct = has_gold & (gold_codes == pred_codes)
+
+    # Per-sample F1, with score_with_gold's conventions for empty sides
+    sample_correct = np.bincount(sample_ids, weights=correct, minlength=n)
+    sample_pred = np.bincount(sample_ids, weights=has_pred, minlength=n)
+    sample_gold = np.bincount(sample_ids, weights=has_gold, minlength=n)
+    precision = _safe_div(sample_correct, sample_pred)
+    recall = _safe_div(sample_correct, sample_gold)
+    sample_f1 = _safe_div(2 * precision * recall, precision + recall)
+    sample_f1[empty_gold != empty_pred] = 0.0
+    sample_f1[empty_gold & empty_pred] = 1.0
+
+    tp = np.bincount(gold_codes[correct], minlength=n_roles)
+    pred_count = np.bincount(pred_codes[has_pred], minlength=n_roles)
+    gold_count = np.bincount(gold_codes[has_gold], minlength=n_roles)
+
+    # Missing roles map to the extra NONE_ROLE slot
+    none_code = n_roles
+    rows = np.where(has_gold, gold_codes, none_code)
+    cols = np.where(has_pred, pred_codes, none_code)
+    confusion = np.bincount(rows * (n_roles + 1) + cols, minlength=(n_roles + 1) ** 2)
+    confusion = confusion.reshape(n_roles + 1, n_roles + 1)
+
+    return BatchScoreReport(roles, sample_f1, tp, pred_count, gold_count, confusion)
+
+
+def _load_gold(path):
+    golds, gold_structs, questions = [], [], []
+    with open(path, "r", encoding="utf-8") as file:
+        for line in file:
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            golds.append(item.get("gold") or item.get("output"))
+            gold_structs.append(item.get("gold_struct") or item.get("format_output"))
+            questions.append((item.get("input") or {}).get("question") or item.get("question"))
+    return golds, gold_structs, questions
+
+
+def _load_predictions(path, questions):
+    """Prediction files hold one {"question", "output"} object per line."""
+    by_question = {}
+    with open(path, "r", encoding="utf-8") as file:
+        for line in file:
+            if line.strip():
+                item = json.loads(line)
+                by_question[item.get("question")] = item.get("output")
+    return [by_question.get(question) for question in questions]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare prediction files against a gold jsonl")
+    parser.add_argument("gold", help="Gold jsonl (output / format_output per sample)")
+    parser.add_argument("predictions", nargs="+", help="Prediction jsonl files, one per prompt version")
+    parser.add_argument("--json", action="store_true", help="Print reports as JSON")
+    args = parser.parse_args()
+
+    golds, gold_structs, questions = _load_gold(args.gold)
+    for path in args.predictions:
+        report = score_batch(_load_predictions(path, questions), golds, gold_structs)
+        if args.json:
+            print(json.dumps({"predictions": path, **report.to_dict()}, ensure_ascii=False))
+        else:
+            print(f"== {path}")
+            print(report.format())
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,7 +1,10 @@
-from openai import OpenAI
+import json
+import re
 
-from settings import OPTIMIZER_CONFIG
-from src.client.openai_httpx import build_httpx_client
+from settings import JUDGE_BATCH_SIZE, OPTIMIZER_CONFIG
+from src.client.openai_httpx import create_chat_completion
+from src.client.registry import client_registry
+from src.utils.output_codec import parse_output
 
 
 RUBRIC = (
@@ -35,21 +38,7 @@ def _extract_roles_from_structured(entities: dict) -> dict:
 
 
 def _extract_roles_from_string(output: str) -> dict:
-    roles = {}
-    if not output:
-        return roles
-    for chunk in output.split("|"):
-        chunk = chunk.strip()
-        if not chunk:
-            continue
-        parts = chunk.split("-", 2)
-        if len(parts) < 2:
-            continue
-        entity_id = parts[0].strip()
-        role = parts[1].strip()
-        if entity_id and role:
-            roles[entity_id] = role
-    return roles
+    return parse_output(output).roles()
 
 
 def score_with_gold(output_json, gold=None, gold_struct=None) -> float:
@@ -74,12 +63,29 @@ def score_with_gold(output_json, gold=None, gold_struct=None) -> float:
     return 2 * precision * recall / (precision + recall)
 
 
-def llm_judge(question, entities, output_json, goal):
-    client = OpenAI(
-        api_key=OPTIMIZER_CONFIG.api_key,
-        base_url=OPTIMIZER_CONFIG.base_url,
-        http_client=build_httpx_client(),
+def _clamp_score(score: float) -> float:
+    if score < 0.0:
+        return 0.0
+    if score > 1.0:
+        return 1.0
+    return score
+
+
+def _judge_completion(prompt: str) -> str:
+    client = client_registry.get_client(OPTIMIZER_CONFIG.api_key, OPTIMIZER_CONFIG.base_url)
+
+    from src.utils.rate_limiter import limiter
+
+    resp = create_chat_completion(
+        client,
+        limiter=limiter,
+        model=OPTIMIZER_CONFIG.model_name,
+        messages=[{"role": "user", "content": prompt}],
     )
+    return resp["choices"][0]["message"]["content"]
+
+
+def llm_judge(question, entities, output_json, goal):
     prompt = (
         "你是评分器。\n"
         f"目标: {goal}\n"
@@ -90,20 +96,94 @@ def llm_judge(question, entities, output_json, goal):
         f"{JUDGE_GUIDE}\n"
         "只输出0~1小数。"
     )
-    
-    from src.utils.rate_limiter import limiter
-    limiter.wait()
+    try:
+        score = float(_judge_completion(prompt).strip())
+    except (AttributeError, TypeError, ValueError):
+        return 0.0
+    return _clamp_score(score)
 
-    resp = client.chat.completions.create(
-        model=OPTIMIZER_CONFIG.model_name,
-        messages=[{"role": "user", "content": prompt}],
+
+# "1: 0.8" / "[2] 0.75" / "样本3：1" ... one indexed score per line
+_INDEXED_SCORE_RE = re.compile(
+    r"^\s*(?:样本|#)?\s*[\[(]?\s*(\d+)\s*[\])]?\s*[:：.、=\-]?\s*(\d+(?:\.\d+)?|\.\d+)\s*$",
+    re.MULTILINE,
+)
+
+
+def _build_batch_prompt(items, goal) -> str:
+    samples = "\n".join(
+        f"### 样本 {index}\n"
+        f"用户问句: {question}\n"
+        f"已识别实体: {entities}\n"
+        f"模型输出: {output_json}\n"
+        for index, (question, entities, output_json) in enumerate(items, 1)
     )
+    return (
+        "你是评分器，请分别为下面每个样本的模型输出评分。\n"
+        f"目标: {goal}\n"
+        f"评分规则: {RUBRIC}\n"
+        f"{JUDGE_GUIDE}\n"
+        f"{samples}\n"
+        f"共 {len(items)} 个样本。每行输出一个结果，格式为 `序号: 分数`，分数为0~1小数，"
+        "按序号顺序输出，不要输出其他内容。"
+    )
+
+
+def parse_batch_scores(text, count: int) -> dict:
+    """
+    Scores of a batched judge reply as {index (0-based): score}.
+
+    Accepts `n: score` lines as well as a JSON list/object; indices outside
+    1..count and non-numeric scores are dropped, so a partial reply yields a
+    partial dict and the caller re-judges only what is missing.
+    """
+    scores = {}
+    if not text:
+        return scores
+    text = text.strip()
+    if text.startswith("```"):
+        text = text.strip("`").split("\n", 1)[-1]
     try:
-        score = float(resp.choices[0].message.content.strip())
-    except (TypeError, ValueError):
-        return 0.0
-    if score < 0.0:
-        return 0.0
-    if score > 1.0:
-        return 1.0
-    return score
+        decoded = json.loads(text)
+    except ValueError:
+        decoded = None
+    if isinstance(decoded, list) and len(decoded) == count:
+        pairs = enumerate(decoded, 1)
+    elif isinstance(decoded, dict):
+        pairs = decoded.items()
+    else:
+        pairs = _INDEXED_SCORE_RE.findall(text)
+    for index, score in pairs:
+        try:
+            index, score = int(index), float(score)
+        except (TypeError, ValueError):
+            continue
+        if 1 <= index <= count and index - 1 not in scores:
+            scores[index - 1] = _clamp_score(score)
+    return scores
+
+
+def llm_judge_batch(items, goal, batch_size: int = None) -> list:
+    """
+    Judge (question, entities, output_json) triples, `batch_size` per request.
+
+    Items whose score cannot be read from the batched reply (or whose
+    batch request fails) are re-judged one by one with llm_judge.
+    """
+    batch_size = max(1, batch_size or JUDGE_BATCH_SIZE)
+    items = list(items)
+    scores = [None] * len(items)
+    for start in range(0, len(items), batch_size):
+        chunk = items[start:start + batch_size]
+        if len(chunk) > 1:
+            try:
+                parsed = parse_batch_scores(_judge_completion(_build_batch_prompt(chunk, goal)), len(chunk))
+            except Exception as e:
+                print(f"批量评分失败，逐条评分: {e}")
+                parsed = {}
+            for offset, score in parsed.items():
+                scores[start + offset] = score
+        for offset, (question, entities, output_json) in enumerate(chunk):
+            if scores[start + offset] is None:
+                scores[start + offset] = llm_judge(question, entities, output_json, goal)
+    return scores
@@ -0,0 +1,93 @@
+import hashlib
+import json
+import threading
+import time
+from typing import Optional
+
+from settings import SCORE_STORE_ENABLED, SCORE_STORE_PATH
+from src.utils.sqlite_store import ThreadLocalSQLite
+
+_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS scores ("
+    "template_hash TEXT NOT NULL, sample_hash TEXT NOT NULL, model TEXT NOT NULL, "
+    "eval_mode TEXT NOT NULL, score REAL NOT NULL, created_at REAL NOT NULL, "
+    "PRIMARY KEY (template_hash, sample_hash, model, eval_mode))",
+)
+
+# Task fields that decide the score of a (prompt, sample) pair. Run-wide
+# connection details (base url, api key) are deliberately left out.
+_SAMPLE_FIELDS = ("question", "entities", "goal", "gold", "gold_struct", "human_score")
+
+
+def _digest(value) -> str:
+    raw = json.dumps(value, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def template_hash(template: str) -> str:
+    return hashlib.sha256((template or "").encode("utf-8")).hexdigest()
+
+
+def sample_hash(task) -> str:
+    return _digest({field: task.get(field) for field in _SAMPLE_FIELDS})
+
+
+class ScoreStore:
+    """
+    Persistent memo of rollout scores keyed by (template hash, sample hash,
+    rollout model, eval_mode), so re-scoring a prompt that was already
+    evaluated on the same sample in an earlier run costs nothing.
+    """
+
+    def __init__(self, path=None, enabled=None):
+        self.path = path or SCORE_STORE_PATH
+        self.enabled = enabled if enabled is not None else SCORE_STORE_ENABLED
+        self.hits = 0
+        self.misses = 0
+        self._db = ThreadLocalSQLite(self.path, _SCHEMA)
+        self._lock = threading.Lock()
+
+    def key_for(self, template: str, task) -> tuple:
+        return (
+            template_hash(template),
+            sample_hash(task),
+            str(task.get("model") or ""),
+            str(task.get("eval_mode", "llm")),
+        )
+
+    def get(self, key) -> Optional[float]:
+        if not self.enabled:
+            return None
+        row = self._db.connect().execute(
+            "SELECT score FROM scores WHERE template_hash = ? AND sample_hash = ? AND model = ? AND eval_mode = ?",
+            key,
+        ).fetchone()
+        with self._lock:
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return row[0]
+
+    def put(self, key, score: float):
+        if not self.enabled:
+            return
+        conn = self._db.connect()
+        conn.execute(
+            "INSERT OR REPLACE INTO scores "
+            "(template_hash, sample_hash, model, eval_mode, score, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (*key, float(score), time.time()),
+        )
+        conn.commit()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+# Global score store instance
+score_store = ScoreStore()
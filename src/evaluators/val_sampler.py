@@ -0,0 +1,120 @@
+import math
+import random
+from statistics import NormalDist
+
+from src.utils.output_codec import ENTITY_KEYS
+
+# ner_enterprise -> enterprise, ...
+_KIND_BY_KEY = {key: key[len("ner_"):] for key in ENTITY_KEYS}
+OTHER_STRATUM = "other"
+# Pseudo-observations of the pooled variance added to every stratum variance
+_PRIOR_WEIGHT = 2
+
+
+def stratum_of(task) -> str:
+    """
+    Stratum key of a validation task: the sorted set of `kind:role` pairs of
+    its gold entities (from gold_struct / format_output). Tasks without a
+    structured gold fall back to their entity kinds with role "?".
+    """
+    gold_struct = task.get("gold_struct")
+    source = gold_struct if isinstance(gold_struct, dict) else (task.get("entities") or {})
+    parts = set()
+    for key, kind in _KIND_BY_KEY.items():
+        for item in source.get(key) or []:
+            parts.add(f"{kind}:{item.get('role') or '?'}")
+    return "+".join(sorted(parts)) or "empty"
+
+
+class StratifiedSampler:
+    """
+    Nested stratified subsets of a validation set with a stratified CI.
+
+    Tasks are grouped by stratum_of(); strata with fewer than
+    `min_stratum_size` tasks are pooled into OTHER_STRATUM. `order` lists
+    every task index so that any prefix of it is a stratified subset: one
+    task of each stratum first (largest strata first), then always the
+    stratum furthest below its proportional share. Growing the subset thus
+    only ever adds tasks, and scores of a smaller subset stay valid.
+    """
+
+    def __init__(self, dataset, confidence: float = 0.95, min_stratum_size: int = 2, seed: int = 0):
+        self.size = len(dataset)
+        self.z = NormalDist().inv_cdf(0.5 + confidence / 2.0)
+
+        groups = {}
+        for index in range(self.size):
+            groups.setdefault(stratum_of(dataset[index]), []).append(index)
+        strata = {}
+        for key, indices in groups.items():
+            target = key if len(indices) >= min_stratum_size else OTHER_STRATUM
+            strata.setdefault(target, []).extend(indices)
+        rng = random.Random(seed)
+        for indices in strata.values():
+            rng.shuffle(indices)
+        self.strata = dict(sorted(strata.items(), key=lambda kv: (-len(kv[1]), kv[0])))
+        self.stratum_by_index = {i: key for key, indices in self.strata.items() for i in indices}
+        self.order = self._interleave()
+
+    def _interleave(self) -> list:
+        taken = {key: 0 for key in self.strata}
+        order = []
+        for key, indices in self.strata.items():
+            order.append(indices[0])
+            taken[key] = 1
+        while len(order) < self.size:
+            n = len(order) + 1
+            key = max(
+                (k for k in self.strata if taken[k] < len(self.strata[k])),
+                key=lambda k: len(self.strata[k]) * n / self.size - taken[k],
+            )
+            order.append(self.strata[key][taken[key]])
+            taken[key] += 1
+        return order
+
+    def take(self, start: int, stop: int) -> dict:
+        """Task indices of order[start:stop], grouped by stratum."""
+        chunk = {}
+        for index in self.order[start:stop]:
+            chunk.setdefault(self.stratum_by_index[index], []).append(index)
+        return chunk
+
+    def estimate(self, rewards: dict):
+        """
+        (mean, half_width) of the stratified mean over {stratum: [rewards]}.
+
+        Uses the finite-population correction per stratum, so the interval
+        shrinks to 0 once every task is scored. A stratum with a single
+        reward borrows the pooled variance of all rewards seen; small strata
+        are shrunk towards it so a few identical rewards do not claim zero
+        variance.
+        """
+        pooled = [r for values in rewards.values() for r in values]
+        if not pooled:
+            return 0.0, float("inf")
+        pooled_mean = sum(pooled) / len(pooled)
+        pooled_var = sum((r - pooled_mean) ** 2 for r in pooled) / max(1, len(pooled) - 1)
+        # Floor at the variance of a [0, 1] reward with one pseudo success and failure
+        smoothed = (sum(pooled) + 1.0) / (len(pooled) + 2.0)
+        pooled_var = max(pooled_var, smoothed * (1.0 - smoothed))
+        mean = 0.0
+        variance = 0.0
+        covered = 0.0
+        for key, indices in self.strata.items():
+            values = rewards.get(key) or []
+            weight = len(indices) / self.size
+            if not values:
+                # An unseen stratum can be anywhere in [0, 1]
+                variance += weight ** 2 * 0.25
+                continue
+            n = len(values)
+            stratum_mean = sum(values) / n
+            sample_var = sum((r - stratum_mean) ** 2 for r in values) / (n - 1) if n > 1 else 0.0
+            stratum_var = ((n - 1) * sample_var + _PRIOR_WEIGHT * pooled_var) / (n - 1 + _PRIOR_WEIGHT)
+            mean += weight * stratum_mean
+            covered += weight
+            variance += weight ** 2 * stratum_var / n * max(0.0, 1.0 - n / len(indices))
+        return mean / covered, self.z * math.sqrt(variance)
+
+    def describe(self) -> str:
+        return ", ".join(f"{key}={len(indices)}" for key, indices in self.strata.items())
@@ -0,0 +1,163 @@
+import json
+import mmap
+import os
+import struct
+from array import array
+from collections.abc import Sequence
+
+# Index file header: size and mtime (ns) of the jsonl it was built from
+_INDEX_HEADER = struct.Struct("<QQ")
+_INDEX_SUFFIX = ".idx"
+
+
+def _file_signature(path):
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def _scan_offsets(path) -> array:
+    offsets = array("Q")
+    position = 0
+    with open(path, "rb") as file:
+        for line in file:
+            if line.strip():
+                offsets.append(position)
+            position += len(line)
+    return offsets
+
+
+def load_line_index(path) -> array:
+    """
+    Returns the byte offset of every non-blank line of a jsonl file.
+
+    The index is cached beside the file as `<path>.idx` and rebuilt whenever
+    the file size or mtime no longer matches the cached header.
+    """
+    index_path = path + _INDEX_SUFFIX
+    signature = _file_signature(path)
+    try:
+        with open(index_path, "rb") as file:
+            header = file.read(_INDEX_HEADER.size)
+            if len(header) == _INDEX_HEADER.size and _INDEX_HEADER.unpack(header) == signature:
+                offsets = array("Q")
+                offsets.frombytes(file.read())
+                return offsets
+    except OSError:
+        pass
+
+    offsets = _scan_offsets(path)
+    try:
+        tmp_path = f"{index_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as file:
+            file.write(_INDEX_HEADER.pack(*signature))
+            offsets.tofile(file)
+        os.replace(tmp_path, index_path)
+    except OSError:
+        # Read-only dataset directories still work, just without the cached index
+        pass
+    return offsets
+
+
+class JsonlDataset(Sequence):
+    """
+    Lazily decoded, memory-mapped view over a jsonl file.
+
+    Only the line-offset index is held in memory; samples are decoded (and
+    passed through `transforms`) on every access, so multi-GB files cost no
+    more RSS than the pages actually touched. Slicing, shard() and
+    with_transform() return new views that share the same index.
+    """
+
+    def __init__(self, path, transform=None, _offsets=None, _positions=None, _transforms=None):
+        self.path = path
+        self._offsets = _offsets if _offsets is not None else load_line_index(path)
+        self._positions = _positions if _positions is not None else range(len(self._offsets))
+        self._transforms = list(_transforms or ())
+        if transform is not None:
+            self._transforms.append(transform)
+        self._mmap = None
+        self._size = None
+
+    def _view(self, positions=None, transforms=None):
+        return JsonlDataset(
+            self.path,
+            _offsets=self._offsets,
+            _positions=self._positions if positions is None else positions,
+            _transforms=self._transforms if transforms is None else transforms,
+        )
+
+    def _open(self):
+        if self._mmap is None:
+            with open(self.path, "rb") as file:
+                self._size = os.fstat(file.fileno()).st_size
+                self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) if self._size else b""
+        return self._mmap
+
+    def __getstate__(self):
+        # mmap handles cannot be pickled; each process maps the file itself
+        state = self.__dict__.copy()
+        state["_mmap"] = None
+        return state
+
+    def __len__(self):
+        return len(self._positions)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self._view(positions=self._positions[index])
+        line_number = self._positions[index]
+        data = self._open()
+        start = self._offsets[line_number]
+        end = data.find(b"\n", start)
+        if end < 0:
+            end = self._size
+        item = json.loads(data[start:end])
+        for transform in self._transforms:
+            item = transform(item)
+        return item
+
+    def shard(self, index: int, count: int) -> "JsonlDataset":
+        """Every count-th sample starting at index, e.g. one shard per runner."""
+        if not 0 <= index < count:
+            raise ValueError(f"Shard index {index} out of range for {count} shards")
+        return self._view(positions=self._positions[index::count])
+
+    def with_transform(self, transform) -> "JsonlDataset":
+        return self._view(transforms=[*self._transforms, transform])
+
+
+class JsonlWriter:
+    """
+    Writes samples to a jsonl file as they are produced.
+
+    With `view_path`, the same samples are streamed into a pretty-printed
+    JSON array for human inspection, without holding them all in memory.
+    """
+
+    def __init__(self, path, view_path=None):
+        self.path = path
+        self.view_path = view_path
+        self.count = 0
+        self._file = None
+        self._view_file = None
+
+    def __enter__(self):
+        self._file = open(self.path, "w", encoding="utf-8")
+        if self.view_path:
+            self._view_file = open(self.view_path, "w", encoding="utf-8")
+            self._view_file.write("[")
+        return self
+
+    def write(self, sample):
+        self._file.write(json.dumps(sample, ensure_ascii=False) + "\n")
+        if self._view_file is not None:
+            pretty = json.dumps(sample, ensure_ascii=False, indent=2).replace("\n", "\n  ")
+            self._view_file.write(("," if self.count else "") + "\n  " + pretty)
+        self.count += 1
+
+    def __exit__(self, exc_type, exc, tb):
+        self._file.close()
+        if self._view_file is not None:
+            self._view_file.write("\n]\n" if self.count else "]\n")
+            self._view_file.close()
+        return False
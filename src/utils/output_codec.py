@@ -0,0 +1,199 @@
+import functools
+import re
+
+from settings import LLM_MAX_TOKENS_BASE, LLM_MAX_TOKENS_PER_ENTITY, LLM_STREAM
+
+# Entity lists of the NER payload that carry ids, in the order ids are matched
+ENTITY_KEYS = ("ner_enterprise", "ner_time", "ner_person")
+
+# Entries are separated by "|" (or full-width "｜"); newlines also end an entry
+# so a trailing explanation never bleeds into the last confidence.
+_SEPARATOR_RE = re.compile(r"[|｜\n]")
+# Each part of id-role[-confidence] may be padded and wrapped in []
+_PAD = " \t\r[]"
+
+
+class ParseError:
+    __slots__ = ("position", "chunk", "reason")
+
+    def __init__(self, position: int, chunk: str, reason: str):
+        self.position = position
+        self.chunk = chunk
+        self.reason = reason
+
+    def to_dict(self) -> dict:
+        return {"position": self.position, "chunk": self.chunk, "reason": self.reason}
+
+    def __repr__(self):
+        return f"ParseError(position={self.position}, reason={self.reason!r}, chunk={self.chunk!r})"
+
+
+class ParseResult:
+    """
+    Parsed `id-role-confidence | ...` output.
+
+    `entries` maps entity id to (role, confidence) in output order; the
+    confidence is the string the model wrote, or None when it was omitted.
+    A repeated id keeps its last entry, as both legacy parsers did, and is
+    reported in `errors` together with every chunk that did not parse.
+    """
+    __slots__ = ("entries", "errors")
+
+    def __init__(self):
+        self.entries = {}
+        self.errors = []
+
+    def roles(self) -> dict:
+        return {entity_id: role for entity_id, (role, _) in self.entries.items()}
+
+    @property
+    def ok(self) -> bool:
+        return not self.errors
+
+
+def _parse_entry(chunk: str):
+    """
+    Parse one `id-role[-confidence]` chunk, or return None.
+
+    ids are ASCII letters/digits/underscores, roles ASCII letters/underscores
+    and confidences non-negative decimals, so a "-" can only ever be a
+    separator and a plain split is enough.
+    """
+    parts = chunk.split("-")
+    if len(parts) == 2:
+        confidence = None
+    elif len(parts) == 3:
+        confidence = parts[2].strip(_PAD)
+        if not (confidence.isascii() and confidence.replace(".", "", 1).isdigit()):
+            return None
+    else:
+        return None
+    entity_id = parts[0].strip(_PAD)
+    role = parts[1].strip(_PAD)
+    if not (entity_id.isascii() and entity_id.replace("_", "").isalnum()):
+        return None
+    if not (role.isascii() and role.replace("_", "").isalpha()):
+        return None
+    return entity_id, role, confidence
+
+
+def parse_output(text) -> ParseResult:
+    result = ParseResult()
+    if not text:
+        return result
+    entries = result.entries
+    chunks = _SEPARATOR_RE.split(text) if ("\n" in text or "｜" in text) else text.split("|")
+    for position, chunk in enumerate(chunks):
+        parsed = _parse_entry(chunk)
+        if parsed is None:
+            if chunk.strip():
+                result.errors.append(ParseError(position, chunk, "malformed entry"))
+            continue
+        entity_id, role, confidence = parsed
+        if entity_id in entries:
+            result.errors.append(ParseError(position, chunk, "duplicate id"))
+        entries[entity_id] = (role, confidence)
+    return result
+
+
+class StreamingParser:
+    """
+    Incremental parse of a streamed `id-role-confidence | ...` output.
+
+    feed() takes each content delta and returns True once every id in
+    `entity_ids` has an entry closed by a separator, so the caller can stop
+    the stream before the model adds an explanation. The entry still being
+    written never counts: "0." may yet become "0.85". Without ids to wait
+    for it never returns True.
+    """
+    __slots__ = ("missing", "_armed", "_tail")
+
+    def __init__(self, entity_ids):
+        self.missing = set(entity_ids)
+        self._armed = bool(self.missing)
+        self._tail = ""
+
+    def feed(self, delta: str) -> bool:
+        if not delta:
+            return self._armed and not self.missing
+        chunks = _SEPARATOR_RE.split(self._tail + delta)
+        self._tail = chunks.pop()
+        for chunk in chunks:
+            parsed = _parse_entry(chunk)
+            if parsed is not None:
+                self.missing.discard(parsed[0])
+        return self._armed and not self.missing
+
+
+def max_output_tokens(entity_count: int, base: int, per_entity: int):
+    """max_tokens for an answer labeling `entity_count` entities, None when per_entity <= 0."""
+    if per_entity <= 0:
+        return None
+    return base + per_entity * entity_count
+
+
+def format_output(entries) -> str:
+    """Inverse of parse_output for a {id: (role, confidence)} or {id: role} mapping."""
+    parts = []
+    for entity_id, value in entries.items():
+        if isinstance(value, tuple):
+            role, confidence = value
+        else:
+            role, confidence = value, None
+        parts.append(f"{entity_id}-{role}" if confidence is None else f"{entity_id}-{role}-{confidence}")
+    return "|".join(parts)
+
+
+def index_entities(entities: dict) -> dict:
+    """id -> entity dict across all entity lists; the first entity with an id wins."""
+    index = {}
+    for key in ENTITY_KEYS:
+        for item in entities.get(key) or []:
+            entity_id = item.get("id")
+            if entity_id is not None and entity_id not in index:
+                index[entity_id] = item
+    return index
+
+
+def completion_options(entities: dict, stream: bool = None) -> dict:
+    """
+    create_chat_completion() params for an answer labeling `entities`: when
+    streaming, a stop_when that closes the stream once every entity id has a
+    role, and a max_tokens cap from the entity count if one is configured.
+    """
+    entity_ids = index_entities(entities)
+    options = {}
+    max_tokens = max_output_tokens(len(entity_ids), LLM_MAX_TOKENS_BASE, LLM_MAX_TOKENS_PER_ENTITY)
+    if max_tokens is not None:
+        options["max_tokens"] = max_tokens
+    if LLM_STREAM if stream is None else stream:
+        options["stream"] = True
+        options["stop_when"] = functools.partial(StreamingParser, tuple(entity_ids))
+    return options
+
+
+def apply_to_entities(entities: dict, parsed: ParseResult) -> dict:
+    """Write parsed roles/confidences onto the matching entities in place."""
+    index = index_entities(entities)
+    for entity_id, (role, confidence) in parsed.entries.items():
+        item = index.get(entity_id)
+        if item is not None:
+            item["role"] = role
+            item["confidence"] = confidence
+    return entities
+
+
+def rename_ids(text, mapping: dict):
+    """Replace entity ids in an output string, keeping every other character as written."""
+    if not text or not mapping:
+        return text
+    pieces = re.split(r"([|｜\n])", text)
+    for position in range(0, len(pieces), 2):
+        chunk = pieces[position]
+        if _parse_entry(chunk) is None:
+            continue
+        head, separator, tail = chunk.partition("-")
+        new_id = mapping.get(head.strip(_PAD))
+        if new_id is not None:
+            pieces[position] = head.replace(head.strip(_PAD), new_id, 1) + separator + tail
+    return "".join(pieces)
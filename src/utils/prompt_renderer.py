@@ -0,0 +1,160 @@
+import threading
+from collections import OrderedDict
+from string import Formatter
+
+_FORMATTER = Formatter()
+
+
+class UnknownFieldsError(ValueError):
+    """A template uses placeholders the renderer has no value for."""
+
+    def __init__(self, fields):
+        self.fields = sorted(fields)
+        super().__init__(f"Prompt template uses unknown fields: {', '.join(self.fields)}")
+
+
+def _root_name(field: str) -> str:
+    # `{a.b}` and `{a[0]}` both look up `a`
+    for i, char in enumerate(field):
+        if char in ".[":
+            return field[:i]
+    return field
+
+
+def _format_field(field: str, conversion, spec: str, values: dict) -> str:
+    value, _ = _FORMATTER.get_field(field, (), values)
+    value = _FORMATTER.convert_field(value, conversion)
+    if spec and "{" in spec:
+        spec = _FORMATTER.vformat(spec, (), values)
+    return _FORMATTER.format_field(value, spec)
+
+
+def _placeholder(field: str, conversion, spec: str) -> str:
+    return "{" + field + (f"!{conversion}" if conversion else "") + (f":{spec}" if spec else "") + "}"
+
+
+class CompiledTemplate:
+    """
+    One f-string template, parsed once.
+
+    `segments` alternates literal text (static fields already substituted,
+    adjacent literals merged) with the dynamic fields still to fill, so a
+    render only formats those. `fields` names the dynamic variables the
+    template actually uses, so callers only compute those.
+    """
+    __slots__ = ("template", "segments", "fields", "unknown")
+
+    def __init__(self, template: str, segments: list, fields: frozenset, unknown: frozenset):
+        self.template = template
+        self.segments = segments
+        self.fields = fields
+        self.unknown = unknown
+
+    def render(self, values: dict) -> str:
+        parts = []
+        for segment in self.segments:
+            if segment.__class__ is str:
+                parts.append(segment)
+                continue
+            name, field, conversion, spec = segment
+            value = values[name]
+            if field is None:
+                # Plain `{name}`: the common case, no lookup or format machinery
+                parts.append(value if value.__class__ is str else format(value))
+                continue
+            parts.append(_format_field(field, conversion, spec, {name: value}))
+        return "".join(parts)
+
+
+class PromptRenderer:
+    """
+    Compiles APO-generated f-string templates against a fixed set of variables.
+
+    `static` values are the same for every sample and are substituted at
+    compile time; `dynamic` maps the remaining names to `fn(context)`,
+    evaluated per render and only for the fields the template uses.
+    Placeholders that are neither, or that could not be formatted (a bad
+    spec, a missing attribute), are `unknown`: with unknown="fill" they are
+    kept verbatim as literal text (APO often writes JSON examples with bare
+    braces), with unknown="reject" compile() raises UnknownFieldsError.
+    Compiled templates are cached by template text, least recently used
+    entries dropped past `maxsize`.
+    """
+
+    def __init__(self, static: dict, dynamic: dict, unknown: str = "fill", maxsize: int = 256):
+        if unknown not in ("fill", "reject"):
+            raise ValueError(f"unknown must be 'fill' or 'reject', got {unknown!r}")
+        self.static = dict(static)
+        self.dynamic = dict(dynamic)
+        self.unknown = unknown
+        self.maxsize = maxsize
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.compiles = 0
+
+    def compile(self, template: str) -> CompiledTemplate:
+        with self._lock:
+            compiled = self._cache.get(template)
+            if compiled is not None:
+                self._cache.move_to_end(template)
+                return compiled
+        compiled = self._compile(template)
+        with self._lock:
+            self._cache[template] = compiled
+            self.compiles += 1
+            while len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+        return compiled
+
+    def _compile(self, template: str) -> CompiledTemplate:
+        segments = []
+        fields = set()
+        unknown = set()
+
+        def literal(text: str):
+            if not text:
+                return
+            if segments and segments[-1].__class__ is str:
+                segments[-1] += text
+            else:
+                segments.append(text)
+
+        # Formatter.parse raises ValueError on unbalanced braces, same as str.format
+        for text, field, spec, conversion in _FORMATTER.parse(template):
+            literal(text)
+            if field is None:
+                continue
+            name = _root_name(field)
+            if name in self.dynamic:
+                if field == name and not spec and not conversion:
+                    fields.add(name)
+                    segments.append((name, None, None, None))
+                    continue
+                # Dynamic values are strings: a lookup or spec that fails on one fails for every sample
+                if self._formats(field, conversion, spec, {name: ""}) is not None:
+                    fields.add(name)
+                    segments.append((name, field, conversion, spec))
+                    continue
+            elif name in self.static:
+                value = self._formats(field, conversion, spec, self.static)
+                if value is not None:
+                    literal(value)
+                    continue
+            unknown.add(name or "{}")
+            literal(_placeholder(field, conversion, spec))
+
+        if unknown and self.unknown == "reject":
+            raise UnknownFieldsError(unknown)
+        return CompiledTemplate(template, segments, frozenset(fields), frozenset(unknown))
+
+    @staticmethod
+    def _formats(field: str, conversion, spec: str, values: dict):
+        """The field formatted against `values`, or None when str.format would raise."""
+        try:
+            return _format_field(field, conversion, spec, values)
+        except (AttributeError, IndexError, KeyError, TypeError, ValueError):
+            return None
+
+    def render(self, template: str, context) -> str:
+        compiled = self.compile(template)
+        return compiled.render({name: self.dynamic[name](context) for name in compiled.fields})
@@ -1,31 +1,164 @@
+import asyncio
+import os
+import struct
+import sys
+import tempfile
+import threading
 import time
-import random
-from settings import LLM_REQUEST_INTERVAL
+from settings import LLM_BURST, LLM_LIMITER_PATH, LLM_RPM, LLM_TPM
 
-class RateLimiter:
+if sys.platform == "win32":
+    import msvcrt
+else:
+    import fcntl
+
+def estimate_tokens(text) -> int:
+    """
+    Rough token estimate used to reserve TPM budget before a request is sent.
+    Prompts here are mostly Chinese, which tokenizes at roughly one token per
+    1-2 characters; the reservation is corrected by record_usage() afterwards.
+    """
+    if not text:
+        return 0
+    return len(text) // 2 + 1
+
+
+class SharedTokenBucket:
     """
-    A simple rate limiter that ensures a minimum interval between requests.
-    Includes a small random jitter to prevent 'thundering herd' issues in 
-    multiprocessing environments.
+    Token-bucket limiter whose state lives in a small lock-protected file, so
+    every thread and process on this host draws from the same RPM and TPM
+    budget (rollout runners, the APO optimizer client and llm_judge alike).
+
+    Callers reserve capacity up front and are allowed to drive the buckets
+    into debt; the returned wait is exactly how long it takes the debt to be
+    repaid. Reservations are therefore served in arrival order (fair queuing)
+    and nobody polls or sleeps on a guess.
     """
-    def __init__(self, interval=None):
-        self.interval = interval if interval is not None else LLM_REQUEST_INTERVAL
-        self.last_call = 0.0
+    # request tokens, llm tokens, last refill timestamp
+    _STATE = struct.Struct("ddd")
+
+    def __init__(self, rpm=None, tpm=None, burst=None, path=None):
+        self.rpm = rpm if rpm is not None else LLM_RPM
+        self.tpm = tpm if tpm is not None else LLM_TPM
+        burst = burst if burst is not None else LLM_BURST
+        # Default burst: ten seconds' worth of requests
+        self.burst = burst if burst > 0 else max(1, self.rpm // 6)
+        self.path = path or LLM_LIMITER_PATH or os.path.join(
+            tempfile.gettempdir(), f"agent_trainer_llm_{self.rpm}_{self.tpm}.bucket"
+        )
+        self._lock = threading.Lock()
+        self._fd = None
+        self._pid = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.rpm > 0 or self.tpm > 0
+
+    def _open(self):
+        # A forked child shares the parent's open file description, and flock()
+        # would not exclude the two, so each process opens its own descriptor.
+        if self._fd is None or self._pid != os.getpid():
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o666)
+            self._pid = os.getpid()
+        return self._fd
+
+    def _lock_file(self, fd):
+        if sys.platform == "win32":
+            os.lseek(fd, 0, os.SEEK_SET)
+            msvcrt.locking(fd, msvcrt.LK_LOCK, self._STATE.size)
+        else:
+            fcntl.flock(fd, fcntl.LOCK_EX)
 
-    def wait(self):
-        if self.interval <= 0:
+    def _unlock_file(self, fd):
+        if sys.platform == "win32":
+            os.lseek(fd, 0, os.SEEK_SET)
+            msvcrt.locking(fd, msvcrt.LK_UNLCK, self._STATE.size)
+        else:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+
+    def _update(self, requests, tokens) -> float:
+        """Refill, take `requests`/`tokens` from the shared state and return the wait."""
+        with self._lock:
+            fd = self._open()
+            self._lock_file(fd)
+            try:
+                os.lseek(fd, 0, os.SEEK_SET)
+                raw = os.read(fd, self._STATE.size)
+                now = time.time()
+                if len(raw) == self._STATE.size:
+                    req_level, tok_level, updated_at = self._STATE.unpack(raw)
+                else:
+                    req_level, tok_level, updated_at = float(self.burst), float(self.tpm), now
+
+                elapsed = max(0.0, now - updated_at)
+                wait = 0.0
+                if self.rpm > 0:
+                    rate = self.rpm / 60.0
+                    req_level = min(float(self.burst), req_level + elapsed * rate) - requests
+                    if req_level < 0:
+                        wait = max(wait, -req_level / rate)
+                if self.tpm > 0:
+                    rate = self.tpm / 60.0
+                    # A single request can never need more than a full minute of budget
+                    tok_level = min(float(self.tpm), tok_level + elapsed * rate) - min(tokens, self.tpm)
+                    if tok_level < 0:
+                        wait = max(wait, -tok_level / rate)
+
+                os.lseek(fd, 0, os.SEEK_SET)
+                os.write(fd, self._STATE.pack(req_level, tok_level, now))
+            finally:
+                self._unlock_file(fd)
+        return wait
+
+    def reserve(self, tokens=0) -> float:
+        """Reserve one request plus `tokens` and return the seconds to wait before sending."""
+        if not self.enabled:
+            return 0.0
+        return self._update(1, tokens)
+
+    def release(self, tokens=0):
+        """Give back a reservation that will not be sent."""
+        if self.enabled:
+            self._update(-1, -tokens)
+
+    def wait(self, tokens=0, max_wait=None) -> bool:
+        """
+        Sleep until a reservation for one request plus `tokens` is due.
+
+        Returns False without sleeping, and releases the reservation, when
+        that is more than `max_wait` seconds away.
+        """
+        wait = self.reserve(tokens)
+        if max_wait is not None and wait > max_wait:
+            self.release(tokens)
+            return False
+        if wait > 0:
+            time.sleep(wait)
+        return True
+
+    async def async_wait(self, tokens=0, max_wait=None) -> bool:
+        if not self.enabled:
+            return True
+        # reserve() blocks on the file lock while other processes hold it; keep that off the event loop
+        wait = await asyncio.to_thread(self.reserve, tokens)
+        if max_wait is not None and wait > max_wait:
+            await asyncio.to_thread(self.release, tokens)
+            return False
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return True
+
+    def record_usage(self, reserved, used):
+        """Correct a token reservation once the real usage of the response is known."""
+        if self.tpm <= 0 or used is None:
             return
+        self._update(0, used - reserved)
+
+    async def httpx_request_hook(self, request):
+        """httpx async event hook so clients we do not call directly (APO) share the budget."""
+        body = request.content.decode("utf-8", errors="ignore") if request.content else ""
+        await self.async_wait(estimate_tokens(body))
 
-        elapsed = time.time() - self.last_call
-        wait_time = max(0, self.interval - elapsed)
-        
-        # Add a small random jitter (up to 20% of the interval)
-        jitter = random.uniform(0, self.interval * 0.2)
-        
-        if wait_time + jitter > 0:
-            time.sleep(wait_time + jitter)
-            
-        self.last_call = time.time()
 
 # Global rate limiter instance
-limiter = RateLimiter()
+limiter = SharedTokenBucket()
@@ -0,0 +1,56 @@
+import json
+import math
+import os
+from collections import deque
+from typing import Optional
+
+from settings import ROLLOUT_LATENCY_HINT, RUNNERS_MAX
+
+# Extra in-flight rollouts on top of Little's law, so a slow tail does not starve the budget
+_HEADROOM = 1.2
+
+
+def observed_rollout_latency(jsonl_path: str, window: int = 1000) -> Optional[float]:
+    """
+    Median wall time of the last `window` rollouts that called the LLM, read
+    from a telemetry JSONL file (METRICS_JSONL_PATH / --metrics-jsonl).
+    """
+    if not jsonl_path or not os.path.exists(jsonl_path):
+        return None
+    recent = deque(maxlen=window)
+    with open(jsonl_path, "r", encoding="utf-8") as file:
+        for line in file:
+            try:
+                metrics = json.loads(line)
+            except ValueError:
+                continue
+            if metrics.get("llm_requests") and "error" not in metrics and metrics.get("rollout_seconds"):
+                recent.append(metrics["rollout_seconds"])
+    if not recent:
+        return None
+    ordered = sorted(recent)
+    return ordered[len(ordered) // 2]
+
+
+def target_concurrency(rpm: int, latency: float, max_total: int) -> int:
+    """
+    Rollouts in flight needed to spend an RPM budget (Little's law: rate x
+    latency, plus headroom). Past that the rate limiter only queues them.
+    Without a budget (rpm <= 0) the answer is max_total.
+    """
+    if rpm <= 0:
+        return max_total
+    return max(1, min(max_total, math.ceil(rpm / 60.0 * latency * _HEADROOM)))
+
+
+def plan_runners(spec, rpm: int, latency: Optional[float] = None, max_runners: int = RUNNERS_MAX):
+    """
+    Resolve a runner count spec (an int, or "auto") into (n_runners, latency used).
+
+    A runner keeps one rollout in flight, so "auto" is target_concurrency()
+    runners; latency falls back to ROLLOUT_LATENCY_HINT when none was measured.
+    """
+    if str(spec).strip().lower() != "auto":
+        return max(1, int(spec)), latency
+    latency = latency or ROLLOUT_LATENCY_HINT
+    return target_concurrency(rpm, latency, max_runners), latency
@@ -0,0 +1,34 @@
+import os
+import sqlite3
+import threading
+
+
+class ThreadLocalSQLite:
+    """
+    Hands out one SQLite connection per thread and process for a store file.
+
+    sqlite3 connections must not be shared across threads or survive a fork,
+    and every runner thread/process writes to the same file, so connections
+    are opened lazily in WAL mode and the schema is created on first use.
+    """
+
+    def __init__(self, path, schema):
+        self.path = path
+        self.schema = schema
+        self._local = threading.local()
+
+    def connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30.0)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            for statement in self.schema:
+                conn.execute(statement)
+            conn.commit()
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
@@ -0,0 +1,227 @@
+import contextvars
+import json
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from settings import METRICS_JSONL_PATH
+
+_SECONDS_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+_TOKEN_BUCKETS = (64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384)
+_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10)
+_SCORE_BUCKETS = (0.0, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0)
+
+# Per-rollout field -> (metric name, help, buckets). Fields are summed over
+# every LLM call made inside the rollout.
+HISTOGRAMS = {
+    "rollout_seconds": ("agent_trainer_rollout_seconds", "Wall time of one rollout", _SECONDS_BUCKETS),
+    "limiter_wait_seconds": ("agent_trainer_limiter_wait_seconds", "Time spent waiting on the rate limiter", _SECONDS_BUCKETS),
+    "llm_seconds": ("agent_trainer_llm_request_seconds", "LLM call latency", _SECONDS_BUCKETS),
+    "ttft_seconds": ("agent_trainer_llm_ttft_seconds", "Time to the first streamed content token", _SECONDS_BUCKETS),
+    "headers_seconds": ("agent_trainer_llm_headers_seconds", "Time to LLM response headers (the whole answer when not streaming)", _SECONDS_BUCKETS),
+    "prompt_tokens": ("agent_trainer_prompt_tokens", "Prompt tokens per rollout", _TOKEN_BUCKETS),
+    "completion_tokens": ("agent_trainer_completion_tokens", "Completion tokens per rollout", _TOKEN_BUCKETS),
+    "retries": ("agent_trainer_llm_retries", "HTTP attempts beyond the first, per rollout", _COUNT_BUCKETS),
+    "hedges": ("agent_trainer_llm_hedges", "Duplicate requests sent for slow LLM calls, per rollout", _COUNT_BUCKETS),
+    "early_stops": ("agent_trainer_llm_early_stops", "Streamed completions closed once every entity had a role, per rollout", _COUNT_BUCKETS),
+    "parse_errors": ("agent_trainer_parse_errors", "Malformed entries in the model output", _COUNT_BUCKETS),
+    "score": ("agent_trainer_score", "Rollout reward", _SCORE_BUCKETS),
+}
+
+_current = contextvars.ContextVar("rollout_metrics", default=None)
+# Hedged attempts record into their rollout's dict from executor threads
+_fields_lock = threading.Lock()
+
+
+def record(field: str, value):
+    """Add `value` to `field` of the rollout running in this context, if any."""
+    metrics = _current.get()
+    if metrics is not None and value is not None:
+        with _fields_lock:
+            metrics[field] = metrics.get(field, 0) + value
+
+
+def current_rollout():
+    return _current.get()
+
+
+class Histogram:
+    """Prometheus-style histogram: cumulative bucket counts, sum and count."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-quantile (inf past the last bucket)."""
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank and self.count:
+                return bound
+        return float("inf")
+
+    def render(self, name: str, labels: str) -> list:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels}le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels}le="+Inf"}} {self.count}')
+        lines.append(f"{name}_sum{{{labels.rstrip(',')}}} {self.sum}")
+        lines.append(f"{name}_count{{{labels.rstrip(',')}}} {self.count}")
+        return lines
+
+
+class Telemetry:
+    """
+    Per-rollout metrics aggregated into histograms by rollout mode.
+
+    Code inside `with telemetry.rollout(mode):` reports through record();
+    when the block exits the rollout's fields are observed into the
+    histograms and, if a sink is open, appended as one JSON line.
+    """
+
+    def __init__(self, jsonl_path: str = ""):
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._counters = {}
+        self._sink = None
+        self._server = None
+        if jsonl_path:
+            self.open_sink(jsonl_path)
+
+    def open_sink(self, path: str):
+        with self._lock:
+            if self._sink is not None:
+                self._sink.close()
+            self._sink = open(path, "a", encoding="utf-8", buffering=1)
+
+    @contextmanager
+    def rollout(self, mode=None, **fields):
+        metrics = {"mode": mode or "offline", **fields}
+        token = _current.set(metrics)
+        started = time.perf_counter()
+        try:
+            yield metrics
+        except BaseException as e:
+            metrics["error"] = type(e).__name__
+            raise
+        finally:
+            _current.reset(token)
+            # A losing sync hedge may still record into `metrics`: observe a snapshot
+            with _fields_lock:
+                metrics["rollout_seconds"] = time.perf_counter() - started
+                snapshot = dict(metrics)
+            self.observe(snapshot)
+
+    def observe(self, metrics: dict):
+        # The client registry counts every HTTP attempt, the chat helpers every logical call
+        attempts = metrics.get("http_requests", 0)
+        metrics["retries"] = max(0, attempts - metrics.get("llm_requests", 0) - metrics.get("hedges", 0))
+        mode = metrics.get("mode", "offline")
+        source = metrics.get("source")
+        if source is None:
+            if metrics.get("llm_requests"):
+                source = "llm"
+            elif metrics.get("coalesced"):
+                source = "coalesced"
+            else:
+                source = "response_cache" if metrics.get("cache_hits") else "llm"
+        with self._lock:
+            key = ("agent_trainer_rollouts_total", f'mode="{mode}",source="{source}"')
+            self._counters[key] = self._counters.get(key, 0) + 1
+            if "error" in metrics:
+                key = ("agent_trainer_rollout_errors_total", f'mode="{mode}",error="{metrics["error"]}"')
+                self._counters[key] = self._counters.get(key, 0) + 1
+            for field, (_, _, buckets) in HISTOGRAMS.items():
+                value = metrics.get(field)
+                if value is None:
+                    continue
+                histogram = self._histograms.get((field, mode))
+                if histogram is None:
+                    histogram = self._histograms[(field, mode)] = Histogram(buckets)
+                histogram.observe(value)
+            if self._sink is not None:
+                self._sink.write(json.dumps({"ts": time.time(), **metrics}, ensure_ascii=False, default=str) + "\n")
+
+    def render_prometheus(self) -> str:
+        lines = []
+        with self._lock:
+            names = {}
+            for (name, labels), value in sorted(self._counters.items()):
+                if name not in names:
+                    names[name] = True
+                    lines.append(f"# TYPE {name} counter")
+                lines.append(f"{name}{{{labels}}} {value}")
+            for field, (name, help_text, _) in HISTOGRAMS.items():
+                series = [(mode, h) for (f, mode), h in sorted(self._histograms.items()) if f == field]
+                if not series:
+                    continue
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} histogram")
+                for mode, histogram in series:
+                    lines.extend(histogram.render(name, f'mode="{mode}",'))
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> dict:
+        """Count, mean and p50/p95 bucket bounds per field and mode, for logs."""
+        with self._lock:
+            return {
+                f"{field}[{mode}]": {
+                    "count": h.count,
+                    "mean": h.sum / h.count if h.count else 0.0,
+                    "p50": h.quantile(0.5),
+                    "p95": h.quantile(0.95),
+                }
+                for (field, mode), h in sorted(self._histograms.items())
+            }
+
+    def serve(self, port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+        """Serve /metrics in Prometheus text format from a daemon thread."""
+        telemetry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = telemetry.render_prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self._server
+
+    def close(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server = None
+        with self._lock:
+            if self._sink is not None:
+                self._sink.close()
+                self._sink = None
+
+
+telemetry = Telemetry(METRICS_JSONL_PATH)
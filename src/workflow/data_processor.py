@@ -1,13 +1,68 @@
+import argparse
+import hashlib
 import json
 import random
 import string
+import unicodedata
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
+from itertools import islice
+
+try:
+    import orjson
+except ImportError:  # optional fast path for batch decoding
+    orjson = None
+
+from settings import ENTITY_ID_MODE
+
+ID_ALPHABET = string.ascii_uppercase + string.digits
+ID_LENGTH = 4
+
+# 输出结果中带 id 的实体列表：(列表字段, 实体类别, 名称字段)，稳定 id 按此顺序分配
+ENTITY_ID_FIELDS = (
+    ("ner_enterprise", "enterprise", "name"),
+    ("ner_time", "time", "raw"),
+    ("ner_person", "person", "name"),
+)
 
 def generate_random_id():
     # 生成一个4位长度的随机码(数字和英文字符全部大写)
     return ''.join(random.choices(string.ascii_uppercase + string.digits, k=4)).upper()
 
-def main(ner_result: str) -> dict:
+def generate_stable_id(kind: str, name: str, salt: int = 0) -> str:
+    # 由 实体类别 + 规范化名称 哈希得到的4位码，同一实体每次生成的 id 一致
+    normalized = unicodedata.normalize("NFKC", name or "").strip().lower()
+    digest = hashlib.sha1(f"{kind}\x1f{normalized}\x1f{salt}".encode("utf-8")).digest()
+    value = int.from_bytes(digest[:8], "big")
+    chars = []
+    for _ in range(ID_LENGTH):
+        value, index = divmod(value, len(ID_ALPHABET))
+        chars.append(ID_ALPHABET[index])
+    return "".join(chars)
+
+def assign_stable_ids(entities: dict) -> dict:
+    """
+    为 entities 中的实体就地分配稳定 id，返回 旧id -> 新id 的映射。
+    同一问句内发生冲突（含同名重复实体）时递增 salt 重新哈希，结果仍是确定的。
+    """
+    used = set()
+    mapping = {}
+    for key, kind, field in ENTITY_ID_FIELDS:
+        for item in entities.get(key) or []:
+            salt = 0
+            new_id = generate_stable_id(kind, item.get(field), salt)
+            while new_id in used:
+                salt += 1
+                new_id = generate_stable_id(kind, item.get(field), salt)
+            used.add(new_id)
+            old_id = item.get("id")
+            if old_id is not None and old_id not in mapping:
+                mapping[old_id] = new_id
+            item["id"] = new_id
+    return mapping
+
+def _decode_ner_result(ner_result) -> str:
     if isinstance(ner_result, (bytes, bytearray)):
         try:
             ner_result = ner_result.decode("utf-8-sig")
@@ -15,8 +70,21 @@ def main(ner_result: str) -> dict:
             ner_result = ner_result.decode("gbk", errors="replace")
     elif isinstance(ner_result, str) and ner_result.startswith("\ufeff"):
         ner_result = ner_result.lstrip("\ufeff")
+    return ner_result
 
+def main(ner_result: str, id_mode: str = None) -> dict:
+    ner_result = _decode_ner_result(ner_result)
     payload = json.loads(ner_result) if ner_result else {}
+    return normalize_payload(payload, id_mode)
+
+def normalize_payload(payload: dict, id_mode: str = None) -> dict:
+    # id_mode: "stable" 按内容哈希生成确定的 id，"random" 为原来的随机 id
+    id_mode = id_mode or ENTITY_ID_MODE
+    if id_mode not in ("stable", "random"):
+        raise ValueError(f"Unknown entity id mode: {id_mode}")
+    # stable 模式在收集完所有实体后统一分配 id
+    make_id = generate_random_id if id_mode == "random" else (lambda: None)
+
     # 新格式直接在顶层有 data 字段，不再有 windNerPlugInfo 包装
     data_list = payload.get("data", [])
     
@@ -26,10 +94,11 @@ def main(ner_result: str) -> dict:
     ner_location_list = []
     ner_person_list = []
 
-    ner_enterprise_set = []
-    ner_time_set = []
-    ner_location_set = []
-    ner_person_set = []
+    # name -> 第一个同名企业，用于合并 codes；其余类别只需去重
+    ner_enterprise_index = {}
+    ner_time_set = set()
+    ner_location_set = set()
+    ner_person_set = set()
 
     reference_set = set()  # 使用 set 来去重，用于扩展词
     
@@ -62,50 +131,50 @@ def main(ner_result: str) -> dict:
                     
                     # 收集企业信息：name 和 codes
                     enterprise_info = {
-                        "id": generate_random_id(),
+                        "id": make_id(),
                         "name": entity_name ,
                         "codes": [entity_id] if entity_id and not entity_id.isdigit() else []
                     }
                     # 去重：检查是否已存在相同的 name 和 codes
-                    if entity_name in ner_enterprise_set:
-                        for existing in ner_enterprise_list:
-                            if existing["name"] == enterprise_info["name"]:
-                                existing["codes"].extend(enterprise_info["codes"])
-                                existing["codes"] = list(set(existing["codes"]))
-                                break
-                    ner_enterprise_set.append(entity_name)
+                    existing = ner_enterprise_index.get(entity_name)
+                    if existing is not None:
+                        existing["codes"].extend(enterprise_info["codes"])
+                        # 保持首次出现的顺序：set 的顺序随字符串哈希变化，会让同一问句渲染出不同的提示词
+                        existing["codes"] = list(dict.fromkeys(existing["codes"]))
+                    else:
+                        ner_enterprise_index[entity_name] = enterprise_info
                     ner_enterprise_list.append(enterprise_info)
                     
                 # 2. 处理时间实体（time）
                 elif ner_type == "time":
                     if entity_name and entity_name not in ner_time_set:
                         time_obj = {
-                            "id":generate_random_id(),
+                            "id":make_id(),
 				            "raw":entity_name
                         }
                         ner_time_list.append(time_obj)
-                        ner_time_set.append(entity_name)
+                        ner_time_set.add(entity_name)
                     # time 类型不添加到 reference（原来就排除）
 
                 # 处理地点实体（location）
                 elif ner_type == "location":
                     if entity_name and entity_name not in ner_location_set:
                         location_obj = {
-                            "id":generate_random_id(),
+                            "id":make_id(),
 				            "location":entity_name
                         }
                         ner_location_list.append(location_obj)
-                        ner_location_set.append(entity_name)
+                        ner_location_set.add(entity_name)
                 
                 # 处理人物实体（person）
                 elif ner_type == "person":
                     if entity_name and entity_name not in ner_person_set:
                         person_obj = {
-                            "id":generate_random_id(),
+                            "id":make_id(),
 				            "name":entity_name
                         }
                         ner_person_list.append(person_obj)
-                        ner_person_set.append(entity_name)
+                        ner_person_set.add(entity_name)
                 
                 # 跳过其他排除的 nerType
                 elif ner_type in excluded_ner_types:
@@ -143,6 +212,8 @@ def main(ner_result: str) -> dict:
         "ner_person": ner_person_list,
         # "reference": reference,
     }
+    if id_mode == "stable":
+        assign_stable_ids(result)
     
     # # 验证所有返回值都是字符串类型
     # for key, value in result.items():
@@ -151,7 +222,47 @@ def main(ner_result: str) -> dict:
     
     return result
 
-if __name__ == "__main__":
+def _normalize_lines(lines: list, fast_json: bool = True, id_mode: str = None) -> list:
+    loads = orjson.loads if fast_json and orjson is not None else json.loads
+    results = []
+    for line in lines:
+        text = _decode_ner_result(line).strip()
+        payload = loads(text) if text else {}
+        results.append(json.dumps(normalize_payload(payload, id_mode), ensure_ascii=False))
+    return results
+
+def normalize_batch(input_path: str, output_path: str, workers: int = 0, chunk_size: int = 512,
+                    fast_json: bool = True, id_mode: str = None) -> int:
+    """
+    批量规范化 NER 原始结果：输入 jsonl 每行一个 NER 接口返回，输出 jsonl 每行一个 main() 的结果，
+    顺序与输入一致。workers > 0 时按 chunk 分发到进程池，同时在途的 chunk 数有上限，避免整文件读入内存。
+    """
+    count = 0
+    with open(input_path, "rb") as src, open(output_path, "w", encoding="utf-8") as dst:
+        lines = (line for line in src if line.strip())
+        chunks = iter(lambda: list(islice(lines, chunk_size)), [])
+        if workers <= 0:
+            for chunk in chunks:
+                for result in _normalize_lines(chunk, fast_json, id_mode):
+                    dst.write(result + "\n")
+                    count += 1
+            return count
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            pending = deque()
+            for chunk in chunks:
+                pending.append(executor.submit(_normalize_lines, chunk, fast_json, id_mode))
+                if len(pending) >= workers * 2:
+                    for result in pending.popleft().result():
+                        dst.write(result + "\n")
+                        count += 1
+            while pending:
+                for result in pending.popleft().result():
+                    dst.write(result + "\n")
+                    count += 1
+    return count
+
+def _demo():
     ner_result = """{
         "data": [
             [
@@ -194,3 +305,20 @@ if __name__ == "__main__":
 
     result = main(ner_result)
     print(json.dumps(result, ensure_ascii=False,indent=2))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("input", nargs="?", help="原始 NER 结果 jsonl（每行一个接口返回）")
+    parser.add_argument("output", nargs="?", help="规范化结果输出 jsonl")
+    parser.add_argument("--workers", type=int, default=0, help="进程池大小，0 表示单进程")
+    parser.add_argument("--chunk-size", type=int, default=512)
+    parser.add_argument("--no-fast-json", action="store_true", help="不使用 orjson 解码")
+    parser.add_argument("--id-mode", choices=("stable", "random"), default=None, help="实体 id 生成方式，默认取 ENTITY_ID_MODE")
+    args = parser.parse_args()
+    if args.input and args.output:
+        total = normalize_batch(args.input, args.output, workers=args.workers,
+                                chunk_size=args.chunk_size, fast_json=not args.no_fast_json,
+                                id_mode=args.id_mode)
+        print(f"已规范化 {total} 条 NER 结果 -> {args.output}")
+    else:
+        _demo()
@@ -0,0 +1,71 @@
+import argparse
+import json
+import os
+
+from src.utils.output_codec import rename_ids
+from src.workflow.data_processor import assign_stable_ids
+
+
+def _rename_struct(entities, mapping: dict):
+    # format_output 等与 entities 同结构的字段，按映射替换 id
+    if not isinstance(entities, dict):
+        return entities
+    for key, value in entities.items():
+        if not isinstance(value, list):
+            continue
+        for item in value:
+            if isinstance(item, dict) and item.get("id") in mapping:
+                item["id"] = mapping[item["id"]]
+    return entities
+
+
+def migrate_sample(sample: dict) -> dict:
+    """
+    将一条样本中的随机 id 就地替换为稳定 id，返回 旧id -> 新id 映射。
+    input.entities 决定映射，output / format_output / legacy 中的 id 按同一映射改写；
+    legacy.entities 中的实体与 input 一致，单独生成映射可覆盖两者不同的情况。
+    """
+    entities = (sample.get("input") or {}).get("entities")
+    if not isinstance(entities, dict):
+        return {}
+    mapping = assign_stable_ids(entities)
+    if "output" in sample:
+        sample["output"] = rename_ids(sample["output"], mapping)
+    _rename_struct(sample.get("format_output"), mapping)
+
+    legacy = sample.get("legacy")
+    if isinstance(legacy, dict):
+        legacy_mapping = dict(mapping)
+        if isinstance(legacy.get("entities"), dict):
+            legacy_mapping.update(assign_stable_ids(legacy["entities"]))
+        if "output" in legacy:
+            legacy["output"] = rename_ids(legacy["output"], legacy_mapping)
+        _rename_struct(legacy.get("format_output"), legacy_mapping)
+    return mapping
+
+
+def migrate_file(input_path: str, output_path: str) -> dict:
+    """逐行迁移 jsonl 数据集，返回统计信息；输入输出可以是同一个文件。"""
+    stats = {"samples": 0, "renamed": 0, "unchanged": 0}
+    tmp_path = output_path + ".tmp"
+    with open(input_path, "r", encoding="utf-8") as src, open(tmp_path, "w", encoding="utf-8") as dst:
+        for line in src:
+            if not line.strip():
+                continue
+            sample = json.loads(line)
+            mapping = migrate_sample(sample)
+            stats["samples"] += 1
+            stats["renamed"] += sum(1 for old, new in mapping.items() if old != new)
+            stats["unchanged"] += sum(1 for old, new in mapping.items() if old == new)
+            dst.write(json.dumps(sample, ensure_ascii=False) + "\n")
+    os.replace(tmp_path, output_path)
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="将数据集中的随机实体 id 迁移为稳定 id")
+    parser.add_argument("input", help="待迁移的 jsonl 数据集")
+    parser.add_argument("output", nargs="?", help="输出 jsonl，缺省时原地改写")
+    args = parser.parse_args()
+    stats = migrate_file(args.input, args.output or args.input)
+    print(f"已迁移 {stats['samples']} 条样本，改写 {stats['renamed']} 个 id，{stats['unchanged']} 个 id 保持不变")
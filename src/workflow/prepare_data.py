@@ -2,12 +2,21 @@ import json
 import random
 import copy
 import requests
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import sys
+import threading
 from pathlib import Path
 
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from settings import NER_API_URL, NER_MAX_IN_FLIGHT, NER_RETRIES, NER_TIMEOUT
 from src.client.openai_httpx import run_chat
+from src.utils.jsonl import JsonlWriter
+from src.utils.output_codec import apply_to_entities, completion_options, parse_output
 from src.workflow.data_processor import main as process_ner_result
+from src.workflow.staged_pipeline import run_stages
 
 GENERATE_MODEL_NAME = "glm-4.5-flash"
 CORRECTING_MODEL_NAME = "glm-4.7"
@@ -80,7 +89,36 @@ publisher，author，filter_time会被处理为查询的过滤条件，其他的
 
 """
 
-def call_ner_api(query: str) -> str:
+def build_ner_session(max_in_flight: int = NER_MAX_IN_FLIGHT, retries: int = NER_RETRIES) -> requests.Session:
+    """
+    Pooled session for the NER service: keeps up to max_in_flight connections
+    alive and retries connection errors, 429 and 5xx with exponential backoff.
+    """
+    retry = Retry(
+        total=retries,
+        backoff_factor=0.5,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset({"POST"}),
+        respect_retry_after_header=True,
+    )
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_in_flight, max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+_ner_session = None
+_ner_session_lock = threading.Lock()
+
+def _default_ner_session() -> requests.Session:
+    global _ner_session
+    # 多个NER工作线程可能同时首次调用：加锁，只建一个连接池
+    with _ner_session_lock:
+        if _ner_session is None:
+            _ner_session = build_ner_session()
+        return _ner_session
+
+def call_ner_api(query: str, session: requests.Session = None, url: str = None, timeout: float = NER_TIMEOUT) -> str:
     """
     curl --location --request POST 'http://10.106.40.74:30803/ner_pred' \
         --header 'Content-Type: application/json' \
@@ -93,7 +131,8 @@ def call_ner_api(query: str) -> str:
             "with_weight": "1"
         }'
     """
-    url = "http://10.106.40.74:30803/ner_pred"
+    url = url or NER_API_URL
+    session = session or _default_ner_session()
     headers = {
         "Content-Type": "application/json",
     }
@@ -105,72 +144,50 @@ def call_ner_api(query: str) -> str:
         "source": "wind.search",
         "with_weight": "1"
     }
-    response = requests.post(url, headers=headers, json=payload, timeout=60)
+    response = session.post(url, headers=headers, json=payload, timeout=timeout)
     response.raise_for_status()
     return response.text.strip()
 
+def fetch_ner_results(
+    queries: list,
+    max_in_flight: int = NER_MAX_IN_FLIGHT,
+    url: str = None,
+    timeout: float = NER_TIMEOUT,
+    retries: int = NER_RETRIES,
+) -> list:
+    """
+    Calls the NER service for every query with at most max_in_flight requests
+    outstanding over one pooled session. Results come back in input order.
+    """
+    session = build_ner_session(max_in_flight=max_in_flight, retries=retries)
+    try:
+        with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+            return list(executor.map(
+                lambda query: call_ner_api(query, session=session, url=url, timeout=timeout),
+                queries,
+            ))
+    finally:
+        session.close()
+
 def convert_results_to_dict(entities:dict, api_result: str) -> dict:
     # "CMV5-subject-10|2J8D-content_descriptor-9"
-    results = api_result.split("|")
-    result_dict = {}
-    for result in results:
-        parts = result.split("-")
-        if len(parts) != 3:
-            continue
-        entity_id, role, confidence = parts
-        result_dict[entity_id] = {
-            "role": role,
-            "confidence": confidence
-        }
-    
-    ner_enterprise_list = entities["ner_enterprise"]
-    ner_time_list = entities["ner_time"]
-    ner_person_list = entities["ner_person"]
-
-    seen_ids = []
-    all_ids = [k for k,_ in result_dict.items()]
-
-    for item1 in ner_enterprise_list:
-        if item1["id"] not in seen_ids and item1["id"] in all_ids:
-            item1["role"] = result_dict[item1["id"]]["role"]
-            item1["confidence"] = result_dict[item1["id"]]["confidence"]
-            seen_ids.append(item1["id"])
-
-    for item2 in ner_time_list:
-        if item2["id"] not in seen_ids and item2["id"] in all_ids:
-            item2["role"] = result_dict[item2["id"]]["role"]
-            item2["confidence"] = result_dict[item2["id"]]["confidence"]
-            seen_ids.append(item2["id"])
-        
-    for item3 in ner_person_list:
-        if item3["id"] not in seen_ids and item3["id"] in all_ids:
-            item3["role"] = result_dict[item3["id"]]["role"]
-            item3["confidence"] = result_dict[item3["id"]]["confidence"]
-            seen_ids.append(item3["id"]) 
-
-    entities["ner_enterprise"] = ner_enterprise_list
-    entities["ner_time"] = ner_time_list
-    entities["ner_person"] = ner_person_list
-
-    return entities
+    return apply_to_entities(entities, parse_output(api_result))
 
-def invoke_generation_api(query: str, debug: bool = False) -> dict:
-    ner_result = call_ner_api(query)
-    entities = process_ner_result(ner_result)
-
-    ner_enterprise = entities["ner_enterprise"]
-    ner_time = entities["ner_time"]
-    ner_person = entities["ner_person"]
-    is_empty_entity = len(ner_enterprise) == 0 and len(ner_time) == 0 and len(ner_person) == 0
-    if is_empty_entity:
-        return None, None, None
+def fetch_entities(query: str, session: requests.Session = None) -> dict:
+    ner_result = call_ner_api(query, session=session)
+    return process_ner_result(ner_result)
+
+def is_empty_entities(entities: dict) -> bool:
+    return len(entities["ner_enterprise"]) == 0 and len(entities["ner_time"]) == 0 and len(entities["ner_person"]) == 0
 
+def generate_for_entities(query: str, entities: dict, debug: bool = False):
     input_text = PROMPT_TEMPLATE.format(
         question=query,
         entities=json.dumps(entities, ensure_ascii=False)
     )
     t1 = datetime.now()
-    llm_result = run_chat(input_text,model=GENERATE_MODEL_NAME, temperature=0.01)
+    # 流式生成：所有实体都有角色后立即结束，max_tokens 按实体数封顶
+    llm_result = run_chat(input_text, model=GENERATE_MODEL_NAME, temperature=0.01, **completion_options(entities))
     t2 = datetime.now()
     delta = (t2 - t1).total_seconds()
 
@@ -186,6 +203,12 @@ def invoke_generation_api(query: str, debug: bool = False) -> dict:
 
     return output, entities, format_entities if debug else None
 
+def invoke_generation_api(query: str, debug: bool = False) -> dict:
+    entities = fetch_entities(query)
+    if is_empty_entities(entities):
+        return None, None, None
+    return generate_for_entities(query, entities, debug)
+
 def invoke_correcting_api(query, entities:dict, output, format_entities) -> dict:
     input_text = PROMPT_TEMPLATE_CORRECTING.format(
         question=query,
@@ -210,8 +233,8 @@ def invoke_correcting_api(query, entities:dict, output, format_entities) -> dict
 
     return new_output, entities, format_entities
 
-def pipeline(lines: list, output_path: str, sampling: bool = False, sample_size: int = 0):
-    train_samples = []
+def pipeline(lines: list, output_path: str, sampling: bool = False, sample_size: int = 0,
+             max_in_flight: int = NER_MAX_IN_FLIGHT):
     assert output_path.endswith(".jsonl"), "输出文件必须是jsonl格式"
 
     if sampling:
@@ -219,58 +242,84 @@ def pipeline(lines: list, output_path: str, sampling: bool = False, sample_size:
     if sample_size > 0 and sample_size < len(lines):
         lines = lines[:sample_size]
 
-    for query in lines:
-        ner_result = call_ner_api(query)
-        entities = process_ner_result(ner_result)
+    # NER 请求并发执行，结果按输入顺序返回
+    ner_results = fetch_ner_results(lines, max_in_flight=max_in_flight)
 
-        train_samples.append({
-            "input":{
-                "question": query,
-                "entities": entities
-            }
-        })
     # 写入jsonl文件中
-    with open(output_path, "w", encoding="utf-8") as f:
-        for sample in train_samples:
-            f.write(json.dumps(sample, ensure_ascii=False) + "\n")
+    with JsonlWriter(output_path) as writer:
+        for query, ner_result in zip(lines, ner_results):
+            entities = process_ner_result(ner_result)
+            writer.write({
+                "input":{
+                    "question": query,
+                    "entities": entities
+                }
+            })
+
+def _build_val_sample(query, output, entities, format_output, new_output, new_entities, new_formats) -> dict:
+    val_sample = {
+        "input":{
+            "question": query,
+            "entities": new_entities
+        },
+        "output": new_output,
+        "format_output": new_formats
+    }
+    if new_output != output:
+        val_sample["legacy"] = {
+            "entities":entities,
+            "output": output,
+            "format_output": format_output,
+        }
+    return val_sample
 
-def pipeline_with_gold(lines: list, output_path: str, sampling: bool = False, sample_size: int = 0):
-    val_samples = []
+def pipeline_with_gold(lines: list, output_path: str, sampling: bool = False, sample_size: int = 0,
+                       ner_workers: int = NER_MAX_IN_FLIGHT, generation_workers: int = 4,
+                       correction_workers: int = 4, queue_size: int = 32):
+    """
+    NER -> 生成 -> 纠偏 三个阶段由有界队列串联，各阶段独立并发，
+    不同问句在各阶段之间重叠执行，结果按输入顺序写出。
+    """
     assert output_path.endswith(".jsonl"), "输出文件必须是jsonl格式"
     if sampling:
         lines = random.sample(lines, sample_size)
     if sample_size > 0 and sample_size < len(lines):
         lines = lines[:sample_size]
 
-    for query in lines:
-        output, entities, format_output = invoke_generation_api(query, True)
+    # 在启动各阶段线程之前建好会话，连接池大小与NER并发一致
+    ner_session = build_ner_session(max_in_flight=ner_workers)
+
+    def ner_stage(query):
+        entities = fetch_entities(query, session=ner_session)
+        if is_empty_entities(entities):
+            return None
+        return query, entities
+
+    def generation_stage(payload):
+        query, entities = payload
+        output, entities, format_output = generate_for_entities(query, entities, True)
         if output == None:
-            continue
+            return None
+        return query, output, entities, format_output
+
+    def correction_stage(payload):
+        query, output, entities, format_output = payload
         new_output, new_entities, new_formats = invoke_correcting_api(query, entities, output, format_output)
-        val_sample = {
-            "input":{
-                "question": query,
-                "entities": new_entities
-            },
-            "output": new_output,
-            "format_output": new_formats
-        }
-        if new_output != output:
-            val_sample["legacy"] = {
-                "entities":entities,
-                "output": output,
-                "format_output": format_output,
-            }
-        val_samples.append(val_sample)
-    # 写入jsonl文件中
-    with open(output_path, "w", encoding="utf-8") as f:
-        for sample in val_samples:
-            f.write(json.dumps(sample, ensure_ascii=False) + "\n")
-        f.close()
-    # 写入json文件中，方便查看
-    with open(output_path.replace(".jsonl", ".view.json"), "w", encoding="utf-8") as sf:
-        sf.write(json.dumps(val_samples, ensure_ascii=False, indent=2) + "\n")
-        sf.close()
+        return _build_val_sample(query, output, entities, format_output, new_output, new_entities, new_formats)
+
+    stages = [
+        ("ner", ner_stage, ner_workers),
+        ("generation", generation_stage, generation_workers),
+        ("correction", correction_stage, correction_workers),
+    ]
+    # 逐条写入jsonl文件，同时写入json文件方便查看
+    try:
+        with JsonlWriter(output_path, view_path=output_path.replace(".jsonl", ".view.json")) as writer:
+            for _, sample in run_stages(lines, stages, queue_size=queue_size):
+                if sample is not None:
+                    writer.write(sample)
+    finally:
+        ner_session.close()
 
 
 if __name__ == "__main__":
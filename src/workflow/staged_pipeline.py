@@ -0,0 +1,123 @@
+import queue
+import threading
+import time
+import traceback
+
+_DONE = object()
+
+
+class StageStats:
+    def __init__(self, name: str, workers: int):
+        self.name = name
+        self.workers = workers
+        self.processed = 0
+        self.dropped = 0
+        self.errors = 0
+        self.latencies = []
+        self._lock = threading.Lock()
+
+    def record(self, latency: float, result, error: bool):
+        with self._lock:
+            self.processed += 1
+            self.latencies.append(latency)
+            if error:
+                self.errors += 1
+            elif result is None:
+                self.dropped += 1
+
+    def summary(self, wall_time: float) -> str:
+        latencies = sorted(self.latencies)
+        if latencies:
+            mean = sum(latencies) / len(latencies)
+            p50 = latencies[len(latencies) // 2]
+            p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+        else:
+            mean = p50 = p95 = 0.0
+        throughput = self.processed / wall_time if wall_time > 0 else 0.0
+        return (
+            f"[{self.name}] workers={self.workers} processed={self.processed} dropped={self.dropped} "
+            f"errors={self.errors} throughput={throughput:.2f}/s "
+            f"latency mean={mean:.2f}s p50={p50:.2f}s p95={p95:.2f}s"
+        )
+
+
+def run_stages(items, stages, queue_size: int = 32):
+    """
+    Runs items through a chain of stages connected by bounded queues.
+
+    `stages` is a list of (name, fn, workers). Each stage has its own worker
+    threads, so different items overlap across stages. A stage fn returning
+    None (or raising) drops the item; dropped items still travel downstream as
+    None so results can be yielded as (index, result) in input order.
+
+    Per-stage throughput/latency stats are printed once all items are done.
+    """
+    items = list(items)
+    stats = [StageStats(name, workers) for name, _, workers in stages]
+    queues = [queue.Queue(maxsize=queue_size) for _ in range(len(stages) + 1)]
+    threads = []
+
+    def feed():
+        for index, item in enumerate(items):
+            queues[0].put((index, item))
+        for _ in range(stages[0][2]):
+            queues[0].put(_DONE)
+
+    def work(stage_index, fn, stage_stats, finished):
+        inbox, outbox = queues[stage_index], queues[stage_index + 1]
+        while True:
+            message = inbox.get()
+            if message is _DONE:
+                break
+            index, payload = message
+            result = None
+            if payload is not None:
+                t1 = time.perf_counter()
+                error = False
+                try:
+                    result = fn(payload)
+                except Exception:
+                    error = True
+                    print(f"[{stage_stats.name}] 第{index}条处理失败：\n{traceback.format_exc()}")
+                stage_stats.record(time.perf_counter() - t1, result, error)
+            outbox.put((index, result))
+        # The last worker of a stage to finish closes the next queue
+        with finished["lock"]:
+            finished["count"] += 1
+            last = finished["count"] == stage_stats.workers
+        if last:
+            next_workers = stages[stage_index + 1][2] if stage_index + 1 < len(stages) else 1
+            for _ in range(next_workers):
+                outbox.put(_DONE)
+
+    start = time.perf_counter()
+    threads.append(threading.Thread(target=feed, daemon=True))
+    for stage_index, (name, fn, workers) in enumerate(stages):
+        finished = {"lock": threading.Lock(), "count": 0}
+        for _ in range(workers):
+            threads.append(threading.Thread(
+                target=work, args=(stage_index, fn, stats[stage_index], finished), daemon=True,
+            ))
+    for thread in threads:
+        thread.start()
+
+    # Re-order the tail of the chain back into input order
+    pending = {}
+    next_index = 0
+    while True:
+        message = queues[-1].get()
+        if message is _DONE:
+            break
+        index, result = message
+        pending[index] = result
+        while next_index in pending:
+            yield next_index, pending.pop(next_index)
+            next_index += 1
+
+    for thread in threads:
+        thread.join()
+    wall_time = time.perf_counter() - start
+    print("=" * 10)
+    print(f"流水线完成：{len(items)} 条，总耗时 {wall_time:.2f} s")
+    for stage_stats in stats:
+        print(stage_stats.summary(wall_time))
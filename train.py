@@ -2,21 +2,47 @@ from src.utils.windows_patch import apply_patches
 apply_patches()
 
 import argparse
-import json
+import functools
 import os
 import sys
 import threading
 import time
 from datetime import datetime
 
-from openai import AsyncOpenAI
+import openai
 import yaml
 
 import agentlightning as agl
+from agentlightning.execution import ClientServerExecutionStrategy, SharedMemoryExecutionStrategy
 
-from src.agents.entity_filter import entity_filter_agent
-from src.client.openai_httpx import build_async_httpx_client
-from settings import OPTIMIZER_CONFIG, ROLLOUT_CONFIG
+from src.agents.entity_filter import entity_filter_agent, entity_filter_agent_async, predict
+from src.agents.task import EntityTask, RunContext
+from src.algorithms.racing_apo import RacingAPO
+from src.algorithms.resumable_apo import ResumableAPO
+from src.algorithms.stratified_apo import StratifiedValAPO
+from src.client.registry import client_registry
+from src.client.resilience import resilient_caller
+from src.client.response_cache import response_cache
+from src.client.single_flight import single_flight
+from src.evaluators.batch_scoring import score_batch
+from src.evaluators.llm_judge import llm_judge_batch
+from src.evaluators.score_store import score_store
+from src.utils.jsonl import JsonlDataset
+from src.utils.rate_limiter import limiter
+from src.utils.scaling import observed_rollout_latency, plan_runners
+from src.utils.telemetry import telemetry
+from settings import (
+    JUDGE_BATCH_SIZE,
+    LLM_HEDGE,
+    LLM_ROLLOUT_DEADLINE,
+    LLM_RPM,
+    METRICS_JSONL_PATH,
+    METRICS_PORT,
+    OPTIMIZER_CONFIG,
+    ROLLOUT_CONFIG,
+    RUNNER_POLL_INTERVAL,
+    RUNNERS,
+)
 
 OPTIMIZER_BASE_URL = OPTIMIZER_CONFIG.base_url
 OPTIMIZER_API_KEY = OPTIMIZER_CONFIG.api_key
@@ -63,8 +89,8 @@ def _normalize_sample(item):
 
 
 def load_jsonl(path):
-    with open(path, "r", encoding="utf-8") as file:
-        return [_normalize_sample(json.loads(line)) for line in file if line.strip()]
+    """Indexed, lazily decoded dataset; samples are normalized on access."""
+    return JsonlDataset(path, transform=_normalize_sample)
 
 
 def load_config(path):
@@ -78,14 +104,50 @@ def save_config(path, config):
         yaml.dump(config, file, allow_unicode=True, default_flow_style=False, sort_keys=False)
 
 
-def build_dataset(dataset, goal, eval_mode, model, base_url, api_key):
-    for item in dataset:
-        item["goal"] = goal
-        item["eval_mode"] = eval_mode
-        item["model"] = model
-        item["model_base_url"] = base_url
-        item["model_api_key"] = api_key
-    return dataset
+def build_dataset(dataset, goal, eval_mode, model, base_url, api_key, as_dict=False):
+    """
+    Turn normalized samples into EntityTasks that share one RunContext.
+
+    as_dict=True yields EntityTask.to_dict() payloads instead: rollout
+    inputs of runner processes travel through the store server as JSON, so
+    they carry the per-sample fields and the context id, not the run config.
+    """
+    context = RunContext(goal, eval_mode, model, base_url, api_key)
+    from_sample = functools.partial(EntityTask.from_sample, context=context)
+
+    def to_task(item):
+        task = from_sample(item)
+        return task.to_dict() if as_dict else task
+    if isinstance(dataset, JsonlDataset):
+        return dataset.with_transform(to_task)
+    return [to_task(item) for item in dataset]
+
+
+def log_validation_report(prompt_template, val_ds, judge_batch_size=None):
+    """
+    Score a prompt on the whole validation set and log per-role metrics.
+
+    eval_mode: llm samples without gold are scored by the LLM judge,
+    judge_batch_size of them per request.
+    """
+    outputs = [predict(task, prompt_template) for task in val_ds]
+    report = score_batch(
+        outputs,
+        golds=[task.get("gold") for task in val_ds],
+        gold_structs=[task.get("gold_struct") for task in val_ds],
+    )
+    for line in report.format().splitlines():
+        log(line)
+
+    unlabeled = [
+        (task, output) for task, output in zip(val_ds, outputs)
+        if task.get("eval_mode") == "llm" and task.get("gold") is None and task.get("gold_struct") is None
+    ]
+    if unlabeled:
+        items = [(task["question"], task["entities"], output) for task, output in unlabeled]
+        scores = llm_judge_batch(items, unlabeled[0][0]["goal"], batch_size=judge_batch_size)
+        log(f"LLM judge: {sum(scores) / len(scores):.4f} mean over {len(scores)} samples without gold")
+    return report
 
 
 class PromptMonitor:
@@ -165,6 +227,35 @@ class PromptMonitor:
                 log(f"⚠️ [{minutes}m {seconds}s] Monitor error: {e}")
 
 
+def build_trainer(algo, prompt_template, n_runners=1, poll_interval=RUNNER_POLL_INTERVAL, server_port=None):
+    """
+    Trainer with `n_runners` rollout runners.
+
+    agentlightning keeps one active tracer per process, so runners cannot
+    share a process: one runner is a thread next to the algorithm (shm),
+    several are runner processes talking to the store over HTTP (cs, on
+    `server_port`, default AGL_SERVER_PORT or 4747).
+    """
+    # The algorithm owns the main thread, so runners stop as soon as it returns
+    if n_runners > 1:
+        strategy = ClientServerExecutionStrategy(
+            role="both", n_runners=n_runners, main_process="algorithm", server_port=server_port,
+        )
+    else:
+        strategy = SharedMemoryExecutionStrategy(n_runners=1, main_thread="algorithm")
+    return agl.Trainer(
+        algorithm=algo,
+        strategy=strategy,
+        runner={
+            "type": "agentlightning.LitAgentRunner",
+            "poll_interval": poll_interval,
+            "interval_jitter": poll_interval * 0.2,
+        },
+        initial_resources={"prompt_template": prompt_template},
+        adapter=agl.TraceToMessages(),
+    )
+
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--node", default="entity_filter")
@@ -177,6 +268,36 @@ def main():
                         help="APO branch_factor: new candidates per parent (default 4)")
     parser.add_argument("--monitor-interval", type=int, default=30, 
                         help="Seconds between prompt checks")
+    parser.add_argument("--val-report", action="store_true",
+                        help="After training, log per-role precision/recall and a role confusion matrix of the best prompt on the val set")
+    parser.add_argument("--async-rollout", action="store_true",
+                        help="Use the async rollout agent with a pooled, keep-alive client per runner loop")
+    selection = parser.add_mutually_exclusive_group()
+    selection.add_argument("--val-ci-width", type=float, default=None,
+                           help="Score candidates on the smallest stratified val subset whose CI is at most this wide")
+    selection.add_argument("--racing", action="store_true",
+                           help="Race candidates on growing val slices and drop those that cannot reach the beam")
+    parser.add_argument("--racing-min-samples", type=int, default=4,
+                        help="Val samples in the first racing slice; slices double up to the val batch")
+    parser.add_argument("--racing-confidence", type=float, default=0.9,
+                        help="Confidence of the Hoeffding bound used to eliminate candidates")
+    parser.add_argument("--judge-batch-size", type=int, default=None,
+                        help="Samples per LLM judge request in the validation report (default: node judge_batch_size or JUDGE_BATCH_SIZE)")
+    parser.add_argument("--runners", default=None,
+                        help="Rollout runners (processes when more than one), or 'auto' to size from LLM_RPM and the "
+                             "measured rollout latency (default: node n_runners or RUNNERS)")
+    parser.add_argument("--runner-poll-interval", type=float, default=RUNNER_POLL_INTERVAL,
+                        help="Seconds an idle runner waits before polling for new rollouts")
+    parser.add_argument("--hedge", action="store_true", default=LLM_HEDGE,
+                        help="Send a duplicate LLM request when one runs past the recent p95 latency; first answer wins")
+    parser.add_argument("--checkpoint", default=None,
+                        help="APO checkpoint file (default: .cache/checkpoints/<node>.json)")
+    parser.add_argument("--resume", action="store_true",
+                        help="Continue from the APO checkpoint instead of starting from the seed prompt")
+    parser.add_argument("--metrics-port", type=int, default=METRICS_PORT,
+                        help="Serve per-rollout metrics in Prometheus text format on 127.0.0.1:<port>/metrics (0 = off)")
+    parser.add_argument("--metrics-jsonl", default=None,
+                        help="Append one JSON line of metrics per rollout to this file")
     args = parser.parse_args()
 
     config_path = f"src/configs/nodes/{args.node}.yaml"
@@ -187,14 +308,35 @@ def main():
     log("Agent Trainer - Starting")
     log("=" * 60)
     
+    if args.metrics_jsonl:
+        telemetry.open_sink(args.metrics_jsonl)
+        log(f"Rollout metrics sink: {args.metrics_jsonl}")
+    if args.metrics_port:
+        telemetry.serve(args.metrics_port)
+        log(f"Rollout metrics: http://127.0.0.1:{args.metrics_port}/metrics")
+
     log(f"Loading config from: {config_path}")
     config = load_config(config_path)
     original_prompt = config.get("prompt_template", "")
+    judge_batch_size = args.judge_batch_size or config.get("judge_batch_size", JUDGE_BATCH_SIZE)
+    resilient_caller.configure(hedge=args.hedge)
+    log(f"LLM calls: {resilient_caller.attempts} attempts, rollout deadline {LLM_ROLLOUT_DEADLINE or 'off'}s, "
+        f"hedging {'on' if args.hedge else 'off'}")
    
     rollout_model_name = args.model or ROLLOUT_MODEL
     log(f"Rollout model: {rollout_model_name}")
     log(f"Optimizer model: {OPTIMIZER_MODEL}")
     
+    runners_spec = args.runners or config.get("n_runners", RUNNERS)
+    measured = observed_rollout_latency(args.metrics_jsonl or METRICS_JSONL_PATH)
+    n_runners, latency = plan_runners(runners_spec, LLM_RPM, measured)
+    if str(runners_spec).strip().lower() == "auto":
+        source = "measured" if measured else "ROLLOUT_LATENCY_HINT"
+        log(f"Runners sized for LLM_RPM={LLM_RPM} at {latency:.2f}s per rollout ({source})")
+    log(f"Runners: {n_runners} ({'processes' if n_runners > 1 else 'thread'}), poll interval {args.runner_poll_interval}s")
+    if n_runners > 1:
+        log("Runner processes keep their own response coalescing and telemetry; use --metrics-jsonl to collect rollout metrics")
+
     log(f"Loading training data from: {train_path}")
     train_data = load_jsonl(train_path)
     log(f"Loaded {len(train_data)} training samples")
@@ -210,6 +352,7 @@ def main():
         rollout_model_name,
         ROLLOUT_BASE_URL,
         ROLLOUT_API_KEY,
+        as_dict=n_runners > 1,
     )
     val_ds = build_dataset(
         val_data,
@@ -218,35 +361,50 @@ def main():
         rollout_model_name,
         ROLLOUT_BASE_URL,
         ROLLOUT_API_KEY,
+        as_dict=n_runners > 1,
     )
 
     # When rounds=1, beam has only the seed prompt; beam_width>1 causes APO to replicate it
     # and log "Duplicated beam index". Use beam_width=1 for single-round to avoid that.
     beam_width = args.beam_width if args.beam_width is not None else (1 if args.rounds == 1 else 4)
     log(f"Initializing APO algorithm: rounds={args.rounds}, beam_width={beam_width}, branch_factor={args.branch_factor}")
-    algo = agl.APO(
-        AsyncOpenAI(
-            api_key=OPTIMIZER_API_KEY,
-            base_url=OPTIMIZER_BASE_URL,
-            http_client=build_async_httpx_client(),
-        ),
+    checkpoint_path = args.checkpoint or os.path.join(".cache", "checkpoints", f"{args.node}.json")
+    log(f"APO checkpoint: {checkpoint_path}{' (resuming)' if args.resume else ''}")
+    apo_kwargs = dict(
+        checkpoint_path=checkpoint_path,
+        resume=args.resume,
         gradient_model=OPTIMIZER_MODEL,
         apply_edit_model=OPTIMIZER_MODEL,
         beam_rounds=args.rounds,
         beam_width=beam_width,
         branch_factor=args.branch_factor,
     )
+    # The optimizer draws from the same shared RPM/TPM budget as the rollouts
+    optimizer_client = client_registry.get_async_client(
+        OPTIMIZER_API_KEY,
+        OPTIMIZER_BASE_URL,
+        request_hooks=(limiter.httpx_request_hook,),
+        max_retries=openai.DEFAULT_MAX_RETRIES,
+    )
+    if args.val_ci_width is not None:
+        log(f"Stratified validation: CI width <= {args.val_ci_width}")
+        algo = StratifiedValAPO(optimizer_client, ci_width=args.val_ci_width, **apo_kwargs)
+    elif args.racing:
+        log(f"Racing candidate evaluation: min_samples={args.racing_min_samples}, confidence={args.racing_confidence}")
+        algo = RacingAPO(
+            optimizer_client,
+            min_samples=args.racing_min_samples,
+            confidence=args.racing_confidence,
+            **apo_kwargs,
+        )
+    else:
+        algo = ResumableAPO(optimizer_client, **apo_kwargs)
     
-    trainer = agl.Trainer(
-        algorithm=algo,
-        strategy="shm",
-        initial_resources={
-            "prompt_template": agl.PromptTemplate(
-                template=config["prompt_template"],
-                engine="f-string",
-            )
-        },
-        adapter=agl.TraceToMessages(),
+    trainer = build_trainer(
+        algo,
+        agl.PromptTemplate(template=config["prompt_template"], engine="f-string"),
+        n_runners=n_runners,
+        poll_interval=args.runner_poll_interval,
     )
 
     log(f"Starting training with {args.rounds} rounds...")
@@ -262,9 +420,12 @@ def main():
     )
     monitor.start()
     
+    agent = entity_filter_agent_async if args.async_rollout else entity_filter_agent
+    log(f"Rollout agent: {'async' if args.async_rollout else 'sync'}")
+
     try:
         trainer.fit(
-            agent=entity_filter_agent,
+            agent=agent,
             train_dataset=train_ds,
             val_dataset=val_ds,
         )
@@ -278,6 +439,19 @@ def main():
         log("=" * 60)
         log("Training session ended.")
         log(f"Total prompt versions saved: {monitor.save_count}")
+        log(f"LLM response cache: {response_cache.stats()}")
+        log(f"Score store: {score_store.stats()}")
+        for stats in getattr(algo, "val_stats", []):
+            log(f"Stratified validation round {stats['round']}: {stats['rollouts']}/{stats['full_rollouts']} rollouts")
+        for stats in getattr(algo, "racing_stats", []):
+            log(f"Racing round {stats['round']}: {stats['rollouts']}/{stats['full_rollouts']} rollouts, "
+                f"saved {stats['saved']}, eliminated {stats['eliminated']}/{stats['candidates']} candidates")
+        for name, stats in telemetry.summary().items():
+            log(f"Rollout {name}: n={stats['count']} mean={stats['mean']:.3f} p50<={stats['p50']} p95<={stats['p95']}")
+        for label, stats in client_registry.metrics().items():
+            log(f"LLM client [{label}]: {stats}")
+        log(f"LLM call resilience: {resilient_caller.stats()}")
+        log(f"LLM call coalescing: {single_flight.stats()}")
         
         # Final save attempt
         try:
@@ -293,6 +467,10 @@ def main():
                 log("-" * 40)
                 print(best_prompt.template)
                 log("-" * 40)
+
+                if args.val_report:
+                    log("VALIDATION REPORT (best prompt):")
+                    log_validation_report(best_prompt, val_ds, judge_batch_size)
         except Exception as e:
             log(f"⚠️ Could not retrieve final best prompt: {e}")
 